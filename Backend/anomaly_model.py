@@ -1,78 +1,45 @@
 import os
-import joblib
 import numpy as np
 import pandas as pd
-from functools import lru_cache
-from influxdb_client import InfluxDBClient
-import json
+import influx_pool
+from influx_pool import INFLUXDB_BUCKET
+from model_registry import ModelRegistry
+from range_table import RangeTable, normalize, SEVERITY_LABELS, SEVERITY_WARNING
 
-# ───────────────────────── Load Normal Range JSON ─────────────────────────
-with open(os.path.join(os.path.dirname(__file__), "normal_ranges.json")) as f:
-    NORMAL_RANGES = json.load(f)
+FEATURES = [
+    "rpm",
+    "engine_load",
+    "throttle_pos",
+    "long_fuel_trim_1",
+    "coolant_temp",
+    "elm_voltage",
+]
 
-def normalize(text):
-    return str(text).strip().lower().replace(" ", "_")
+# ───────────────────────── Load Normal Range JSON ─────────────────────────
+RANGE_TABLE = RangeTable.from_json(
+    os.path.join(os.path.dirname(__file__), "normal_ranges.json"), FEATURES
+)
 
 def classify_value(feature, value, brand, model):
-    try:
-        brand = normalize(brand)
-        model = normalize(model)
-        ranges = NORMAL_RANGES[brand][model][feature]
-
-        if value <= ranges["critical_min"] or value >= ranges["critical_max"]:
-            return "critical"
-        elif value <= ranges["warning_min"] or value >= ranges["warning_max"]:
-            return "warning"
-        else:
-            return "normal"
-    except Exception as e:
-        print(f"[classify_value] ⚠️ Missing reference or error for {brand} → {model} → {feature} → {e}")
-        return "unknown"
+    return RANGE_TABLE.classify_value(feature, value, brand, model)
 
 def compute_severity_score(feature, value, brand, model):
-    try:
-        brand = normalize(brand)
-        model = normalize(model)
-        ranges = NORMAL_RANGES[brand][model][feature]
-
-        normal_min = ranges["warning_min"]
-        normal_max = ranges["warning_max"]
-        critical_min = ranges["critical_min"]
-        critical_max = ranges["critical_max"]
-
-        if normal_min <= value <= normal_max:
-            return 0
-
-        if value < normal_min:
-            score = (normal_min - value) / (normal_min - critical_min)
-        elif value > normal_max:
-            score = (value - normal_max) / (critical_max - normal_max)
-        else:
-            score = 0
-
-        return int(min(max(score * 100, 0), 100))
-
-    except Exception as e:
-        print(f"[severity_score] ⚠️ Cannot compute severity score for {feature}: {e}")
-        return -1
+    return RANGE_TABLE.severity_score(feature, value, brand, model)
 
-# ───────────────────────── InfluxDB Config ─────────────────────────
-# InfluxDB settings - update these with your real values
-INFLUXDB_URL = os.getenv("INFLUX_URL")
-INFLUXDB_TOKEN = os.getenv("INFLUX_TOKEN")
-INFLUXDB_ORG = os.getenv("INFLUX_ORG")
-INFLUXDB_BUCKET = os.getenv("INFLUX_BUCKET")
+def classify_matrix(X, brand, model):
+    """Batched classify_value/compute_severity_score over a (rows, FEATURES) matrix."""
+    return RANGE_TABLE.classify(X, brand, model)
 
+# ───────────────────────── Config ─────────────────────────
 MODEL_BASE_DIR = "models"
 
-FEATURES = [
-    "rpm",
-    "engine_load",
-    "throttle_pos",
-    "long_fuel_trim_1",
-    "coolant_temp",
-    "elm_voltage",
-]
+WINDOW_ROWS = 500      # most recent rows scored per prediction
+MIN_WINDOW_ROWS = 30   # below this a window is "Not enough data"
+
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", 50_000))          # rows parsed per read_csv chunk
+CSV_MAX_ROW_ANOMALIES = int(os.getenv("CSV_MAX_ROW_ANOMALIES", 500))  # detailed rows kept per upload
+CSV_TIME_COLUMNS = ("_time", "time", "timestamp")
+CSV_NA_VALUES = ["None", "null", "NO DATA", "-"]
 
 SENSOR_SUGGESTIONS = {
     "rpm": ("Engine revolutions per minute.",
@@ -95,51 +62,132 @@ SENSOR_SUGGESTIONS = {
                     "Voltage too low – weak battery, alternator problem, or electrical drain."),
 }
 
-@lru_cache(maxsize=None)
+# Bounded LRU of loaded bundles that picks up retrained files (see model_registry.py)
+MODEL_REGISTRY = ModelRegistry(MODEL_BASE_DIR)
+
 def _load_model(brand: str, moto_id: str, mode="idle"):
-    brand = normalize(brand)
-    path = os.path.join(MODEL_BASE_DIR, brand, f"{mode}_{moto_id}.pkl")
-    if not os.path.exists(path):
-        raise FileNotFoundError(path)
-    bundle = joblib.load(path)
-    if not {"model", "scaler"} <= bundle.keys():
-        raise ValueError(f"{path} missing model/scaler keys")
-    return bundle["model"], bundle["scaler"]
+    return MODEL_REGISTRY.get(brand, moto_id, mode)
+
+def _get_active_motorcycle_ids(hours: int = 24) -> list:
+    flux = f"""
+    import "influxdata/influxdb/schema"
+
+    schema.tagValues(
+        bucket: "{INFLUXDB_BUCKET}",
+        tag: "motorcycle_id",
+        predicate: (r) => r._measurement == "obd_data",
+        start: -{int(hours)}h
+    )
+    """
+    try:
+        df = influx_pool.query_data_frame(flux)
+    except Exception as e:
+        print(f"[ERROR] Flux query failed in _get_active_motorcycle_ids: {e}")
+        return []
+    if df.empty:
+        return []
+    return [str(m) for m in df["_value"].dropna().unique()]
 
-def _get_window_df(motorcycle_id: str, minutes: int = 30) -> pd.DataFrame:
-    sql = f"""
-    SELECT *
-    FROM "obd_data"
-    WHERE
-        time >= now() - interval '{minutes} minutes'
-        AND "motorcycle_id" = '{motorcycle_id}'
-        AND (
-            "rpm" IS NOT NULL OR
-            "engine_load" IS NOT NULL OR
-            "throttle_pos" IS NOT NULL OR
-            "long_fuel_trim_1" IS NOT NULL OR
-            "coolant_temp" IS NOT NULL OR
-            "elm_voltage" IS NOT NULL
-        )
-    ORDER BY time DESC
-    LIMIT 500
+def preload_models(hours: int = 24, mode="idle") -> int:
+    """Load the models of every bike that sent data in the last `hours`."""
+    ids = _get_active_motorcycle_ids(hours)
+    loaded = MODEL_REGISTRY.preload(ids, mode)
+    print(f"[INFO] Preloaded {loaded} model(s) for {len(ids)} active motorcycle(s)")
+    return loaded
+
+def _column_mean(df: pd.DataFrame, feature: str) -> float:
+    try:
+        return float(df[feature].mean())
+    except:
+        return 0.0
+
+# Pivoted to one row per timestamp (so duplicates collapse and every row has
+# at least one feature), trimmed to the newest WINDOW_ROWS and sorted oldest
+# first by InfluxDB; pandas only fixes the dtypes
+FIELD_FILTER = " or\n          ".join(f'r._field == "{f}"' for f in FEATURES)
+
+def _window_flux(motorcycle_filter: str, minutes: int) -> str:
+    return f"""
+    from(bucket: "{INFLUXDB_BUCKET}")
+      |> range(start: -{int(minutes)}m)
+      |> filter(fn: (r) => r._measurement == "obd_data")
+      |> filter(fn: (r) => {motorcycle_filter})
+      |> filter(fn: (r) =>
+          {FIELD_FILTER})
+      |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+      |> sort(columns: ["_time"])
+      |> tail(n: {WINDOW_ROWS})
+      |> keep(columns: ["motorcycle_id", "_time", {", ".join(f'"{f}"' for f in FEATURES)}])
     """
 
+def window_flux(motorcycle_id: str, minutes: int = 30) -> str:
+    """The window query of one bike, for callers that run it on their own client."""
+    return _window_flux(f'r.motorcycle_id == "{motorcycle_id}"', minutes)
+
+def _clean_window_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Rows arrive unique and oldest first; a feature the bike never sent is all NaN."""
+    df = df.reindex(columns=["_time"] + FEATURES)
+    df = df.astype({f: np.float64 for f in FEATURES}, copy=False)
+    return df.reset_index(drop=True)
+
+def _get_window_df(motorcycle_id: str, minutes: int = 30) -> pd.DataFrame:
+    flux = window_flux(motorcycle_id, minutes)
+
     try:
-        client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-        df = client.query_api().query_data_frame_sql(query=sql, database=INFLUXDB_BUCKET)
-        client.close()
+        df = influx_pool.query_data_frame(flux)
     except Exception as e:
-        print(f"[ERROR] SQL query failed in _get_window_df: {e}")
+        print(f"[ERROR] Flux query failed in _get_window_df: {e}")
         return pd.DataFrame()
 
     if df.empty:
         return pd.DataFrame()
 
-    df = df.dropna(subset=FEATURES, how='all')
-    df = df.drop_duplicates()
-    df = df.sort_values(by="time").reset_index(drop=True)
-    return df
+    return _clean_window_df(df)
+
+def _get_windows_df(motorcycle_ids, minutes: int = 30) -> dict:
+    """
+    Fetch the latest WINDOW_ROWS rows for many motorcycles in a single query.
+    Returns {motorcycle_id: cleaned window DataFrame}; bikes without data are absent.
+    """
+    if not motorcycle_ids:
+        return {}
+    # One table per bike after the pivot, so tail() trims each bike separately
+    id_filter = " or ".join(f'r.motorcycle_id == "{m}"' for m in motorcycle_ids)
+    flux = _window_flux(id_filter, minutes)
+
+    try:
+        df = influx_pool.query_data_frame(flux)
+    except Exception as e:
+        print(f"[ERROR] Flux query failed in _get_windows_df: {e}")
+        return {}
+
+    if df.empty:
+        return {}
+
+    return {
+        str(moto_id): _clean_window_df(group)
+        for moto_id, group in df.groupby("motorcycle_id", sort=False)
+    }
+
+def _drop_zero_rows(df: pd.DataFrame) -> pd.DataFrame:
+    return df[(df[FEATURES] != 0).any(axis=1)]
+
+def _aggregate_features(X_scaled: np.ndarray) -> np.ndarray:
+    """mean/std/max/min of each scaled feature → (1, 24) model input."""
+    return np.hstack([
+        np.mean(X_scaled, axis=0),
+        np.std(X_scaled, axis=0),
+        np.max(X_scaled, axis=0),
+        np.min(X_scaled, axis=0)
+    ]).reshape(1, -1)
+
+def _not_enough_data(motorcycle_id: str) -> dict:
+    return {
+        "status": "ok",
+        "motorcycle_id": motorcycle_id,
+        "message": "Not enough data",
+        "explanations": []
+    }
 
 
 def detect_anomalies(motorcycle_id: str, brand: str, model: str, mode="idle", minutes=30):
@@ -153,135 +201,367 @@ def detect_anomalies(motorcycle_id: str, brand: str, model: str, mode="idle", mi
         df = _get_window_df(motorcycle_id, minutes)
         print(f"[DEBUG] Raw data rows from InfluxDB: {len(df)}")
 
-        # Step 2: Clean data — remove rows where all feature values are 0
-        df = df[(df[FEATURES] != 0).any(axis=1)]
-        print(f"[DEBUG] Rows after removing all-zero rows: {len(df)}")
+        return _detect_window(motorcycle_id, brand, model, df, mode)
 
-        # Step 3: Check if we have enough data to continue
-        if df.empty or len(df) < 30:
-            print("[WARN] Not enough data to analyze.")
-            return {
-                "status": "ok",
-                "motorcycle_id": motorcycle_id,
-                "message": "Not enough data",
-                "explanations": []
-            }
-
-        # Step 4: Load model and scale data
-        model_obj, scaler = _load_model(brand, motorcycle_id, mode)
-        X_scaled = scaler.transform(df[FEATURES].values)
-        print(f"[DEBUG] Scaled input shape: {X_scaled.shape}")
-
-        # Step 5: Aggregate features for prediction
-        agg_features = np.hstack([
-            np.mean(X_scaled, axis=0),
-            np.std(X_scaled, axis=0),
-            np.max(X_scaled, axis=0),
-            np.min(X_scaled, axis=0)
-        ]).reshape(1, -1)
-        print(f"[DEBUG] Aggregated features shape: {agg_features.shape}")
-
-        # Step 6: Make prediction
-        pred = model_obj.predict(agg_features)
-        is_anomaly = (pred[0] == -1)
-        print(f"[RESULT] Model Prediction: {'Anomaly' if is_anomaly else 'Normal'}")
-
-        # Step 7: Interpret sensor values
-        explanations = []
-        abnormal_features = []
-
-        for f in FEATURES:
-            try:
-                mean_value = float(df[f].mean())
-            except:
-                mean_value = 0.0
+    except Exception as e:
+        print(f"[ERROR] detect_anomalies failed: {e}")
+        return {"status": "error", "motorcycle_id": motorcycle_id, "error": str(e)}
+
+
+def detect_anomalies_in_window(motorcycle_id: str, brand: str, model: str, df: pd.DataFrame, mode="idle"):
+    """
+    detect_anomalies() on a window_flux() result the caller fetched itself
+    (the async server queries InfluxDB on its own client and only scores here).
+    """
+    try:
+        print(f"\n[INFO] Detecting anomalies for Motorcycle ID: {motorcycle_id}, Brand: {brand}, Model: {model}, Mode: {mode}")
+        df = pd.DataFrame() if df.empty else _clean_window_df(df)
+        print(f"[DEBUG] Raw data rows from InfluxDB: {len(df)}")
+        return _detect_window(motorcycle_id, normalize(brand), normalize(model), df, mode)
 
-            severity = classify_value(f, mean_value, brand, model)
-            severity_score = compute_severity_score(f, mean_value, brand, model)
-            desc, high_tip, low_tip = SENSOR_SUGGESTIONS.get(f, ("", "", ""))
+    except Exception as e:
+        print(f"[ERROR] detect_anomalies failed: {e}")
+        return {"status": "error", "motorcycle_id": motorcycle_id, "error": str(e)}
 
+
+def detect_anomalies_from_frame(motorcycle_id: str, brand: str, model: str, df: pd.DataFrame, mode="idle"):
+    """
+    detect_anomalies() on caller-supplied rows (FEATURES columns, optional
+    `_time`) instead of the latest InfluxDB window. The frame is scored as
+    one window; use detect_anomalies_from_csv for long logs.
+    """
+    try:
+        print(f"\n[INFO] Detecting anomalies from {len(df)} supplied rows for Motorcycle ID: {motorcycle_id}")
+        missing = [f for f in FEATURES if f not in df.columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        df = df.copy()
+        df[FEATURES] = df[FEATURES].apply(pd.to_numeric, errors="coerce").astype(np.float64)
+        df = df.dropna(subset=FEATURES).reset_index(drop=True)
+        if "_time" not in df.columns:
+            df["_time"] = None
+        return _detect_window(motorcycle_id, normalize(brand), normalize(model), df, mode)
+
+    except Exception as e:
+        print(f"[ERROR] detect_anomalies_from_frame failed: {e}")
+        return {"status": "error", "motorcycle_id": motorcycle_id, "error": str(e)}
+
+
+def _detect_window(motorcycle_id: str, brand: str, model: str, df: pd.DataFrame, mode="idle"):
+    """Steps 2–9 on one fetched or supplied window (brand/model already normalized)."""
+    # Step 2: Clean data — remove rows where all feature values are 0
+    df = _drop_zero_rows(df)
+    print(f"[DEBUG] Rows after removing all-zero rows: {len(df)}")
+
+    # Step 3: Check if we have enough data to continue
+    if df.empty or len(df) < MIN_WINDOW_ROWS:
+        print("[WARN] Not enough data to analyze.")
+        return _not_enough_data(motorcycle_id)
+
+    # Step 4: Load model and scale data
+    model_obj, scaler = _load_model(brand, motorcycle_id, mode)
+    X_scaled = scaler.transform(df[FEATURES].values)
+    print(f"[DEBUG] Scaled input shape: {X_scaled.shape}")
+
+    # Step 5: Aggregate features for prediction
+    agg_features = _aggregate_features(X_scaled)
+    print(f"[DEBUG] Aggregated features shape: {agg_features.shape}")
+
+    # Step 6: Make prediction
+    pred = model_obj.predict(agg_features)
+    is_anomaly = (pred[0] == -1)
+    print(f"[RESULT] Model Prediction: {'Anomaly' if is_anomaly else 'Normal'}")
+
+    return _interpret_window(motorcycle_id, brand, model, df, is_anomaly)
+
+
+def detect_anomalies_batch(bikes, mode="idle", minutes=30):
+    """
+    Score many motorcycles at once. `bikes` is a list of (motorcycle_id, brand, model).
+    All windows come from one InfluxDB query, and bikes sharing a loaded model are
+    predicted in a single stacked call. Results are returned in input order.
+    """
+    bikes = [(str(m), normalize(b), normalize(mo)) for m, b, mo in bikes]
+    print(f"\n[INFO] Batch detecting anomalies for {len(bikes)} motorcycles, Mode: {mode}")
+
+    windows = _get_windows_df(sorted({m for m, _, _ in bikes}), minutes)
+    print(f"[DEBUG] Windows fetched from InfluxDB: {len(windows)}")
+
+    results = [None] * len(bikes)
+    pending = {}  # id(model_obj) → (model_obj, [(index, df, agg_features)])
+
+    for i, (motorcycle_id, brand, model) in enumerate(bikes):
+        try:
+            df = windows.get(motorcycle_id)
+            if df is None or df.empty:
+                results[i] = _not_enough_data(motorcycle_id)
+                continue
+            df = _drop_zero_rows(df)
+            if len(df) < MIN_WINDOW_ROWS:
+                results[i] = _not_enough_data(motorcycle_id)
+                continue
+
+            model_obj, scaler = _load_model(brand, motorcycle_id, mode)
+            agg_features = _aggregate_features(scaler.transform(df[FEATURES].values))
+            pending.setdefault(id(model_obj), (model_obj, []))[1].append((i, df, agg_features))
+        except Exception as e:
+            print(f"[ERROR] Batch preparation failed for {motorcycle_id}: {e}")
+            results[i] = {"status": "error", "motorcycle_id": motorcycle_id, "error": str(e)}
+
+    for model_obj, items in pending.values():
+        try:
+            preds = model_obj.predict(np.vstack([agg for _, _, agg in items]))
+        except Exception as e:
+            print(f"[ERROR] Batch prediction failed: {e}")
+            for i, _, _ in items:
+                results[i] = {"status": "error", "motorcycle_id": bikes[i][0], "error": str(e)}
+            continue
+
+        for (i, df, _), pred in zip(items, preds):
+            motorcycle_id, brand, model = bikes[i]
             try:
-                if f == "long_fuel_trim_1":
-                    is_high = mean_value > 0
-                else:
-                    r = NORMAL_RANGES[brand][model][f]
-                    midpoint = (r["warning_min"] + r["warning_max"]) / 2
-                    is_high = mean_value > midpoint
-            except:
-                is_high = True
-
-            if severity != "normal":
-                abnormal_features.append(f)
-
-            tip_base = high_tip if is_high else low_tip
-
-            if severity == "critical":
-                level = "High" if is_high else "Low"
-                tip = f"🔴 CRITICAL ({level}): {tip_base} Please consult a mechanic immediately."
-            elif severity == "warning":
-                level = "High" if is_high else "Low"
-                tip = f"🟡 WARNING ({level}): {tip_base} Monitor this and schedule maintenance."
-            elif severity == "normal":
-                tip = "🟢 Normal: Sensor reading is within expected range."
-            else:
-                tip = "⚠️ Unknown: No reference range found."
-
-            explanations.append({
-                "feature": f,
-                "status": severity,
-                "value": round(mean_value, 2),
-                "severity_score": severity_score,
-                "description": desc,
-                "tip": tip
+                results[i] = _interpret_window(motorcycle_id, brand, model, df, pred == -1)
+            except Exception as e:
+                print(f"[ERROR] Batch interpretation failed for {motorcycle_id}: {e}")
+                results[i] = {"status": "error", "motorcycle_id": motorcycle_id, "error": str(e)}
+
+    return results
+
+
+def _interpret_window(motorcycle_id: str, brand: str, model: str, df: pd.DataFrame, is_anomaly) -> dict:
+    """Steps 7–9: range-based explanations, row-level anomalies and final suggestion."""
+    # Step 7: Interpret sensor values
+    mean_values = np.array([_column_mean(df, f) for f in FEATURES])
+    explanations, abnormal_features = _explain_means(mean_values, brand, model)
+
+    # Step 8: Row-level anomalies (vectorized over the whole window)
+    row_anomalies = _row_anomalies(df, brand, model)
+    anomaly_percent = (len(row_anomalies) / len(df)) * 100
+
+    # Step 9: Final message
+    suggestion = _suggestion(explanations, is_anomaly)
+
+    print(f"[SUMMARY] {len(row_anomalies)} row anomalies found ({anomaly_percent:.2f}% of data)")
+    print(f"[SUMMARY] Abnormal features: {abnormal_features}")
+    print(f"[SUGGESTION] {suggestion}")
+
+    return {
+        "status": "ok",
+        "motorcycle_id": motorcycle_id,
+        "anomalies_detected": len(row_anomalies),
+        "anomaly_percent": round(anomaly_percent, 2),
+        "abnormal_features": abnormal_features,
+        "explanations": explanations,
+        "row_anomalies": row_anomalies,
+        "suggestion": suggestion
+    }
+
+def _explain_means(mean_values: np.ndarray, brand: str, model: str):
+    """Per-feature explanation of the window means → (explanations, abnormal_features)."""
+    explanations = []
+    abnormal_features = []
+
+    ranges = RANGE_TABLE.lookup(brand, model)
+    mean_codes, mean_scores = RANGE_TABLE.classify(mean_values.reshape(1, -1), brand, model)
+    mean_is_high = ranges.is_high(mean_values)
+
+    for j, f in enumerate(FEATURES):
+        mean_value = float(mean_values[j])
+        severity = SEVERITY_LABELS[mean_codes[0, j]]
+        severity_score = int(mean_scores[0, j])
+        desc, high_tip, low_tip = SENSOR_SUGGESTIONS.get(f, ("", "", ""))
+        is_high = bool(mean_is_high[j])
+
+        if severity != "normal":
+            abnormal_features.append(f)
+
+        tip_base = high_tip if is_high else low_tip
+
+        if severity == "critical":
+            level = "High" if is_high else "Low"
+            tip = f"🔴 CRITICAL ({level}): {tip_base} Please consult a mechanic immediately."
+        elif severity == "warning":
+            level = "High" if is_high else "Low"
+            tip = f"🟡 WARNING ({level}): {tip_base} Monitor this and schedule maintenance."
+        elif severity == "normal":
+            tip = "🟢 Normal: Sensor reading is within expected range."
+        else:
+            tip = "⚠️ Unknown: No reference range found."
+
+        explanations.append({
+            "feature": f,
+            "status": severity,
+            "value": round(mean_value, 2),
+            "severity_score": severity_score,
+            "description": desc,
+            "tip": tip
+        })
+    return explanations, abnormal_features
+
+def _row_anomalies(df: pd.DataFrame, brand: str, model: str) -> list:
+    """Rows with a warning/critical feature, in window order."""
+    X = df[FEATURES].to_numpy(dtype=float)
+    codes, _ = classify_matrix(X, brand, model)
+    flagged = codes >= SEVERITY_WARNING
+
+    row_anomalies = []
+    flagged_rows = np.flatnonzero(flagged.any(axis=1))
+    if len(flagged_rows):
+        index_labels = df.index.tolist()
+        times = df["_time"]
+        for r in flagged_rows:
+            values = {f: float(X[r, j]) for j, f in enumerate(FEATURES)}
+            row_anomalies.append({
+                "row_index": index_labels[r],
+                "time": times.iloc[r],
+                "issues": [
+                    f"{f}={X[r, j]:.2f} → {SEVERITY_LABELS[codes[r, j]]}"
+                    for j, f in enumerate(FEATURES) if flagged[r, j]
+                ],
+                "values": {**values, "_time": times.iloc[r]},
+                "severity": {f: SEVERITY_LABELS[codes[r, j]] for j, f in enumerate(FEATURES)}
             })
+    return row_anomalies
+
+def _suggestion(explanations: list, is_anomaly) -> str:
+    if any(e["status"] == "critical" for e in explanations):
+        suggestion = "⚠️ Critical values detected. Please see a mechanic immediately."
+    elif any(e["status"] == "warning" for e in explanations):
+        suggestion = "🛠️ Warning detected. Maintenance check recommended."
+    elif is_anomaly:
+        suggestion = "⚠️ ML pattern anomaly detected. Observe or consult a mechanic if needed."
+    else:
+        suggestion = "✅ All systems within normal range."
+    return suggestion
+
+# ───────────────────────── Uploaded Ride Logs ─────────────────────────
+def read_feature_csv(source, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Parse a CSV (path or file object) in chunks of `chunk_rows` rows, keeping
+    only FEATURES as float64 and an optional time column (as `_time`). Cells
+    that are not numbers become NaN; rows with a missing feature or all
+    features 0 are dropped. The index is the data row number in the file.
+    """
+    reader = pd.read_csv(
+        source,
+        usecols=lambda c: c in FEATURES or c in CSV_TIME_COLUMNS,
+        dtype={c: str for c in CSV_TIME_COLUMNS},
+        na_values=CSV_NA_VALUES,
+        chunksize=chunk_rows
+    )
+    with reader:
+        for chunk in reader:
+            missing = [f for f in FEATURES if f not in chunk.columns]
+            if missing:
+                raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+            time_col = next((c for c in CSV_TIME_COLUMNS if c in chunk.columns), None)
+            chunk = chunk.rename(columns={time_col: "_time"}) if time_col else chunk.assign(_time=None)
+            chunk = chunk[["_time", *FEATURES]]
+            # Coerced per chunk, so one odd cell drops its row instead of the upload
+            chunk[FEATURES] = chunk[FEATURES].apply(pd.to_numeric, errors="coerce").astype(np.float64)
+            yield _drop_zero_rows(chunk.dropna(subset=FEATURES))
+
+def _iter_windows(chunks, window_rows):
+    """Consecutive windows of `window_rows` rows across chunk boundaries (last one may be shorter)."""
+    pending = None
+    for chunk in chunks:
+        pending = chunk if pending is None else pd.concat([pending, chunk])
+        while len(pending) >= window_rows:
+            yield pending.iloc[:window_rows]
+            pending = pending.iloc[window_rows:]
+    if pending is not None and len(pending):
+        yield pending
+
+def detect_anomalies_from_csv(motorcycle_id: str, brand: str, model: str, source, mode="idle",
+                              window_rows=WINDOW_ROWS, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Score a ride log of any length in bounded memory. The CSV is parsed in
+    chunks and cut into consecutive windows of `window_rows` rows, each
+    scored like one live window (a shorter tail below MIN_WINDOW_ROWS only
+    counts towards the means). Returns the detect_anomalies() fields for the
+    whole log, with at most CSV_MAX_ROW_ANOMALIES detailed rows, plus one
+    summary per window.
+    """
+    try:
+        print(f"\n[INFO] Detecting anomalies from CSV for Motorcycle ID: {motorcycle_id}, Brand: {brand}, Model: {model}")
+        brand = normalize(brand)
+        model = normalize(model)
+        model_obj, scaler = _load_model(brand, motorcycle_id, mode)
 
-        # Step 8: Row-level anomalies
+        rows = 0
+        flagged_total = 0
+        sums = np.zeros(len(FEATURES))
         row_anomalies = []
-        for i, row in df.iterrows():
-            issues = []
-            for f in FEATURES:
-                v = row[f]
-                sev = classify_value(f, v, brand, model)
-                if sev in ["critical", "warning"]:
-                    issues.append(f"{f}={v:.2f} → {sev}")
-            if issues:
-                row_anomalies.append({
-                    "row_index": i,
-                    "time": row["_time"],
-                    "issues": issues,
-                    "values": {**{f: row[f] for f in FEATURES}, "_time": row["_time"]},
-                    "severity": {f: classify_value(f, row[f], brand, model) for f in FEATURES}
-                })
-
-        anomaly_percent = (len(row_anomalies) / len(df)) * 100
-
-        # Step 9: Final message
-        if any(e["status"] == "critical" for e in explanations):
-            suggestion = "⚠️ Critical values detected. Please see a mechanic immediately."
-        elif any(e["status"] == "warning" for e in explanations):
-            suggestion = "🛠️ Warning detected. Maintenance check recommended."
-        elif is_anomaly:
-            suggestion = "⚠️ ML pattern anomaly detected. Observe or consult a mechanic if needed."
-        else:
-            suggestion = "✅ All systems within normal range."
+        windows, aggregates, window_means = [], [], []
+
+        for window in _iter_windows(read_feature_csv(source, chunk_rows), window_rows):
+            X = window[FEATURES].to_numpy()
+            rows += len(X)
+            sums += X.sum(axis=0)
+
+            codes, _ = classify_matrix(X, brand, model)
+            flagged_rows = np.flatnonzero((codes >= SEVERITY_WARNING).any(axis=1))
+            flagged_total += len(flagged_rows)
+            room = CSV_MAX_ROW_ANOMALIES - len(row_anomalies)
+            if room > 0 and len(flagged_rows):
+                row_anomalies += _row_anomalies(window.iloc[flagged_rows[:room]], brand, model)
+
+            if len(X) < MIN_WINDOW_ROWS:
+                continue
+            aggregates.append(_aggregate_features(scaler.transform(X)))
+            window_means.append(X.mean(axis=0))
+            windows.append({
+                "window": len(windows),
+                "first_row": int(window.index[0]),
+                "last_row": int(window.index[-1]),
+                "start_time": window["_time"].iloc[0],
+                "end_time": window["_time"].iloc[-1],
+                "rows": len(X),
+                "row_anomalies": int(len(flagged_rows))
+            })
 
-        print(f"[SUMMARY] {len(row_anomalies)} row anomalies found ({anomaly_percent:.2f}% of data)")
-        print(f"[SUMMARY] Abnormal features: {abnormal_features}")
+        print(f"[DEBUG] Clean rows: {rows}, windows scored: {len(windows)}")
+        if not windows:
+            print("[WARN] Not enough data to analyze.")
+            return _not_enough_data(motorcycle_id)
+
+        # One stacked model call for every window of the log
+        agg = np.vstack(aggregates)
+        preds = model_obj.predict(agg)
+        scores = model_obj.decision_function(agg)
+        mean_codes, _ = RANGE_TABLE.classify(np.vstack(window_means), brand, model)
+        for w, pred, score, codes in zip(windows, preds, scores, mean_codes):
+            w["anomaly"] = bool(pred == -1)
+            w["score"] = round(float(score), 4)
+            w["abnormal_features"] = [f for j, f in enumerate(FEATURES) if codes[j] >= SEVERITY_WARNING]
+
+        anomalous_windows = int((preds == -1).sum())
+        explanations, abnormal_features = _explain_means(sums / rows, brand, model)
+        suggestion = _suggestion(explanations, anomalous_windows > 0)
+        anomaly_percent = flagged_total / rows * 100
+
+        print(f"[SUMMARY] {anomalous_windows}/{len(windows)} windows anomalous, "
+              f"{flagged_total} row anomalies ({anomaly_percent:.2f}% of data)")
         print(f"[SUGGESTION] {suggestion}")
 
         return {
             "status": "ok",
             "motorcycle_id": motorcycle_id,
-            "anomalies_detected": len(row_anomalies),
+            "rows": rows,
+            "windows_scored": len(windows),
+            "anomalous_windows": anomalous_windows,
+            "anomalies_detected": flagged_total,
             "anomaly_percent": round(anomaly_percent, 2),
             "abnormal_features": abnormal_features,
             "explanations": explanations,
             "row_anomalies": row_anomalies,
-            "suggestion": suggestion
+            "row_anomalies_truncated": flagged_total > len(row_anomalies),
+            "suggestion": suggestion,
+            "windows": windows
         }
 
     except Exception as e:
-        print(f"[ERROR] detect_anomalies failed: {e}")
+        print(f"[ERROR] detect_anomalies_from_csv failed: {e}")
         return {"status": "error", "motorcycle_id": motorcycle_id, "error": str(e)}
 
 if __name__ == "__main__":
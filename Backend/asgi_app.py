@@ -0,0 +1,238 @@
+"""
+asgi_app.py
+───────────
+Async serving mode for the dashboard read APIs:
+
+    POST /predict   POST /recent-data   GET /reports/daily   GET /reports/weekly
+
+Same parameters and response schemas as server.py, served from one event
+loop so hundreds of concurrent dashboard requests need no thread each:
+
+  • Every Flux query (the /recent-data rows, the /predict window, the
+    report rollup buckets) runs on InfluxDBClientAsync; a request waiting on
+    InfluxDB only holds a coroutine.
+  • Only CPU work leaves the loop: model scoring, row shaping and report
+    folding run on a bounded thread pool (ASGI_EXECUTOR_WORKERS).
+  • Predictions are coalesced and cached like in server.py, and reports
+    come from this process' own rollup cache, both awaiting their queries.
+
+MQTT, the OBD subprocess and training stay in server.py. Run this next to it:
+
+    hypercorn asgi_app:app --bind 0.0.0.0:5001
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+import pandas as pd
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+
+from anomaly_model import MODEL_REGISTRY, detect_anomalies_in_window, window_flux
+from influx_pool import INFLUX_TIMEOUT_MS, INFLUXDB_ORG, INFLUXDB_TOKEN, INFLUXDB_URL, pool_stats
+from influx_query import (DOWNSAMPLE_METHODS, FORMATS, encode_msgpack, get_recent_columnar, get_recent_data,
+                          page_filled, parse_cursor, recent_data_flux, stream_json, stream_ndjson)
+from prediction_cache import PredictionCache
+from report_api import BUCKETS, FEATURES, build_report, rollup_buckets_flux
+from report_cache import RollupCache
+
+ASGI_EXECUTOR_WORKERS = int(os.getenv("ASGI_EXECUTOR_WORKERS", 16))
+ASGI_INFLUX_CONNECTIONS = int(os.getenv("ASGI_INFLUX_CONNECTIONS", 100))
+
+app = cors(Quart(__name__))
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_EXECUTOR_WORKERS, thread_name_prefix="asgi-blocking")
+_influx = None
+
+# Only touched from the event loop thread, so no lock
+_stats = {"flux_queries": 0, "flux_errors": 0, "flux_ms_total": 0.0, "flux_ms_max": 0.0,
+          "blocking_calls": 0, "blocking_in_flight": 0}
+
+# ───── Lifecycle ─────
+@app.before_serving
+async def open_influx():
+    # The async client must be created inside the running loop
+    global _influx
+    _influx = InfluxDBClientAsync(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG,
+                                  timeout=INFLUX_TIMEOUT_MS, connection_pool_maxsize=ASGI_INFLUX_CONNECTIONS)
+
+@app.after_serving
+async def close_influx():
+    if _influx is not None:
+        await _influx.close()
+    _executor.shutdown(wait=False)
+
+# ───── Helpers ─────
+async def run_blocking(fn, *args, **kwargs):
+    """Run CPU-bound work (model scoring, row shaping, report folding) on the bounded thread pool."""
+    _stats["blocking_calls"] += 1
+    _stats["blocking_in_flight"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, partial(fn, *args, **kwargs))
+    finally:
+        _stats["blocking_in_flight"] -= 1
+
+@contextmanager
+def _flux_timer():
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        _stats["flux_errors"] += 1
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        _stats["flux_queries"] += 1
+        _stats["flux_ms_total"] += elapsed_ms
+        _stats["flux_ms_max"] = max(_stats["flux_ms_max"], elapsed_ms)
+
+async def fetch_records(flux):
+    """All FluxRecords of a query, read without blocking the loop."""
+    with _flux_timer():
+        stream = await _influx.query_api().query_stream(flux)
+        return [record async for record in stream]
+
+async def fetch_frame(flux):
+    """influx_pool.query_data_frame() on the async client."""
+    with _flux_timer():
+        df = await _influx.query_api().query_data_frame(flux)
+    if isinstance(df, list):  # tables with different columns come back separately
+        df = pd.concat(df, ignore_index=True) if df else pd.DataFrame()
+    return df.drop(columns=["result", "table"], errors="ignore")
+
+# ───── Predictions and Reports ─────
+async def predict_window(motorcycle_id, brand, model, mode="idle", minutes=30):
+    """detect_anomalies() with the window fetched here; only the scoring runs on a thread."""
+    try:
+        df = await fetch_frame(window_flux(motorcycle_id, minutes))
+    except Exception as e:
+        print(f"[ERROR] Flux query failed in predict_window: {e}")
+        df = pd.DataFrame()
+    return await run_blocking(detect_anomalies_in_window, motorcycle_id, brand, model, df, mode)
+
+async def fetch_rollup_buckets(motorcycle_id, since_epoch, bucket_minutes, until_epoch=None):
+    return await fetch_frame(rollup_buckets_flux(motorcycle_id, since_epoch, bucket_minutes, until_epoch))
+
+# No telemetry reaches this process, so cached predictions only expire by TTL
+PREDICTION_CACHE = PredictionCache(predict_window)
+ROLLUP_CACHE = RollupCache(fetch_rollup_buckets, FEATURES)
+
+# ───── Routes ─────
+@app.route("/predict", methods=["POST"])
+async def predict_route():
+    data = await request.get_json()
+    motorcycle_id, brand, model = data["motorcycle_id"], data["brand"], data["model"]
+    try:
+        print(f"Predicting for motorcycle {motorcycle_id}, brand={brand}, model={model}")
+        result = await PREDICTION_CACHE.get_async(motorcycle_id, brand, model, mode="idle", minutes=30)
+    except Exception as e:
+        result = {"status": "error", "message": f"Prediction failed: {str(e)}"}
+    return jsonify(result)
+
+@app.route("/recent-data", methods=["POST"])
+async def recent_data_route():
+    data = await request.get_json()
+    motorcycle_id = data["motorcycle_id"]
+    minutes = int(data.get("minutes", 30))
+    cursor = data.get("cursor")
+    limit = data.get("limit")
+    stream = data.get("stream")
+    points = data.get("points")
+    method = data.get("downsample", "mean")
+    fmt = data.get("format", "rows")
+    if method not in DOWNSAMPLE_METHODS:
+        return jsonify({"error": f"downsample must be one of {list(DOWNSAMPLE_METHODS)}"}), 400
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {list(FORMATS)}"}), 400
+    try:
+        cursor = parse_cursor(cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The query runs natively async; the rows are then shaped by the same
+    # code as the Flask route, fed with the fetched records
+    try:
+        records = await fetch_records(recent_data_flux(motorcycle_id, minutes, cursor, limit, points, method))
+    except Exception as e:
+        print(f"[ERROR] Flux query failed: {e}")
+        records = []
+
+    if fmt != "rows":
+        columnar = await run_blocking(get_recent_columnar, motorcycle_id, minutes, cursor, limit,
+                                      points, method, records=records)
+        if fmt == "columnar":
+            return jsonify(columnar)
+        try:
+            return Response(encode_msgpack(columnar), mimetype="application/x-msgpack")
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 501
+
+    if stream == "ndjson":
+        return Response(stream_ndjson(motorcycle_id, minutes, cursor, limit, points, method, records),
+                        mimetype="application/x-ndjson")
+    if stream:
+        return Response(stream_json(motorcycle_id, minutes, cursor, limit, points, method, records),
+                        mimetype="application/json")
+
+    state = {}
+    rows = await run_blocking(get_recent_data, motorcycle_id, minutes, cursor, limit, state, points, method, records)
+    if limit:
+        return jsonify({"rows": rows, "next_cursor": state.get("next_cursor") if page_filled(state, limit) else None})
+    return jsonify({"rows": rows})
+
+async def _report(time_range):
+    motorcycle_id = request.args.get("motorcycle_id", "unknown")
+    if motorcycle_id == "unknown":
+        return jsonify({"error": "Missing motorcycle_id"}), 400
+    bucket = request.args.get("bucket")
+    if bucket is not None and bucket not in BUCKETS:
+        return jsonify({"error": f"bucket must be one of {sorted(BUCKETS)}"}), 400
+    # Same fallbacks as report_api.query_aggregated_report
+    try:
+        partials = await ROLLUP_CACHE.get_async(motorcycle_id, time_range)
+    except Exception as e:
+        print(f"[ERROR] Flux query failed: {e}")
+        return jsonify({f: None for f in FEATURES})
+    report = await run_blocking(build_report, partials, bucket)
+    return jsonify(report)
+
+@app.route("/reports/daily", methods=["GET"])
+async def daily_report():
+    return await _report("-24h")
+
+@app.route("/reports/weekly", methods=["GET"])
+async def weekly_report():
+    return await _report("-7d")
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_route():
+    stats = dict(_stats)
+    queries = stats["flux_queries"]
+    stats["flux_ms_avg"] = round(stats["flux_ms_total"] / queries, 2) if queries else 0.0
+    stats["flux_ms_total"] = round(stats["flux_ms_total"], 2)
+    stats["flux_ms_max"] = round(stats["flux_ms_max"], 2)
+    stats["executor_workers"] = ASGI_EXECUTOR_WORKERS
+    return jsonify({
+        "async": stats,
+        "influx": pool_stats(),
+        "report_cache": ROLLUP_CACHE.stats(),
+        "models": MODEL_REGISTRY.stats(),
+        "prediction_cache": PREDICTION_CACHE.stats()
+    })
+
+@app.route("/health", methods=["GET"])
+async def health_check():
+    return jsonify({"status": "ok"})
+
+if __name__ == "__main__":
+    import hypercorn.asyncio
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [os.getenv("ASGI_BIND", "0.0.0.0:5001")]
+    asyncio.run(hypercorn.asyncio.serve(app, config))
@@ -0,0 +1,277 @@
+"""
+feature_store.py
+────────────────
+Local columnar copy of the OBD training features, so retraining reads disk
+instead of re-downloading weeks of raw data from InfluxDB.
+
+Layout (one directory per motorcycle, one per UTC day):
+
+    feature_store/<motorcycle_id>/sync.json                       ← covered range, replaced atomically
+    feature_store/<motorcycle_id>/<YYYY-MM-DD>/part-<seq>/time.npy   ← int64 ns since epoch
+    feature_store/<motorcycle_id>/<YYYY-MM-DD>/part-<seq>/<feature>.npy  ← float64, NaN = missing
+
+  • sync() only pulls what is not on disk yet: rows newer than the last sync
+    plus any older history a longer training window asks for. It re-reads
+    the last FEATURE_STORE_OVERLAP_MINUTES (default a day) too: the collector
+    spool uploads its backlog late, so keep this at least as long as the
+    longest collector outage whose data should reach the next training.
+  • Syncs of one bike are serialized with an flock on <motorcycle_id>/.lock,
+    so concurrent trainings in separate worker processes never write the
+    same day's parts twice.
+  • Day partitions older than FEATURE_STORE_RETENTION_DAYS (or than the
+    window being synced, if that is longer) are deleted after each sync.
+  • Every sync writes new immutable parts (a temp directory renamed into
+    place), so readers never see half-written files. A row stored twice
+    resolves to the newest part's copy; a day's parts are merged into one
+    once the day is over.
+  • load() maps only the requested columns (mmap_mode="r") of the days that
+    overlap the range.
+"""
+
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: syncs are then only serialized within a process
+    fcntl = None
+
+import influx_pool
+from influx_pool import INFLUXDB_BUCKET
+
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "feature_store")
+FEATURE_STORE_OVERLAP_MINUTES = int(os.getenv("FEATURE_STORE_OVERLAP_MINUTES", 1440))
+FEATURE_STORE_RETENTION_DAYS = int(os.getenv("FEATURE_STORE_RETENTION_DAYS", 45))
+
+FEATURES = ["rpm", "engine_load", "throttle_pos", "long_fuel_trim_1", "coolant_temp", "elm_voltage"]
+SYNC_FILE = "sync.json"
+LOCK_FILE = ".lock"
+NS_PER_MINUTE = 60 * 1_000_000_000
+NS_PER_DAY = 1440 * NS_PER_MINUTE
+
+
+# ───── InfluxDB ─────
+def query_features(moto_id, start, stop=None) -> pd.DataFrame:
+    """
+    Pivoted FEATURES rows of one bike, `_time` plus one column per feature.
+    start/stop are Flux time expressions, e.g. "-60m" or "time(v: 1700000000000000000)".
+    """
+    bounds = f"start: {start}" + (f", stop: {stop}" if stop else "")
+    fields = " or\n          ".join(f'r._field == "{f}"' for f in FEATURES)
+    flux = f"""
+    from(bucket: "{INFLUXDB_BUCKET}")
+      |> range({bounds})
+      |> filter(fn: (r) => r._measurement == "obd_data")
+      |> filter(fn: (r) => r.motorcycle_id == "{moto_id}")
+      |> filter(fn: (r) =>
+          {fields})
+      |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+      |> keep(columns: ["_time", {", ".join(f'"{f}"' for f in FEATURES)}])
+    """
+    return influx_pool.query_data_frame(flux)
+
+
+def _to_ns(times):
+    return pd.DatetimeIndex(pd.to_datetime(times, utc=True)).as_unit("ns").asi8
+
+
+def _day(ns):
+    return datetime.fromtimestamp(ns // 1_000_000_000, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+# ───── Store ─────
+class FeatureStore:
+    def __init__(self, base_dir=FEATURE_STORE_DIR, overlap_minutes=FEATURE_STORE_OVERLAP_MINUTES,
+                 retention_days=FEATURE_STORE_RETENTION_DAYS):
+        self.base_dir = base_dir
+        self.overlap_ns = overlap_minutes * NS_PER_MINUTE
+        self.retention_ns = retention_days * NS_PER_DAY
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _bike_dir(self, moto_id):
+        return os.path.join(self.base_dir, str(moto_id))
+
+    def _bike_lock(self, moto_id):
+        with self._lock:
+            return self._locks.setdefault(str(moto_id), threading.Lock())
+
+    @contextmanager
+    def _locked(self, moto_id):
+        """Hold one bike's sync lock, across threads and processes."""
+        with self._bike_lock(moto_id):
+            os.makedirs(self._bike_dir(moto_id), exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self._bike_dir(moto_id), LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def sync_state(self, moto_id):
+        try:
+            with open(os.path.join(self._bike_dir(moto_id), SYNC_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_state(self, moto_id, state):
+        path = os.path.join(self._bike_dir(moto_id), SYNC_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    # ───── Writing ─────
+    def _write_part(self, moto_id, day, times, columns):
+        day_dir = os.path.join(self._bike_dir(moto_id), day)
+        os.makedirs(day_dir, exist_ok=True)
+        # Sortable, unique part names: newer parts win on duplicate rows
+        name = f"part-{time.time_ns():020d}"
+        tmp_dir = os.path.join(day_dir, name + ".tmp")
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "time.npy"), times)
+        for feature, values in columns.items():
+            np.save(os.path.join(tmp_dir, f"{feature}.npy"), values)
+        os.rename(tmp_dir, os.path.join(day_dir, name))
+
+    def append(self, moto_id, df):
+        """Store a query_features() frame as new parts, one per UTC day; returns rows written."""
+        if df.empty:
+            return 0
+        times = _to_ns(df["_time"])
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+        columns = {
+            f: (df[f].to_numpy(dtype=np.float64, na_value=np.nan)[order] if f in df
+                else np.full(len(times), np.nan))
+            for f in FEATURES
+        }
+        bounds = np.flatnonzero(np.diff(times // NS_PER_DAY)) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(times)]):
+            self._write_part(moto_id, _day(times[lo]), times[lo:hi],
+                             {f: v[lo:hi] for f, v in columns.items()})
+        return len(times)
+
+    def sync(self, moto_id, minutes):
+        """
+        Bring the last `minutes` of one bike up to date; returns counts of rows
+        fetched. Only the gap before the stored range and the tail after the
+        last sync (minus the overlap) are queried.
+        """
+        with self._locked(moto_id):
+            now_ns = time.time_ns()
+            want_start = now_ns - int(minutes) * NS_PER_MINUTE
+            state = self.sync_state(moto_id)
+            fetched = {"backfill": 0, "incremental": 0}
+
+            if state is None:
+                fetched["incremental"] = self.append(moto_id, query_features(moto_id, f"time(v: {want_start})"))
+                state = {"start_ns": want_start}
+            else:
+                if want_start < state["start_ns"]:
+                    fetched["backfill"] = self.append(moto_id, query_features(
+                        moto_id, f"time(v: {want_start})", f"time(v: {state['start_ns']})"))
+                    state["start_ns"] = want_start
+                since = max(state["start_ns"], state["end_ns"] - self.overlap_ns)
+                fetched["incremental"] = self.append(moto_id, query_features(moto_id, f"time(v: {since})"))
+
+            # Keep at least the window just synced, even past the retention
+            keep_from = min(now_ns - self.retention_ns, want_start)
+            state["start_ns"] = max(state["start_ns"], keep_from - keep_from % NS_PER_DAY)
+            state["end_ns"] = now_ns
+            state["synced_at"] = time.time()
+            self._save_state(moto_id, state)
+            self.compact(moto_id, before_day=_day(now_ns - self.overlap_ns))
+            fetched["pruned_days"] = self.prune(moto_id, before_day=_day(keep_from))
+            return fetched
+
+    def compact(self, moto_id, before_day):
+        """Merge the parts of each day older than `before_day` into one."""
+        merged = 0
+        for day_dir in sorted(glob.glob(os.path.join(self._bike_dir(moto_id), "????-??-??"))):
+            if os.path.basename(day_dir) >= before_day:
+                continue
+            parts = self._parts(day_dir)
+            if len(parts) < 2:
+                continue
+            times, columns = self._read_parts(parts, FEATURES)
+            self._write_part(moto_id, os.path.basename(day_dir), times, columns)
+            for part in parts:
+                shutil.rmtree(part, ignore_errors=True)
+            merged += 1
+        return merged
+
+    def prune(self, moto_id, before_day):
+        """Delete the day partitions older than `before_day`."""
+        pruned = 0
+        for day_dir in sorted(glob.glob(os.path.join(self._bike_dir(moto_id), "????-??-??"))):
+            if os.path.basename(day_dir) >= before_day:
+                break
+            shutil.rmtree(day_dir, ignore_errors=True)
+            pruned += 1
+        return pruned
+
+    # ───── Reading ─────
+    @staticmethod
+    def _parts(day_dir):
+        return sorted(p for p in glob.glob(os.path.join(day_dir, "part-*")) if not p.endswith(".tmp"))
+
+    @staticmethod
+    def _read_parts(parts, columns, start_ns=None):
+        """Concatenate parts (oldest first), keep the newest copy of each time, sort."""
+        times, values = [], {c: [] for c in columns}
+        for part in parts:
+            t = np.load(os.path.join(part, "time.npy"), mmap_mode="r")
+            keep = slice(None) if start_ns is None else t >= start_ns
+            times.append(np.asarray(t[keep]))
+            for c in columns:
+                values[c].append(np.asarray(np.load(os.path.join(part, f"{c}.npy"), mmap_mode="r")[keep]))
+        if not times:
+            return np.empty(0, dtype=np.int64), {c: np.empty(0) for c in columns}
+
+        times = np.concatenate(times)
+        # Last occurrence wins: unique over the reversed array picks the newest part
+        _, first_rev = np.unique(times[::-1], return_index=True)
+        keep = len(times) - 1 - first_rev  # sorted by time
+        return times[keep], {c: np.concatenate(v)[keep] for c, v in values.items()}
+
+    def load(self, moto_id, minutes, columns=FEATURES) -> pd.DataFrame:
+        """The stored rows of the last `minutes`, `_time` plus the requested columns."""
+        start_ns = time.time_ns() - int(minutes) * NS_PER_MINUTE
+        first_day = _day(start_ns)
+        for attempt in range(3):
+            parts = [
+                part
+                for day_dir in sorted(glob.glob(os.path.join(self._bike_dir(moto_id), "????-??-??")))
+                if os.path.basename(day_dir) >= first_day
+                for part in self._parts(day_dir)
+            ]
+            try:
+                times, values = self._read_parts(parts, list(columns), start_ns)
+                break
+            except FileNotFoundError:
+                # A part was merged away by a concurrent compaction; list again
+                if attempt == 2:
+                    raise
+        df = pd.DataFrame(values)
+        df.insert(0, "_time", pd.to_datetime(times, utc=True))
+        return df
+
+    def sync_and_load(self, moto_id, minutes, columns=FEATURES):
+        fetched = self.sync(moto_id, minutes)
+        df = self.load(moto_id, minutes, columns)
+        print(f"[INFO] Feature store {moto_id}: fetched {fetched['incremental']:,} new "
+              f"+ {fetched['backfill']:,} backfilled rows, read {len(df):,} from disk")
+        return df
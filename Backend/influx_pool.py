@@ -0,0 +1,166 @@
+"""
+influx_pool.py
+──────────────
+One shared, thread-safe InfluxDB client per process.
+
+The client keeps HTTP connections alive in a bounded urllib3 pool, applies a
+configurable timeout and retries transient failures with exponential backoff.
+Every query goes through the helpers below so hit/miss and latency counters
+can be read from pool_stats().
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+from dotenv import load_dotenv
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
+from urllib3.util.retry import Retry
+
+load_dotenv()
+
+# ───── InfluxDB Configuration ─────
+INFLUXDB_URL = os.getenv("INFLUX_URL")
+INFLUXDB_TOKEN = os.getenv("INFLUX_TOKEN")
+INFLUXDB_ORG = os.getenv("INFLUX_ORG")
+INFLUXDB_BUCKET = os.getenv("INFLUX_BUCKET")
+
+INFLUX_TIMEOUT_MS = int(os.getenv("INFLUX_TIMEOUT_MS", 10_000))
+INFLUX_POOL_SIZE = int(os.getenv("INFLUX_POOL_SIZE", 8))
+INFLUX_RETRIES = int(os.getenv("INFLUX_RETRIES", 3))
+INFLUX_RETRY_BACKOFF = float(os.getenv("INFLUX_RETRY_BACKOFF", 0.5))
+
+_client = None
+_client_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(INFLUX_POOL_SIZE)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "client_hits": 0,
+    "client_misses": 0,
+    "queries": 0,
+    "errors": 0,
+    "total_ms": 0.0,
+    "max_ms": 0.0,
+}
+
+def _retry_policy():
+    return Retry(
+        total=INFLUX_RETRIES,
+        backoff_factor=INFLUX_RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,  # queries are POSTs but idempotent
+        respect_retry_after_header=True,
+    )
+
+def get_client() -> InfluxDBClient:
+    """Return the process-wide client, creating it on first use."""
+    global _client
+    client = _client
+    if client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InfluxDBClient(
+                    url=INFLUXDB_URL,
+                    token=INFLUXDB_TOKEN,
+                    org=INFLUXDB_ORG,
+                    timeout=INFLUX_TIMEOUT_MS,
+                    retries=_retry_policy(),
+                    connection_pool_maxsize=INFLUX_POOL_SIZE,
+                    enable_gzip=True,
+                )
+                _count("client_misses")
+            else:
+                _count("client_hits")
+            return _client
+    _count("client_hits")
+    return client
+
+def get_query_api():
+    return get_client().query_api()
+
+def get_write_api(write_options=SYNCHRONOUS, **kwargs):
+    return get_client().write_api(write_options=write_options, **kwargs)
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+# ───── Timed Query Helpers ─────
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+@contextmanager
+def _timed():
+    """Hold one pool slot for the duration of a query and record its latency."""
+    with _slots:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            _count("errors")
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with _stats_lock:
+                _stats["queries"] += 1
+                _stats["total_ms"] += elapsed_ms
+                _stats["max_ms"] = max(_stats["max_ms"], elapsed_ms)
+
+def query_data_frame(flux: str) -> pd.DataFrame:
+    """One DataFrame for the whole result, without the result/table columns."""
+    with _timed():
+        df = get_query_api().query_data_frame(flux)
+    if isinstance(df, list):  # tables with different columns come back separately
+        df = pd.concat(df, ignore_index=True) if df else pd.DataFrame()
+    return df.drop(columns=["result", "table"], errors="ignore")
+
+def query_stream(flux: str):
+    """
+    Yield FluxRecords as they are parsed. The pool slot is held only while
+    the query is sent, so a reader that stops early (an aborted HTTP stream)
+    never pins it; closing this generator closes the HTTP response.
+    """
+    with _timed():
+        records = get_query_api().query_stream(flux)
+    yield from records
+
+# ───── Metrics ─────
+def _connection_stats():
+    """Requests vs. new TCP/TLS connections across the urllib3 pools."""
+    requests_made = connections_opened = 0
+    client = _client
+    if client is None:
+        return {"requests": 0, "connections_opened": 0, "connections_reused": 0}
+    try:
+        pools = client.api_client.rest_client.pool_manager.pools
+        with pools.lock:
+            conn_pools = list(pools._container.values())
+        for pool in conn_pools:
+            requests_made += pool.num_requests
+            connections_opened += pool.num_connections
+    except AttributeError:
+        pass
+    return {
+        "requests": requests_made,
+        "connections_opened": connections_opened,
+        "connections_reused": max(requests_made - connections_opened, 0),
+    }
+
+def pool_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    queries = stats["queries"]
+    stats["avg_ms"] = round(stats["total_ms"] / queries, 2) if queries else 0.0
+    stats["total_ms"] = round(stats["total_ms"], 2)
+    stats["max_ms"] = round(stats["max_ms"], 2)
+    stats["pool_size"] = INFLUX_POOL_SIZE
+    stats.update(_connection_stats())
+    return stats
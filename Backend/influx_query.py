@@ -1,86 +1,302 @@
-from influxdb_client import InfluxDBClient
-import pandas as pd
-import os
-from dotenv import load_dotenv
+import calendar
 import json
+import math
+import re
+from contextlib import closing
+from datetime import datetime, timezone
 
-# ───── Load Environment Variables ─────
-load_dotenv()
+import numpy as np
 
-# ───── InfluxDB Configuration ─────
-INFLUXDB_URL = os.getenv("INFLUX_URL")
-INFLUXDB_TOKEN = os.getenv("INFLUX_TOKEN")
-INFLUXDB_ORG = os.getenv("INFLUX_ORG")
-INFLUXDB_BUCKET = os.getenv("INFLUX_BUCKET")
+try:
+    import msgpack
+except ImportError:  # optional: only needed for the binary wire format
+    msgpack = None
 
-# ───── Initialize InfluxDB Client ─────
-client = InfluxDBClient(
-    url=INFLUXDB_URL,
-    token=INFLUXDB_TOKEN,
-    org=INFLUXDB_ORG
-)
-query_api = client.query_api()
+import influx_pool
+from influx_pool import INFLUXDB_BUCKET
 
-def get_recent_data(motorcycle_id, minutes=30):
+FEATURES = [
+    "coolant_temp",
+    "elm_voltage",
+    "engine_load",
+    "long_fuel_trim_1",
+    "rpm",
+    "throttle_pos"
+]
+
+# ───── Columns dropped from the table / renamed for readability ─────
+DROP_COLS = {"result", "table", "_start", "_stop", "_measurement"}
+
+COLUMN_MAP = {
+    "_time": "Timestamp",
+    "coolant_temp": "Coolant Temperature (°C)",
+    "elm_voltage": "ELM Voltage (V)",
+    "engine_load": "Engine Load (%)",
+    "long_fuel_trim_1": "Fuel Trim (%)",
+    "rpm": "RPM",
+    "throttle_pos": "Throttle Position (%)"
+}
+
+DOWNSAMPLE_METHODS = ("mean", "lttb")
+
+_RFC3339 = re.compile(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d{1,9}))?(Z|[+-]\d{2}:\d{2})")
+
+def parse_cursor(cursor):
     """
-    Fetch recent OBD-II data for a specific motorcycle using Flux query.
-    Cleans up Influx system columns and formats time for frontend use.
+    Validate an RFC3339 cursor and re-serialize it as UTC ("...Z"), keeping
+    its fractional digits; None and "" mean no cursor. Raises ValueError, so
+    nothing but a timestamp ever reaches the Flux text.
     """
+    if cursor is None or cursor == "":
+        return None
+    match = _RFC3339.fullmatch(cursor) if isinstance(cursor, str) else None
+    if match is None:
+        raise ValueError(f"cursor must be an RFC3339 time, got {cursor!r}")
+    seconds, fraction, offset = match.groups()
+    t = datetime.fromisoformat(seconds + ("+00:00" if offset == "Z" else offset))
+    fraction = f".{fraction}" if fraction else ""
+    return t.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S") + fraction + "Z"
 
-    flux_query = f'''
+def _window_seconds(minutes, points):
+    """aggregateWindow period that yields at most `points` rows over the range."""
+    return max(1, math.ceil(int(minutes) * 60 / int(points)))
+
+def _recent_data_flux(motorcycle_id, minutes, cursor=None, limit=None, points=None):
+    field_filter = " or\n        ".join(f'r["_field"] == "{f}"' for f in FEATURES)
+    flux = f'''
     from(bucket: "{INFLUXDB_BUCKET}")
-      |> range(start: -{minutes}m)
+      |> range(start: -{int(minutes)}m)
       |> filter(fn: (r) => r["_measurement"] == "obd_data")
       |> filter(fn: (r) => r["motorcycle_id"] == "{motorcycle_id}")
       |> filter(fn: (r) =>
-        r["_field"] == "coolant_temp" or
-        r["_field"] == "elm_voltage" or
-        r["_field"] == "engine_load" or
-        r["_field"] == "long_fuel_trim_1" or
-        r["_field"] == "rpm" or
-        r["_field"] == "throttle_pos"
+        {field_filter}
       )
-      |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
+    '''
+    cursor = parse_cursor(cursor)
+    if cursor:
+        flux += f'''  |> filter(fn: (r) => r["_time"] > time(v: "{cursor}"))
+    '''
+    if points:
+        flux += f'''  |> aggregateWindow(every: {_window_seconds(minutes, points)}s, fn: mean, createEmpty: false)
+    '''
+    flux += '''  |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
       |> sort(columns: ["_time"])
     '''
+    if limit:
+        flux += f'''  |> limit(n: {int(limit)})
+    '''
+    return flux
+
+def _format_record(values):
+    """
+    One pivoted Flux record → one table row: drop system columns, skip
+    incomplete rows, format the timestamp and rename columns.
+    """
+    if any(f not in values for f in FEATURES):
+        return None
+    row = {}
+    for key, value in values.items():
+        if key in DROP_COLS:
+            continue
+        if value is None:
+            return None
+        if key == "_time":
+            if not isinstance(value, datetime):
+                return None
+            value = value.strftime('%B %d, %Y %H:%M:%S')  # Ex: July 06, 2025 13:02:30
+        row[COLUMN_MAP.get(key, key)] = value
+    return row
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep
+    the visual shape of (x, y). First and last points are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int(math.floor((i + 1) * every)) + 1
+        avg_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                       - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+def recent_data_flux(motorcycle_id, minutes=30, cursor=None, limit=None, points=None, method="mean"):
+    """The Flux query behind iter_recent_data (LTTB downsamples after the query)."""
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"downsample must be one of {DOWNSAMPLE_METHODS}")
+    window_points = points if method == "mean" else None
+    return _recent_data_flux(motorcycle_id, minutes, cursor, limit, window_points)
+
+def _iter_records(motorcycle_id, minutes=30, cursor=None, limit=None, state=None,
+                  points=None, method="mean", lttb_field="rpm", records=None):
+    """Yield (FluxRecord, formatted row) pairs; see iter_recent_data."""
+    flux = recent_data_flux(motorcycle_id, minutes, cursor, limit, points, method)
+    state = {} if state is None else state
+    state["records"] = 0
+
+    def rows_with_time():
+        previous = None
+        source = influx_pool.query_stream(flux) if records is None else iter(records)
+        # Closed explicitly, so a consumer that stops early releases the HTTP response
+        with closing(source):
+            for record in source:
+                state["records"] += 1
+                state["next_cursor"] = record.get_time().isoformat()
+                row = _format_record(record.values)
+                if row is None or row == previous:
+                    continue
+                previous = row
+                yield record, row
+
+    if not points or method == "mean":
+        yield from rows_with_time()
+        return
+
+    # LTTB needs the whole series before it can pick points
+    pairs, x, y = [], [], []
+    for record, row in rows_with_time():
+        pairs.append((record, row))
+        x.append(record.get_time().timestamp())
+        y.append(record.values.get(lttb_field))
+    for i in lttb_indices(x, y, int(points)):
+        yield pairs[i]
+
+def iter_recent_data(motorcycle_id, minutes=30, cursor=None, limit=None, state=None,
+                     points=None, method="mean", records=None):
+    """
+    Stream formatted rows straight from the Flux record stream.
+    `cursor` is an RFC3339 time; only rows strictly after it are returned.
+    With `points`, the series is downsampled to about that many rows, either
+    server-side via aggregateWindow ("mean") or via LTTB on rpm ("lttb").
+    If `state` is a dict it receives the number of records read and the
+    time of the last one as "next_cursor". `records` replaces the query with
+    FluxRecords the caller already fetched (the async server does this).
+    """
+    with closing(_iter_records(motorcycle_id, minutes, cursor, limit, state, points, method,
+                               records=records)) as pairs:
+        for _, row in pairs:
+            yield row
+
+def page_filled(state, limit):
+    """True when a limited page came back full, i.e. more rows may follow."""
+    return bool(limit) and state.get("records", 0) >= int(limit)
 
+def get_recent_data(motorcycle_id, minutes=30, cursor=None, limit=None, state=None,
+                    points=None, method="mean", records=None):
+    """
+    Fetch recent OBD-II data for a specific motorcycle using Flux query.
+    Cleans up Influx system columns and formats time for frontend use.
+    """
     try:
-        df = query_api.query_data_frame(flux_query)
-        if isinstance(df, list):
-            df = pd.concat(df, ignore_index=True)
-
-        if df.empty:
-            return []
-
-        # ───── Drop system columns that you don't want in the table ─────
-        drop_cols = ["result", "table", "_start", "_stop", "_measurement"]
-        df.drop(columns=[col for col in drop_cols if col in df.columns], inplace=True)
-
-        # ───── Clean Data ─────
-        df.dropna(inplace=True)
-        df.drop_duplicates(inplace=True)
-        df.reset_index(drop=True, inplace=True)
-
-        # ───── Format Timestamp ─────
-        if "_time" in df.columns:
-            df["_time"] = pd.to_datetime(df["_time"], errors="coerce")
-            df = df[df["_time"].notna()]
-            df["_time"] = df["_time"].dt.strftime('%B %d, %Y %H:%M:%S')  # Ex: July 06, 2025 13:02:30
-
-        # ───── Rename Columns for Readability (optional) ─────
-        column_map = {
-            "_time": "Timestamp",
-            "coolant_temp": "Coolant Temperature (°C)",
-            "elm_voltage": "ELM Voltage (V)",
-            "engine_load": "Engine Load (%)",
-            "long_fuel_trim_1": "Fuel Trim (%)",
-            "rpm": "RPM",
-            "throttle_pos": "Throttle Position (%)"
-        }
-        df.rename(columns=column_map, inplace=True)
-
-        return json.loads(df.to_json(orient="records"))
+        rows, seen = [], set()
+        for row in iter_recent_data(motorcycle_id, minutes, cursor, limit, state, points, method, records):
+            key = tuple(row.items())
+            if key not in seen:
+                seen.add(key)
+                rows.append(row)
+        return rows
 
     except Exception as e:
         print(f"[ERROR] Flux query failed: {e}")
         return []
+
+# ───── Streaming encoders for the HTTP route ─────
+def stream_ndjson(motorcycle_id, minutes=30, cursor=None, limit=None, points=None, method="mean",
+                  records=None):
+    """One JSON row per line; a final {"next_cursor": ...} line when a page was filled."""
+    state = {}
+    try:
+        with closing(iter_recent_data(motorcycle_id, minutes, cursor, limit, state, points, method, records)) as rows:
+            for row in rows:
+                yield json.dumps(row) + "\n"
+    except Exception as e:
+        print(f"[ERROR] Flux stream failed: {e}")
+        yield json.dumps({"error": str(e)}) + "\n"
+        return
+    if page_filled(state, limit):
+        yield json.dumps({"next_cursor": state.get("next_cursor")}) + "\n"
+
+def stream_json(motorcycle_id, minutes=30, cursor=None, limit=None, points=None, method="mean",
+                records=None):
+    """
+    Chunked {"rows": [...], "next_cursor": ...} document, written row by row.
+    A failure mid-stream closes the document with an "error" field instead,
+    so a cut-off result never looks complete.
+    """
+    state, count = {}, 0
+    yield '{"rows": ['
+    try:
+        with closing(iter_recent_data(motorcycle_id, minutes, cursor, limit, state, points, method, records)) as rows:
+            for row in rows:
+                yield ("," if count else "") + json.dumps(row)
+                count += 1
+    except Exception as e:
+        print(f"[ERROR] Flux stream failed: {e}")
+        yield f'], "next_cursor": null, "error": {json.dumps(str(e))}}}'
+        return
+    next_cursor = state.get("next_cursor") if page_filled(state, limit) else None
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+# ───── Columnar wire format ─────
+FORMATS = ("rows", "columnar", "msgpack")
+
+COLUMNS = [{"name": f, "label": COLUMN_MAP[f], "dtype": "float64"} for f in FEATURES]
+
+def _epoch_ms(t):
+    return calendar.timegm(t.utctimetuple()) * 1000 + t.microsecond // 1000
+
+def get_recent_columnar(motorcycle_id, minutes=30, cursor=None, limit=None,
+                        points=None, method="mean", records=None):
+    """
+    Same rows as get_recent_data, laid out column-wise: one epoch-millisecond
+    time array, one float array per feature, and the column metadata once.
+    """
+    state = {}
+    times, values = [], {f: [] for f in FEATURES}
+    try:
+        for record, _ in _iter_records(motorcycle_id, minutes, cursor, limit, state, points, method, records=records):
+            times.append(_epoch_ms(record.get_time()))
+            for f in FEATURES:
+                values[f].append(record.values[f])
+    except Exception as e:
+        print(f"[ERROR] Flux query failed: {e}")
+        times, values = [], {f: [] for f in FEATURES}
+
+    return {
+        "format": "columnar",
+        "motorcycle_id": str(motorcycle_id),
+        "columns": COLUMNS,
+        "time": times,
+        "values": values,
+        "next_cursor": state.get("next_cursor") if page_filled(state, limit) else None
+    }
+
+def encode_msgpack(columnar):
+    """
+    Binary form of a columnar payload: the time column as little-endian int64
+    bytes and each feature as little-endian float32 bytes (sensor readings
+    carry two decimals, so float32 loses nothing the charts can show).
+    """
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    doc = dict(columnar, format="msgpack")
+    doc["columns"] = [dict(c, dtype="float32") for c in columnar["columns"]]
+    doc["time"] = np.asarray(columnar["time"], dtype="<i8").tobytes()
+    doc["values"] = {f: np.asarray(v, dtype="<f4").tobytes() for f, v in columnar["values"].items()}
+    return msgpack.packb(doc, use_bin_type=True)
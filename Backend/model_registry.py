@@ -0,0 +1,266 @@
+"""
+model_registry.py
+─────────────────
+Bounded, self-refreshing cache of the per-bike model bundles.
+
+    models/<brand>/<mode>_<motorcycle_id>.flat.joblib   (preferred, memory-mapped)
+    models/<brand>/<mode>_<motorcycle_id>.pkl           (fallback)
+        → (model, scaler)
+
+  • At most MODEL_CACHE_MAX_ENTRIES bundles / MODEL_CACHE_MAX_MB of memory are
+    kept; the least recently used bundle is evicted first.
+  • Every MODEL_RELOAD_CHECK_SECONDS an access re-stats the file. When its
+    mtime or size moved, the file is hashed and a changed bundle is reloaded,
+    so a retrained model is served without a restart; once a hash is known,
+    a file that was only touched is not reloaded again. If the new file
+    cannot be loaded the previous bundle keeps being served.
+  • Hit/miss/reload/eviction counts and load times are kept for /metrics.
+
+Flat bundles (see model_store.py) are mapped read-only and shared by all
+worker processes, so they count only their small heap overhead against the
+memory budget.
+"""
+
+import glob
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+
+from model_store import FLAT_SUFFIX, load_flat
+from range_table import normalize
+
+MODEL_CACHE_MAX_ENTRIES = int(os.getenv("MODEL_CACHE_MAX_ENTRIES", 64))
+MODEL_CACHE_MAX_MB = float(os.getenv("MODEL_CACHE_MAX_MB", 512))
+MODEL_RELOAD_CHECK_SECONDS = float(os.getenv("MODEL_RELOAD_CHECK_SECONDS", 5))
+
+
+TREE_NODE_BYTES = 64  # one record of sklearn's tree NODE_DTYPE
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _bundle_bytes(obj, seen=None):
+    """
+    Approximate private (heap) size of a loaded bundle: the nbytes of the
+    arrays it holds. Memory-mapped arrays live in the shared page cache and
+    count as 0; sklearn trees count their node and value buffers.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return 0 if isinstance(obj, np.memmap) or isinstance(obj.base, np.memmap) else obj.nbytes
+    if hasattr(obj, "node_count") and hasattr(obj, "capacity"):  # sklearn.tree._tree.Tree
+        return obj.capacity * TREE_NODE_BYTES + obj.value.nbytes
+    if isinstance(obj, (list, tuple)):
+        return sum(_bundle_bytes(item, seen) for item in obj)
+    if isinstance(obj, dict):
+        return sum(_bundle_bytes(item, seen) for item in obj.values())
+    if hasattr(obj, "__dict__"):
+        return sum(_bundle_bytes(item, seen) for item in vars(obj).values())
+    return 0
+
+
+class _Entry:
+    __slots__ = ("path", "bundle", "mtime", "size", "sha256", "nbytes", "checked_at")
+
+    def __init__(self, path, bundle, mtime, size, sha256, nbytes):
+        self.path = path
+        self.bundle = bundle
+        self.mtime = mtime
+        self.size = size
+        self.sha256 = sha256
+        self.nbytes = nbytes
+        self.checked_at = time.monotonic()
+
+
+class ModelRegistry:
+    def __init__(self, base_dir, max_entries=MODEL_CACHE_MAX_ENTRIES,
+                 max_bytes=MODEL_CACHE_MAX_MB * 1024 * 1024,
+                 check_interval=MODEL_RELOAD_CHECK_SECONDS):
+        self.base_dir = base_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}  # per-key load locks, dropped with their entry
+        self._bytes = 0       # sum of nbytes over _entries
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0,
+                       "load_errors": 0, "loads": 0, "load_ms_total": 0.0, "load_ms_max": 0.0}
+
+    def key(self, brand, moto_id, mode="idle"):
+        return os.path.join(self.base_dir, normalize(brand), f"{mode}_{moto_id}")
+
+    @staticmethod
+    def _resolve(key):
+        """
+        The file to serve for a key: the flat bundle unless it is missing or
+        older than the pickle (a retrain that only wrote the pickle), else the pickle.
+        """
+        flat, pkl = key + FLAT_SUFFIX, key + ".pkl"
+        try:
+            flat_mtime = os.stat(flat).st_mtime_ns
+        except FileNotFoundError:
+            return pkl if os.path.exists(pkl) else None
+        try:
+            return pkl if os.stat(pkl).st_mtime_ns > flat_mtime else flat
+        except FileNotFoundError:
+            return flat
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    # ───── Loading ─────
+    def _load(self, path, sha256=None):
+        """Load one bundle file; `sha256` is its hash if the caller already computed it."""
+        started = time.perf_counter()
+        try:
+            stat = os.stat(path)
+            if path.endswith(FLAT_SUFFIX):
+                bundle = load_flat(path)
+            else:
+                bundle = joblib.load(path)
+                if not {"model", "scaler"} <= bundle.keys():
+                    raise ValueError(f"{path} missing model/scaler keys")
+                bundle = (bundle["model"], bundle["scaler"])
+        except Exception:
+            self._count("load_errors")
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats["loads"] += 1
+            self._stats["load_ms_total"] += elapsed_ms
+            self._stats["load_ms_max"] = max(self._stats["load_ms_max"], elapsed_ms)
+        return _Entry(path, bundle, stat.st_mtime_ns, stat.st_size, sha256, _bundle_bytes(bundle))
+
+    def _store(self, key, entry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                evicted, old = self._entries.popitem(last=False)
+                self._bytes -= old.nbytes
+                self._key_locks.pop(evicted, None)
+                self._stats["evictions"] += 1
+                print(f"[INFO] Model cache evicted {evicted}")
+
+    def _refresh(self, key, entry):
+        """Reload `entry` if its file changed on disk; returns the entry to serve."""
+        path = self._resolve(key)
+        if path is None:
+            self.invalidate_key(key)
+            raise FileNotFoundError(key + ".pkl")
+        entry.checked_at = time.monotonic()
+        sha256 = None
+        if path == entry.path:
+            stat = os.stat(path)
+            if (stat.st_mtime_ns, stat.st_size) == (entry.mtime, entry.size):
+                return entry
+            # Hashed only once the file moved; a first load is never hashed,
+            # so its first change always reloads
+            sha256 = _file_hash(path)
+            if sha256 == entry.sha256:
+                entry.mtime, entry.size = stat.st_mtime_ns, stat.st_size  # touched, not changed
+                return entry
+        try:
+            fresh = self._load(path, sha256)
+        except Exception as e:
+            print(f"[ERROR] Reloading {path} failed, keeping the previous model: {e}")
+            return entry
+        self._count("reloads")
+        print(f"[INFO] Reloaded changed model {path}")
+        self._store(key, fresh)
+        return fresh
+
+    def get(self, brand, moto_id, mode="idle"):
+        """(model, scaler) for one bike; raises FileNotFoundError without a trained model."""
+        key = self.key(brand, moto_id, mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and time.monotonic() - entry.checked_at < self.check_interval:
+            self._count("hits")
+            return entry.bundle
+
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                self._count("hits")
+                return self._refresh(key, entry).bundle
+
+            self._count("misses")
+            path = self._resolve(key)
+            if path is None:
+                raise FileNotFoundError(key + ".pkl")
+            entry = self._load(path)
+            self._store(key, entry)
+            return entry.bundle
+
+    # ───── Maintenance ─────
+    def invalidate_key(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            self._bytes -= entry.nbytes
+            self._key_locks.pop(key, None)
+            return True
+
+    def invalidate(self, brand, moto_id, mode="idle"):
+        return self.invalidate_key(self.key(brand, moto_id, mode))
+
+    def preload(self, motorcycle_ids, mode="idle"):
+        """Load the models of the given bikes (any brand folder); returns how many loaded."""
+        loaded = 0
+        for moto_id in motorcycle_ids:
+            brands = {
+                os.path.basename(os.path.dirname(path))
+                for suffix in (FLAT_SUFFIX, ".pkl")
+                for path in glob.glob(os.path.join(self.base_dir, "*", f"{mode}_{moto_id}{suffix}"))
+            }
+            for brand in sorted(brands):
+                try:
+                    self.get(brand, moto_id, mode)
+                    loaded += 1
+                except Exception as e:
+                    print(f"[ERROR] Preloading {mode}_{moto_id} ({brand}) failed: {e}")
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats["load_ms_avg"] = round(stats["load_ms_total"] / stats["loads"], 2) if stats["loads"] else None
+        stats["load_ms_total"] = round(stats["load_ms_total"], 2)
+        stats["load_ms_max"] = round(stats["load_ms_max"], 2)
+        stats["max_entries"] = self.max_entries
+        stats["max_bytes"] = int(self.max_bytes)
+        return stats
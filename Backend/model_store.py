@@ -0,0 +1,166 @@
+"""
+model_store.py
+──────────────
+Memory-mappable model format for multi-worker deployments.
+
+A pickled IsolationForest cannot be shared between gunicorn workers: every
+worker decompresses the bundle and sklearn copies each tree into its own
+heap buffer. This module flattens the forest and the StandardScaler into a
+handful of plain NumPy arrays, written uncompressed with joblib:
+
+    models/<brand>/<mode>_<motorcycle_id>.flat.joblib
+
+joblib.load(..., mmap_mode="r") maps those arrays read-only, so all workers
+share one copy through the OS page cache and loading is a few page faults
+instead of a zlib decompress. FlatForest/FlatScaler score exactly like the
+sklearn objects they were built from (same float32 split test, same tree
+order for the depth sum), and expose the methods the rest of the backend
+uses: predict, decision_function, score_samples, transform, mean_, scale_.
+
+Convert existing bundles with:  python model_store.py [models_dir]
+"""
+
+import glob
+import os
+import sys
+
+import joblib
+import numpy as np
+from sklearn.ensemble._iforest import _average_path_length
+
+FLAT_SUFFIX = ".flat.joblib"
+FLAT_FORMAT = "flat-iforest-v1"
+
+
+# ───── Flattening ─────
+def flatten(model, scaler) -> dict:
+    """IsolationForest + StandardScaler → dict of arrays (global node ids)."""
+    n_features = model.n_features_in_
+    subsample = model._max_features != n_features
+    roots, left, right, feature, threshold, missing_left, leaf_depth = [], [], [], [], [], [], []
+    offset = 0
+
+    for estimator, features, path_lengths, avg_lengths in zip(
+            model.estimators_, model.estimators_features_,
+            model._decision_path_lengths, model._average_path_length_per_tree):
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        tree_features = np.asarray(features)[tree.feature] if subsample else tree.feature
+
+        roots.append(offset)
+        left.append(np.where(is_leaf, -1, tree.children_left + offset))
+        right.append(np.where(is_leaf, -1, tree.children_right + offset))
+        feature.append(np.where(is_leaf, 0, tree_features))
+        threshold.append(tree.threshold)
+        missing_left.append(tree.missing_go_to_left.astype(bool))
+        leaf_depth.append(path_lengths + avg_lengths - 1.0)
+        offset += tree.node_count
+
+    mean = getattr(scaler, "mean_", None)
+    scale = getattr(scaler, "scale_", None)
+    return {
+        "format": FLAT_FORMAT,
+        "n_features": n_features,
+        "roots": np.asarray(roots, dtype=np.int32),
+        "left": np.concatenate(left).astype(np.int32),
+        "right": np.concatenate(right).astype(np.int32),
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float64),
+        "missing_left": np.concatenate(missing_left),
+        "leaf_depth": np.concatenate(leaf_depth).astype(np.float64),
+        "denominator": float(len(model.estimators_) * _average_path_length([model._max_samples])[0]),
+        "offset": float(model.offset_),
+        "scaler_mean": np.zeros(scaler.n_features_in_) if mean is None else np.asarray(mean, dtype=np.float64),
+        "scaler_scale": np.ones(scaler.n_features_in_) if scale is None else np.asarray(scale, dtype=np.float64)
+    }
+
+
+def save_flat(path, model, scaler):
+    """Write the flat bundle atomically (temp file + os.replace)."""
+    tmp_path = path + ".tmp"
+    joblib.dump(flatten(model, scaler), tmp_path)  # uncompressed, so it can be mmapped
+    os.replace(tmp_path, path)
+
+
+def load_flat(path):
+    """(FlatForest, FlatScaler) backed by read-only memory maps of `path`."""
+    arrays = joblib.load(path, mmap_mode="r")
+    if arrays.get("format") != FLAT_FORMAT:
+        raise ValueError(f"{path} is not a {FLAT_FORMAT} bundle")
+    return FlatForest(arrays), FlatScaler(arrays["scaler_mean"], arrays["scaler_scale"])
+
+
+# ───── Scoring ─────
+class FlatScaler:
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+
+class FlatForest:
+    def __init__(self, arrays):
+        self.n_features_in_ = arrays["n_features"]
+        self.roots = arrays["roots"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.missing_left = arrays["missing_left"]
+        self.leaf_depth = arrays["leaf_depth"]
+        self.denominator = arrays["denominator"]
+        self.offset_ = arrays["offset"]
+
+    def _leaves(self, X):
+        """Leaf node of every (sample, tree), walking all trees level by level."""
+        node = np.repeat(np.asarray(self.roots)[None, :], X.shape[0], axis=0)
+        rows = np.arange(X.shape[0])[:, None]
+        while True:
+            left = self.left[node]
+            inner = left != -1
+            if not inner.any():
+                return node
+            x = X[rows, self.feature[node]]
+            go_left = np.where(np.isnan(x), self.missing_left[node], x <= self.threshold[node])
+            node = np.where(inner, np.where(go_left, left, self.right[node]), node)
+
+    def score_samples(self, X):
+        X = np.asarray(X, dtype=np.float32)  # sklearn trees split on float32 inputs
+        terms = self.leaf_depth[self._leaves(X)]
+        depths = np.zeros(X.shape[0])
+        for t in range(terms.shape[1]):  # tree order, like sklearn, for identical sums
+            depths += terms[:, t]
+        scores = 2 ** (-np.divide(depths, self.denominator, out=np.ones_like(depths),
+                                  where=self.denominator != 0))
+        return -scores
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+
+# ───── Conversion CLI ─────
+def convert_dir(base_dir):
+    """Write a flat bundle next to every pickle that lacks an up-to-date one."""
+    converted = 0
+    for pkl in glob.glob(os.path.join(base_dir, "*", "*.pkl")):
+        flat = pkl[:-len(".pkl")] + FLAT_SUFFIX
+        if os.path.exists(flat) and os.path.getmtime(flat) >= os.path.getmtime(pkl):
+            continue
+        bundle = joblib.load(pkl)
+        save_flat(flat, bundle["model"], bundle["scaler"])
+        print(f"Converted {pkl} → {flat}")
+        converted += 1
+    return converted
+
+
+if __name__ == "__main__":
+    base = sys.argv[1] if len(sys.argv) > 1 else "models"
+    print(f"Converted {convert_dir(base)} model(s) in {base}")
@@ -0,0 +1,221 @@
+"""
+mqtt_dispatcher.py
+──────────────────
+Runs MQTT commands on a worker pool instead of paho's network thread.
+
+  • MQTT_COMMAND_WORKERS threads take commands from a queue of at most
+    MQTT_COMMAND_QUEUE_MAX entries, so a slow InfluxDB query no longer
+    stalls the other commands or the broker keep-alive.
+  • Each concurrency group (by default the command name) has its own
+    limit, MQTT_COMMAND_LIMITS="predict=4,predict-from-csv=1". A worker
+    takes the oldest queued command whose group has room, so a saturated
+    command never blocks the others. start-obd/stop-obd share the "obd"
+    group with a limit of 1, so they run one at a time and in order.
+  • When the queue is full, MQTT_COMMAND_DROP_POLICY decides what is
+    dropped: "reject" refuses the new command, "drop-oldest" evicts the
+    oldest queued one. Commands queued longer than MQTT_COMMAND_TTL seconds
+    are dropped instead of run, since nobody waits for their reply anymore.
+    Dropped commands get a "busy"/"expired" reply.
+  • A "request_id" in the command payload is copied into every reply.
+  • Received/completed/error/drop counts and queue/run latencies per
+    command are kept for /metrics. Commands outside the handler's known set
+    are counted (and limited) together as "unknown", so arbitrary payloads
+    cannot grow the tables.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+MQTT_COMMAND_WORKERS = int(os.getenv("MQTT_COMMAND_WORKERS", 8))
+MQTT_COMMAND_QUEUE_MAX = int(os.getenv("MQTT_COMMAND_QUEUE_MAX", 100))
+MQTT_COMMAND_TTL = float(os.getenv("MQTT_COMMAND_TTL", 30))
+MQTT_COMMAND_DROP_POLICY = os.getenv("MQTT_COMMAND_DROP_POLICY", "reject")  # reject | drop-oldest
+
+COMMAND_GROUPS = {"start-obd": "obd", "stop-obd": "obd"}
+DEFAULT_LIMITS = {"obd": 1, "predict-from-csv": 1, "predict-batch": 2, "train-fleet": 1}
+DEFAULT_GROUP_LIMIT = 4
+UNKNOWN_COMMAND = "unknown"
+LATENCY_SAMPLES = 256  # recent run times kept per command for the p95
+
+
+def parse_limits(spec, defaults=DEFAULT_LIMITS):
+    """'predict=4,recent-data=2' → {group: limit}, on top of the defaults."""
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, limit = item.partition("=")
+        limits[name.strip()] = max(1, int(limit))
+    return limits
+
+
+class _Job:
+    __slots__ = ("command", "name", "group", "payload", "request_id", "queued_at")
+
+    def __init__(self, command, name, payload):
+        self.command = command
+        self.name = name  # command, or UNKNOWN_COMMAND
+        self.group = COMMAND_GROUPS.get(name, name)
+        self.payload = payload
+        self.request_id = payload.get("request_id")
+        self.queued_at = time.monotonic()
+
+
+class _CommandStats:
+    __slots__ = ("received", "completed", "errors", "rejected", "dropped", "expired",
+                 "queue_ms_total", "queue_ms_max", "run_ms_total", "run_ms_max", "recent_run_ms")
+
+    def __init__(self):
+        self.received = self.completed = self.errors = 0
+        self.rejected = self.dropped = self.expired = 0
+        self.queue_ms_total = self.queue_ms_max = 0.0
+        self.run_ms_total = self.run_ms_max = 0.0
+        self.recent_run_ms = deque(maxlen=LATENCY_SAMPLES)
+
+    def as_dict(self):
+        started = self.completed + self.errors
+        recent = sorted(self.recent_run_ms)
+        return {
+            "received": self.received,
+            "completed": self.completed,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "queue_ms_avg": round(self.queue_ms_total / started, 2) if started else None,
+            "queue_ms_max": round(self.queue_ms_max, 2),
+            "run_ms_avg": round(self.run_ms_total / started, 2) if started else None,
+            "run_ms_p95": round(recent[int(0.95 * (len(recent) - 1))], 2) if recent else None,
+            "run_ms_max": round(self.run_ms_max, 2)
+        }
+
+
+class CommandDispatcher:
+    def __init__(self, handler, publish, commands, workers=MQTT_COMMAND_WORKERS, max_queue=MQTT_COMMAND_QUEUE_MAX,
+                 limits=None, ttl=MQTT_COMMAND_TTL, policy=MQTT_COMMAND_DROP_POLICY):
+        """
+        handler(payload, reply) runs one command; reply(dict) publishes a
+        response tagged with the command's request_id. publish(dict) sends it.
+        commands is the set of names the handler knows; anything else still
+        reaches the handler but is counted as "unknown".
+        """
+        if policy not in ("reject", "drop-oldest"):
+            raise ValueError(f"Unknown MQTT_COMMAND_DROP_POLICY: {policy}")
+        self.handler = handler
+        self.publish = publish
+        self.commands = frozenset(commands)
+        self.max_queue = max_queue
+        self.limits = parse_limits(os.getenv("MQTT_COMMAND_LIMITS")) if limits is None else limits
+        self.ttl = ttl
+        self.policy = policy
+        self.workers = max(1, workers)
+        self._queue = deque()
+        self._running = {}   # group → commands running
+        self._stats = {}     # command → _CommandStats
+        self._cond = threading.Condition()
+        for n in range(self.workers):
+            threading.Thread(target=self._worker, daemon=True, name=f"mqtt-command-{n}").start()
+
+    def _command_stats(self, command):
+        stats = self._stats.get(command)
+        if stats is None:
+            stats = self._stats[command] = _CommandStats()
+        return stats
+
+    def _reply(self, job, status):
+        if job.request_id is not None:
+            status = {**status, "request_id": job.request_id}
+        self.publish(status)
+
+    # ───── Submitting (paho network thread) ─────
+    def submit(self, payload):
+        """Queue one decoded command; returns False when it was rejected."""
+        command = payload.get("command")
+        name = command if isinstance(command, str) and command in self.commands else UNKNOWN_COMMAND
+        job = _Job(command, name, payload)
+        dropped = None
+        with self._cond:
+            stats = self._command_stats(name)
+            stats.received += 1
+            if len(self._queue) >= self.max_queue:
+                if self.policy == "reject":
+                    stats.rejected += 1
+                    dropped = job
+                else:
+                    dropped = self._queue.popleft()
+                    self._command_stats(dropped.name).dropped += 1
+            if dropped is not job:
+                self._queue.append(job)
+                self._cond.notify()
+        if dropped is not None:
+            print(f"[ERROR] MQTT command queue full, dropping {dropped.command}")
+            self._reply(dropped, {"status": "busy", "command": dropped.command,
+                                  "message": "Server busy, command dropped"})
+        return dropped is not job
+
+    # ───── Workers ─────
+    def _next_job(self):
+        """Oldest queued job whose group is below its limit (caller holds the lock)."""
+        for job in self._queue:
+            if self._running.get(job.group, 0) < self.limits.get(job.group, DEFAULT_GROUP_LIMIT):
+                self._queue.remove(job)
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running[job.group] = self._running.get(job.group, 0) + 1
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._running[job.group] -= 1
+                    self._cond.notify_all()
+
+    def _run(self, job):
+        queue_ms = (time.monotonic() - job.queued_at) * 1000
+        if queue_ms > self.ttl * 1000:
+            with self._cond:
+                self._command_stats(job.name).expired += 1
+            self._reply(job, {"status": "expired", "command": job.command,
+                              "message": f"Command waited {queue_ms / 1000:.1f}s in the queue"})
+            return
+
+        started = time.perf_counter()
+        failed = False
+        try:
+            self.handler(job.payload, lambda status: self._reply(job, status))
+        except Exception as e:
+            failed = True
+            print(f"❌ MQTT command error: {e}")
+            self._reply(job, {"status": "error", "message": str(e)})
+        run_ms = (time.perf_counter() - started) * 1000
+
+        with self._cond:
+            stats = self._command_stats(job.name)
+            if failed:
+                stats.errors += 1
+            else:
+                stats.completed += 1
+            stats.queue_ms_total += queue_ms
+            stats.queue_ms_max = max(stats.queue_ms_max, queue_ms)
+            stats.run_ms_total += run_ms
+            stats.run_ms_max = max(stats.run_ms_max, run_ms)
+            stats.recent_run_ms.append(run_ms)
+
+    # ───── Metrics ─────
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "policy": self.policy,
+                "queued": len(self._queue),
+                "running": {g: n for g, n in self._running.items() if n},
+                "commands": {c: s.as_dict() for c, s in self._stats.items()}
+            }
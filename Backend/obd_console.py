@@ -0,0 +1,220 @@
+"""
+obd_console.py
+──────────────
+Console output for the headless OBD collector.
+
+The collector runs as a child of server.py with its stdout piped, so the hot
+loop must not clear the screen or print every sample. Instead it logs
+through `logging`:
+
+  • setup_logging() installs a text or JSON-lines formatter (OBD_LOG_FORMAT)
+    and a filter that lets a repeated message through at most once per
+    OBD_LOG_REPEAT_SECONDS, reporting how many copies were suppressed.
+    Messages repeat when their formatted text is the same, so one PID's
+    failure never hides another's; extra={"rate_key": ...} groups variants
+    explicitly, and periodic lines opt out with extra={"rate_limit": False}.
+  • LiveView is an optional curses dashboard (--live) that redraws the latest
+    values and stats in place; log records are shown in its bottom pane.
+"""
+
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import curses
+except ImportError:  # Windows needs the windows-curses package
+    curses = None
+
+OBD_LOG_LEVEL = os.getenv("OBD_LOG_LEVEL", "INFO").upper()
+OBD_LOG_FORMAT = os.getenv("OBD_LOG_FORMAT", "text")  # text | json
+OBD_LOG_REPEAT_SECONDS = float(os.getenv("OBD_LOG_REPEAT_SECONDS", 30))
+
+
+# ───── Logging ─────
+class RateLimitFilter(logging.Filter):
+    """Pass records with the same message (or rate_key) at most once per `interval` seconds."""
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self._last = {}  # (logger, message or rate_key) → [last emitted at, suppressed count]
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        # Forget quiet messages; ones with suppressed copies keep their count
+        for key in [k for k, (at, suppressed) in self._last.items()
+                    if now - at >= self.interval and not suppressed]:
+            del self._last[key]
+        self._next_prune = now + self.interval
+
+    def filter(self, record):
+        if self.interval <= 0 or not getattr(record, "rate_limit", True):
+            return True
+        rate_key = getattr(record, "rate_key", None)
+        key = (record.name, record.getMessage() if rate_key is None else rate_key)
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now)
+            entry = self._last.get(key)
+            if entry and now - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+            suppressed = entry[1] if entry else 0
+            self._last[key] = [now, 0]
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{line} (+{suppressed} suppressed)" if suppressed else line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra={"fields": {...}}` is merged in."""
+
+    def format(self, record):
+        doc = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        doc.update(getattr(record, "fields", {}))
+        if getattr(record, "suppressed", 0):
+            doc["suppressed"] = record.suppressed
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        return json.dumps(doc, default=str)
+
+
+def setup_logging(handler=None):
+    """Configure the root logger for the collector process."""
+    handler = handler or logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if OBD_LOG_FORMAT == "json" else TextFormatter())
+    handler.addFilter(RateLimitFilter(OBD_LOG_REPEAT_SECONDS))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(OBD_LOG_LEVEL)
+    return handler
+
+
+# ───── Live View ─────
+class LiveView(logging.Handler):
+    """
+    curses dashboard: `render(sections)` redraws {title: {key: value}} in place,
+    and log records are kept in a small scrollback pane below it.
+    """
+
+    def __init__(self, log_lines=8, refresh_interval=0.25):
+        super().__init__()
+        self._logs = collections.deque(maxlen=log_lines)
+        self.refresh_interval = refresh_interval
+        self._next_draw = 0.0
+        self._screen = None
+
+    @staticmethod
+    def available():
+        return curses is not None and sys.stdout.isatty()
+
+    def start(self):
+        self._screen = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+        return self
+
+    def stop(self):
+        if self._screen is not None:
+            curses.nocbreak()
+            curses.echo()
+            curses.endwin()
+            self._screen = None
+
+    def emit(self, record):
+        line = self.format(record)
+        if self._screen is None:
+            # Not drawing (yet, or any more): behave like a plain stream handler
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+        else:
+            self._logs.append(line)
+
+    def render(self, sections):
+        now = time.monotonic()
+        if self._screen is None or now < self._next_draw:
+            return
+        self._next_draw = now + self.refresh_interval
+
+        lines = []
+        for title, values in sections.items():
+            lines.append(f"── {title} ──")
+            lines += [f"  {key:<22} {value}" for key, value in values.items()]
+            lines.append("")
+        lines.append("── Log ──")
+        lines += list(self._logs)
+
+        screen = self._screen
+        height, width = screen.getmaxyx()
+        screen.erase()
+        for y, line in enumerate(lines[:height - 1]):
+            try:
+                screen.addnstr(y, 0, line, width - 1)
+            except curses.error:
+                pass
+        screen.refresh()
+
+
+# ───── Loop Statistics ─────
+class LoopStats:
+    """Throughput and per-tick latency of the collector loop, per reporting window."""
+
+    def __init__(self):
+        self._reset(time.monotonic())
+        self.total_samples = 0
+
+    def _reset(self, now):
+        self._window_start = now
+        self.samples = self.stored = self.late = 0
+        self.tick_total = self.tick_max = 0.0
+
+    def tick(self, duration, stored, late):
+        self.samples += 1
+        self.total_samples += 1
+        self.stored += bool(stored)
+        self.late += bool(late)
+        self.tick_total += duration
+        self.tick_max = max(self.tick_max, duration)
+
+    def collect(self):
+        """Return the window's figures and start a new window."""
+        now = time.monotonic()
+        elapsed = max(now - self._window_start, 1e-9)
+        out = {
+            "samples_per_s": round(self.samples / elapsed, 2),
+            "stored_per_s": round(self.stored / elapsed, 2),
+            "tick_avg_ms": round(self.tick_total / self.samples * 1000, 2) if self.samples else None,
+            "tick_max_ms": round(self.tick_max * 1000, 2),
+            "late_ticks": self.late
+        }
+        self._reset(now)
+        return out
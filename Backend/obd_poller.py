@@ -0,0 +1,238 @@
+"""
+obd_poller.py
+─────────────
+Per-PID polling scheduler for the OBD collector.
+
+The ELM327 answers one PID at a time, so link time is the scarce resource.
+Instead of querying every PID on every tick, each PID gets its own rate
+(RPM and throttle fast, coolant and voltage slow) and a background thread
+always queries whichever PID is due next. A PID that keeps returning null
+is backed off exponentially and restored as soon as it answers again.
+
+The collector reads the latest value of every PID with snapshot(), or with
+its update time via readings() so a slow PID's reading is stored only once;
+stats() reports the achieved samples/sec per PID.
+"""
+
+import heapq
+import logging
+import math
+import random
+import threading
+import time
+
+import obd
+from pint.errors import OffsetUnitCalculusError
+
+log = logging.getLogger("obd_poller")
+
+# Target polling rate per PID (Hz); override with OBD_PID_HZ="RPM=10,COOLANT_TEMP=0.5"
+DEFAULT_PID_HZ = {
+    "RPM": 10.0,
+    "THROTTLE_POS": 10.0,
+    "ENGINE_LOAD": 5.0,
+    "LONG_FUEL_TRIM_1": 1.0,
+    "COOLANT_TEMP": 0.5,
+    "ELM_VOLTAGE": 0.5
+}
+
+NULL_BACKOFF_AFTER = 3      # consecutive nulls before a PID is slowed down
+MAX_BACKOFF_INTERVAL = 30.0  # slowest rate (s) a null PID is backed off to
+
+
+def parse_pid_rates(spec, defaults=DEFAULT_PID_HZ):
+    """'RPM=10,COOLANT_TEMP=0.5' → {name: hz}, on top of the defaults."""
+    rates = dict(defaults)
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, hz = item.partition("=")
+        name = name.strip().upper()
+        if not obd.commands.has_name(name):
+            raise ValueError(f"Unknown OBD command in OBD_PID_HZ: {name}")
+        rates[name] = float(hz)
+    return {name: hz for name, hz in rates.items() if hz > 0}
+
+
+def read_value(cmd, response):
+    """OBDResponse → rounded float in the units the collector stores, or None."""
+    if response.is_null() or response.value is None:
+        return None
+    try:
+        if cmd == obd.commands.COOLANT_TEMP:
+            value = float(response.value.to("degC").magnitude)
+        else:
+            value = float(response.value.magnitude)
+        return round(value, 2)
+    except OffsetUnitCalculusError as ex:
+        log.error("Offset unit error for %s: %s", cmd.name, ex)
+    except Exception as ex:
+        log.error("Failed to parse %s: %s", cmd.name, ex)
+    return None
+
+
+class _Pid:
+    __slots__ = ("cmd", "interval", "base_interval", "nulls_in_row", "value",
+                 "updated_at", "samples", "nulls",
+                 "window_samples", "window_queries", "window_latency")
+
+    def __init__(self, cmd, hz):
+        self.cmd = cmd
+        self.base_interval = self.interval = 1.0 / hz
+        self.nulls_in_row = 0
+        self.value = None
+        self.updated_at = None
+        self.samples = self.nulls = 0
+        self.window_samples = self.window_queries = 0
+        self.window_latency = 0.0
+
+
+class PidPoller(threading.Thread):
+    """Earliest-deadline-first polling of each PID at its own rate."""
+
+    def __init__(self, connection, rates):
+        super().__init__(daemon=True, name="obd-poller")
+        self.connection = connection
+        self._pids = [_Pid(obd.commands[name], hz) for name, hz in rates.items()]
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._window_start = time.monotonic()
+
+    @property
+    def names(self):
+        return [p.cmd.name for p in self._pids]
+
+    def run(self):
+        now = time.monotonic()
+        # Spread first deadlines over one interval so PIDs don't start in lockstep
+        queue = [(now + random.uniform(0, p.interval), i) for i, p in enumerate(self._pids)]
+        heapq.heapify(queue)
+
+        while not self._stop_event.is_set():
+            due, i = queue[0]
+            delay = due - time.monotonic()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+            pid = self._pids[i]
+
+            started = time.monotonic()
+            try:
+                value = read_value(pid.cmd, self.connection.query(pid.cmd))
+            except Exception as e:
+                log.error("Query %s failed: %s", pid.cmd.name, e)
+                value = None
+            finished = time.monotonic()
+            self._record(pid, value, finished - started)
+
+            # Fixed-rate per PID; never try to catch up on missed slots
+            heapq.heapreplace(queue, (max(due + pid.interval, finished), i))
+
+    def _record(self, pid, value, latency):
+        with self._lock:
+            pid.window_latency += latency
+            pid.window_queries += 1
+            if value is None:
+                pid.nulls += 1
+                pid.nulls_in_row += 1
+                if pid.nulls_in_row == NULL_BACKOFF_AFTER:
+                    log.info("%s returned null %dx, backing off.", pid.cmd.name, NULL_BACKOFF_AFTER)
+                if pid.nulls_in_row >= NULL_BACKOFF_AFTER:
+                    pid.interval = min(pid.interval * 2, max(MAX_BACKOFF_INTERVAL, pid.base_interval))
+                    pid.value = None
+                return
+            if pid.interval != pid.base_interval:
+                log.info("%s is answering again, restoring its rate.", pid.cmd.name)
+            pid.nulls_in_row = 0
+            pid.interval = pid.base_interval
+            pid.value = value
+            pid.updated_at = time.time()
+            pid.samples += 1
+            pid.window_samples += 1
+
+    def snapshot(self):
+        """Latest value of every PID ({cmd.name: value}); None until it has answered."""
+        with self._lock:
+            return {p.cmd.name: p.value for p in self._pids}
+
+    def readings(self):
+        """Latest (value, updated_at) of every PID; updated_at is None until it has answered."""
+        with self._lock:
+            return {p.cmd.name: (p.value, p.updated_at) for p in self._pids}
+
+    def stats(self):
+        """
+        Achieved samples/sec per PID since the previous call, next to its
+        target rate, current (possibly backed-off) rate and query latency.
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._window_start, 1e-9)
+            out = {}
+            for p in self._pids:
+                queries = p.window_queries
+                out[p.cmd.name] = {
+                    "target_hz": round(1.0 / p.base_interval, 2),
+                    "current_hz": round(1.0 / p.interval, 2),
+                    "achieved_hz": round(p.window_samples / elapsed, 2),
+                    "samples": p.samples,
+                    "nulls": p.nulls,
+                    "avg_latency_ms": round(p.window_latency / queries * 1000, 1) if queries else None
+                }
+                p.window_samples = p.window_queries = 0
+                p.window_latency = 0.0
+            self._window_start = now
+            return out
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=5)
+
+
+# ───── Simulated ELM327 ─────
+class _SimResponse:
+    """Just enough of obd.OBDResponse for read_value()."""
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def is_null(self):
+        return self.value is None
+
+
+class SimulatedConnection:
+    """
+    Stand-in for obd.OBD that answers like an idling bike, with per-query
+    latency like a real ELM327 link. Lets the collector run without hardware.
+    """
+
+    IDLE = {
+        "RPM": (1500.0, 120.0, obd.Unit.rpm),
+        "THROTTLE_POS": (14.0, 1.5, obd.Unit.percent),
+        "ENGINE_LOAD": (22.0, 3.0, obd.Unit.percent),
+        "LONG_FUEL_TRIM_1": (2.0, 1.0, obd.Unit.percent),
+        "COOLANT_TEMP": (88.0, 0.5, obd.Unit.degC),
+        "ELM_VOLTAGE": (13.8, 0.1, obd.Unit.volt)
+    }
+
+    def __init__(self, latency=0.03, unsupported=()):
+        self.latency = latency
+        self.unsupported = set(unsupported)
+        self._connected = True
+        self._started = time.monotonic()
+
+    def is_connected(self):
+        return self._connected
+
+    def supports(self, cmd):
+        return cmd.name in self.IDLE and cmd.name not in self.unsupported
+
+    def query(self, cmd):
+        time.sleep(self.latency)
+        if not self._connected or not self.supports(cmd):
+            return _SimResponse()
+        mean, spread, unit = self.IDLE[cmd.name]
+        wave = math.sin((time.monotonic() - self._started) / 5.0)
+        value = mean + spread * (0.6 * wave + 0.4 * random.uniform(-1, 1))
+        return _SimResponse(obd.Unit.Quantity(value, unit))
+
+    def close(self):
+        self._connected = False
@@ -0,0 +1,259 @@
+"""
+obd_spool.py
+────────────
+Durable, append-only spool for the OBD collector.
+
+Samples are appended as line-protocol lines to numbered segment files. A
+drainer thread uploads the backlog in large batches and commits its read
+offset only after InfluxDB acknowledged the batch, so a killed collector
+resumes exactly where it left off. Disk usage is capped: when the spool
+outgrows max_bytes the oldest segments are dropped.
+
+Layout of a spool directory:
+
+    00000000000000000001.log   ← oldest segment
+    00000000000000000002.log   ← active segment (appends go here)
+    offset.json                ← {"segment": 1, "pos": 4096}, replaced atomically
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+SEGMENT_SUFFIX = ".log"
+OFFSET_FILE = "offset.json"
+
+log = logging.getLogger("obd_spool")
+
+
+def _segment_name(seq):
+    return f"{seq:020d}{SEGMENT_SUFFIX}"
+
+
+class Spool:
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024,
+                 max_bytes=256 * 1024 * 1024, fsync_every=25):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self._lock = threading.Lock()
+        self.stats = {"appended": 0, "committed": 0, "dropped_bytes": 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        self._offset = self._load_offset()
+
+        # Always start a fresh active segment, so a torn tail left by a crash
+        # is never appended to.
+        self._active = None
+        self._unsynced = 0
+        self._open_segment((self._segments[-1] + 1) if self._segments else 1)
+
+    # ───── Offsets ─────
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_offset(self):
+        try:
+            with open(self._path(OFFSET_FILE)) as f:
+                data = json.load(f)
+            return int(data["segment"]), int(data["pos"])
+        except (OSError, ValueError, KeyError):
+            return (self._segments[0] if self._segments else 1), 0
+
+    def _store_offset(self, segment, pos):
+        tmp = self._path(OFFSET_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"segment": segment, "pos": pos}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(OFFSET_FILE))
+        self._offset = (segment, pos)
+
+    # ───── Writing ─────
+    def _open_segment(self, seq):
+        if self._active is not None:
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._active.close()
+        self._active = open(self._path(_segment_name(seq)), "ab")
+        self._active_seq = seq
+        if seq not in self._segments:
+            self._segments.append(seq)
+
+    def append(self, line: str):
+        data = line.rstrip("\n").encode() + b"\n"
+        with self._lock:
+            self._active.write(data)
+            self._active.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                os.fsync(self._active.fileno())
+                self._unsynced = 0
+            self.stats["appended"] += 1
+
+            if self._active.tell() >= self.segment_bytes:
+                self._open_segment(self._active_seq + 1)
+                self._enforce_limit()
+
+    def _size(self):
+        total = 0
+        for seq in self._segments:
+            try:
+                total += os.path.getsize(self._path(_segment_name(seq)))
+            except OSError:
+                pass
+        return total
+
+    def _enforce_limit(self):
+        """Drop the oldest closed segments until the spool fits in max_bytes."""
+        while len(self._segments) > 1 and self._size() > self.max_bytes:
+            seq = self._segments.pop(0)
+            path = self._path(_segment_name(seq))
+            size = os.path.getsize(path)
+            segment, pos = self._offset
+            if segment <= seq:
+                self.stats["dropped_bytes"] += size - (pos if segment == seq else 0)
+                self._store_offset(self._segments[0], 0)
+            os.remove(path)
+            log.warning("Disk budget exceeded, dropped segment %d", seq)
+
+    # ───── Reading ─────
+    def read_batch(self, max_lines):
+        """
+        Return (lines, position) starting at the committed offset. Pass the
+        position to commit() once the lines are safely stored.
+        """
+        with self._lock:
+            self._active.flush()
+            segment, pos = self._offset
+            active = self._active_seq
+
+        while True:
+            path = self._path(_segment_name(segment))
+            try:
+                with open(path, "rb") as f:
+                    f.seek(pos)
+                    lines = []
+                    while len(lines) < max_lines:
+                        line = f.readline()
+                        if not line.endswith(b"\n"):
+                            break  # end of data, or a torn tail from a crash
+                        lines.append(line[:-1].decode())
+                        pos += len(line)
+            except FileNotFoundError:
+                lines = []
+
+            if lines or segment >= active:
+                return lines, (segment, pos)
+            # Finished a closed segment: continue with the next one
+            segment, pos = self._next_segment(segment), 0
+
+    def _next_segment(self, segment):
+        with self._lock:
+            later = [s for s in self._segments if s > segment]
+        return later[0] if later else self._active_seq
+
+    def commit(self, position, count=0):
+        """Persist the read offset and delete fully consumed segments."""
+        segment, pos = position
+        with self._lock:
+            if position == self._offset and not count:
+                return
+            self._store_offset(segment, pos)
+            self.stats["committed"] += count
+            for seq in [s for s in self._segments if s < segment]:
+                self._segments.remove(seq)
+                try:
+                    os.remove(self._path(_segment_name(seq)))
+                except OSError:
+                    pass
+
+    def backlog_bytes(self):
+        with self._lock:
+            segment, pos = self._offset
+            return max(self._size() - pos, 0) if self._segments else 0
+
+    def close(self):
+        with self._lock:
+            if self._active is not None:
+                self._active.flush()
+                os.fsync(self._active.fileno())
+                self._active.close()
+                self._active = None
+
+
+class SpoolDrainer(threading.Thread):
+    """Uploads spooled lines in batches, backing off with jitter while offline."""
+
+    def __init__(self, spool, write_lines, batch_lines=5000, idle_interval=1.0,
+                 retry_interval=5.0, max_retry_delay=30.0, jitter=0.2):
+        super().__init__(daemon=True, name="spool-drainer")
+        self.spool = spool
+        self.write_lines = write_lines
+        self.batch_lines = batch_lines
+        self.idle_interval = idle_interval
+        self.retry_interval = retry_interval
+        self.max_retry_delay = max_retry_delay
+        self.jitter = jitter
+        self._stop_event = threading.Event()
+        self.stats = {"batches": 0, "lines": 0, "failures": 0, "last_upload_ms": None}
+
+    def drain_once(self):
+        """Upload one batch; returns the number of lines written (0 when idle)."""
+        lines, position = self.spool.read_batch(self.batch_lines)
+        if not lines:
+            self.spool.commit(position)
+            return 0
+        started = time.perf_counter()
+        self.write_lines(lines)
+        self.stats["last_upload_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        self.spool.commit(position, len(lines))
+        self.stats["batches"] += 1
+        self.stats["lines"] += len(lines)
+        return len(lines)
+
+    def run(self):
+        delay = self.retry_interval
+        while not self._stop_event.is_set():
+            try:
+                written = self.drain_once()
+                delay = self.retry_interval
+                if written < self.batch_lines:
+                    self._stop_event.wait(self.idle_interval)
+            except Exception as e:
+                self.stats["failures"] += 1
+                log.warning("Upload failed, retrying in %.1fs: %s", delay, e)
+                self._stop_event.wait(delay + random.uniform(0, self.jitter))
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def stop(self, final_drain=True, timeout=None):
+        """
+        Stop the thread, then drain what is left until the spool is empty or
+        `timeout` seconds (join included) have passed. If the thread is still
+        inside an upload, nothing more is drained: the batch would be sent
+        twice and both threads would commit. The backlog stays on disk.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=self.max_retry_delay if timeout is None else timeout)
+        if self.is_alive():
+            log.warning("Upload still running at shutdown, backlog kept on disk")
+            return
+        if not final_drain:
+            return
+        try:
+            while self.drain_once():
+                if deadline is not None and time.monotonic() >= deadline:
+                    log.warning("Final drain out of time, backlog kept on disk")
+                    break
+        except Exception as e:
+            log.error("Final drain incomplete, backlog kept on disk: %s", e)
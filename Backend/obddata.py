@@ -2,17 +2,42 @@ import obd
 import os
 import time
 import json
-import sys
 import ssl
+import signal
+import argparse
+import logging
 import paho.mqtt.client as mqtt
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+from influxdb_client import Point, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
 from urllib.parse import urlparse
-from pint.errors import OffsetUnitCalculusError
+import influx_pool
+from influx_pool import INFLUXDB_BUCKET
+from obd_poller import PidPoller, SimulatedConnection, parse_pid_rates
+from obd_console import LiveView, LoopStats, setup_logging
+from obd_spool import Spool, SpoolDrainer
+from telemetry_codec import BINARY_SUFFIX, TelemetryBatcher
 
 # ───── Load Environment Variables ─────
 from dotenv import load_dotenv
 load_dotenv()
 
+# ───── Command Line ─────
+parser = argparse.ArgumentParser(description="Collect OBD-II data from a motorcycle.")
+parser.add_argument("motorcycle_id", nargs="?", help="ID the samples are tagged with")
+parser.add_argument("--port", default=os.getenv("OBD_PORT", "COM3"), help="Serial port of the ELM327 adapter")
+parser.add_argument("--simulate", action="store_true", help="Use a simulated ELM327 instead of real hardware")
+parser.add_argument("--live", action="store_true", help="Show a live curses view instead of log lines")
+args = parser.parse_args()
+
+# ───── Logging ─────
+# Headless by default: rate-limited log lines on stdout, which server.py reads
+# through a pipe. --live swaps them for an in-place curses dashboard.
+log = logging.getLogger("obddata")
+live_view = LiveView() if args.live and LiveView.available() else None
+setup_logging(live_view)
+if args.live and live_view is None:
+    log.warning("--live needs curses and a terminal; running headless.")
+
 
 # ───── MQTT Setup ─────
 mqtt_url = os.getenv("MQTT_BROKER_URL", "mqtts://ha62a160.ala.asia-southeast1.emqxsl.com:8883")
@@ -33,127 +58,249 @@ mqtt_client.tls_set(cert_reqs=ssl.CERT_REQUIRED)
 mqtt_client.tls_insecure_set(False)
 
 def on_connect(client, userdata, flags, rc):
-    print(f"[MQTT] Connected to broker with result code {rc}")
+    log.info("MQTT connected to broker with result code %s", rc)
+
+# Live telemetry codec: "json" (one message per sample), "binary" (packed
+# micro-batches on <topic>/bin, see telemetry_codec.py) or "both"
+OBD_TELEMETRY_CODEC = os.getenv("OBD_TELEMETRY_CODEC", "json").lower()
+OBD_TELEMETRY_BATCH = int(os.getenv("OBD_TELEMETRY_BATCH", 5))  # samples per binary publish
+if OBD_TELEMETRY_CODEC not in ("json", "binary", "both"):
+    raise ValueError("OBD_TELEMETRY_CODEC must be json, binary or both")
 
 mqtt_client.on_connect = on_connect
 mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 30)
 mqtt_client.loop_start()
 
+# ───── Sampling Configuration ─────
+# Each PID is polled at its own rate (OBD_PID_HZ) by a background poller; the
+# main loop takes a snapshot of the latest values OBD_SAMPLE_HZ times a second
+# and stores every STORE_EVERY-th snapshot in InfluxDB, with only the PIDs
+# that answered since the last stored one.
+OBD_PID_HZ = parse_pid_rates(os.getenv("OBD_PID_HZ"))
+OBD_SAMPLE_HZ = float(os.getenv("OBD_SAMPLE_HZ", 5))
+OBD_STORE_HZ = float(os.getenv("OBD_STORE_HZ", OBD_SAMPLE_HZ))
+OBD_STATS_INTERVAL = float(os.getenv("OBD_STATS_INTERVAL", 10))  # seconds between stats lines
+
+SAMPLE_INTERVAL = 1.0 / OBD_SAMPLE_HZ
+STORE_EVERY = max(1, round(OBD_SAMPLE_HZ / OBD_STORE_HZ))  # store every Nth sample
+
 # ───── InfluxDB Setup ─────
-INFLUXDB_URL = os.getenv("INFLUX_URL")
-INFLUXDB_TOKEN = os.getenv("INFLUX_TOKEN")
-INFLUXDB_ORG = os.getenv("INFLUX_ORG")
-INFLUXDB_BUCKET = os.getenv("INFLUX_BUCKET")
-
-influx_client = InfluxDBClient(
-    url=INFLUXDB_URL,
-    token=INFLUXDB_TOKEN,
-    org=INFLUXDB_ORG
-)
-write_api = influx_client.write_api(write_options=WriteOptions(batch_size=1))
+# Every sample is appended to a local on-disk spool first; a background drainer
+# uploads the backlog in large line-protocol batches, so the polling loop never
+# waits on the network and nothing is lost while InfluxDB is unreachable.
+INFLUX_BATCH_SIZE = int(os.getenv("INFLUX_BATCH_SIZE", 5_000))
+INFLUX_FLUSH_MS = int(os.getenv("INFLUX_FLUSH_MS", 1_000))
+INFLUX_JITTER_MS = int(os.getenv("INFLUX_JITTER_MS", 200))
+INFLUX_RETRY_MS = int(os.getenv("INFLUX_RETRY_MS", 5_000))
+INFLUX_MAX_RETRY_DELAY_MS = int(os.getenv("INFLUX_MAX_RETRY_DELAY_MS", 30_000))
+
+OBD_SPOOL_DIR = os.getenv("OBD_SPOOL_DIR", "spool")
+OBD_SPOOL_MAX_MB = int(os.getenv("OBD_SPOOL_MAX_MB", 256))
+OBD_SPOOL_SEGMENT_MB = int(os.getenv("OBD_SPOOL_SEGMENT_MB", 4))
+# server.py sends SIGKILL this long after SIGTERM; the final drain must end first
+OBD_STOP_TIMEOUT = float(os.getenv("OBD_STOP_TIMEOUT", 5))
+OBD_DRAIN_SECONDS = float(os.getenv("OBD_DRAIN_SECONDS", OBD_STOP_TIMEOUT * 0.6))
+
+write_api = influx_pool.get_write_api(write_options=SYNCHRONOUS)
+
+def upload_lines(lines):
+    write_api.write(bucket=INFLUXDB_BUCKET, record=lines, write_precision=WritePrecision.NS)
 
 # ───── Motorcycle ID ─────
-if len(sys.argv) < 2:
-    print("[WARNING] No motorcycle_id provided. Using 'unknown'.")
+if not args.motorcycle_id:
+    log.warning("No motorcycle_id provided. Using 'unknown'.")
     MOTORCYCLE_ID = "unknown"
 else:
-    MOTORCYCLE_ID = sys.argv[1]
+    MOTORCYCLE_ID = args.motorcycle_id
 
 MQTT_TOPIC = f"obd/motorcycle/{MOTORCYCLE_ID}/data"
+MQTT_BIN_TOPIC = MQTT_TOPIC + BINARY_SUFFIX
+
+telemetry_batcher = TelemetryBatcher(OBD_TELEMETRY_BATCH) if OBD_TELEMETRY_CODEC != "json" else None
 
-def write_to_influxdb(obd_data, motorcycle_id):
+def publish_telemetry(obd_data, sample_ns):
+    if OBD_TELEMETRY_CODEC != "binary":
+        payload_data = {k: v for k, v in obd_data.items() if v is not None}
+        payload = {
+            "motorcycle_id": MOTORCYCLE_ID,
+            "data": payload_data
+        }
+        mqtt_client.publish(MQTT_TOPIC, json.dumps(payload))
+        log.debug("Published %s", payload_data)
+    if telemetry_batcher:
+        frame = telemetry_batcher.add(sample_ns // 1_000_000, obd_data)
+        if frame:
+            mqtt_client.publish(MQTT_BIN_TOPIC, frame)
+
+spool = Spool(
+    os.path.join(OBD_SPOOL_DIR, str(MOTORCYCLE_ID)),
+    segment_bytes=OBD_SPOOL_SEGMENT_MB * 1024 * 1024,
+    max_bytes=OBD_SPOOL_MAX_MB * 1024 * 1024,
+)
+drainer = SpoolDrainer(
+    spool,
+    upload_lines,
+    batch_lines=INFLUX_BATCH_SIZE,
+    idle_interval=INFLUX_FLUSH_MS / 1000,
+    retry_interval=INFLUX_RETRY_MS / 1000,
+    max_retry_delay=INFLUX_MAX_RETRY_DELAY_MS / 1000,
+    jitter=INFLUX_JITTER_MS / 1000,
+)
+drainer.start()
+
+# stop_obd_internal() terminates us with SIGTERM: unwind through `finally`
+# so the spool is synced and a final drain is attempted.
+def _handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+signal.signal(signal.SIGTERM, _handle_sigterm)
+
+def write_to_influxdb(obd_data, motorcycle_id, timestamp_ns=None):
     point = Point("obd_data").tag("motorcycle_id", motorcycle_id)
+    point = point.time(timestamp_ns or time.time_ns(), WritePrecision.NS)
     for cmd, value in obd_data.items():
         if value is not None:
             try:
                 val_float = float(value)
                 point = point.field(cmd.lower(), val_float)
             except (ValueError, TypeError):
-                print(f"[WARNING] Could not convert value to float for {cmd}: {value}")
-    write_api.write(bucket=INFLUXDB_BUCKET, record=point)
-    print(f"[InfluxDB] Wrote: {obd_data}")
+                log.warning("Could not convert value to float for %s: %s", cmd, value)
+    line = point.to_line_protocol()
+    if not line:
+        return False  # no new reading since the last stored sample
+    spool.append(line)
+    return True
+
+def fresh_values(readings, stored_at):
+    """
+    Values of the PIDs that answered since they were last stored. A slow PID
+    (0.5 Hz coolant or voltage) is then written once per reading instead of
+    repeated on every tick, which would shrink its window std and skew the
+    min/max features; until it answers again it is absent from the sample.
+    `stored_at` ({name: updated_at}) is updated in place.
+    """
+    fresh = {}
+    for name, (value, updated_at) in readings.items():
+        if value is not None and updated_at is not None and updated_at != stored_at.get(name):
+            fresh[name] = value
+            stored_at[name] = updated_at
+    return fresh
+
+def log_stats(loop_stats, poller):
+    """One stats line: loop throughput/latency, PID rates and upload backlog."""
+    stats = loop_stats.collect()
+    pids = poller.stats()
+    stats["pid_hz"] = {name: p["achieved_hz"] for name, p in pids.items()}
+    stats["query_ms"] = {name: p["avg_latency_ms"] for name, p in pids.items()}
+    stats["spool_backlog_kb"] = round(spool.backlog_bytes() / 1024, 1)
+    stats["uploaded_lines"] = drainer.stats["lines"]
+    stats["upload_failures"] = drainer.stats["failures"]
+    stats["last_upload_ms"] = drainer.stats["last_upload_ms"]
+    log.info(
+        "stats samples/s=%s stored/s=%s tick_avg_ms=%s tick_max_ms=%s late=%s "
+        "backlog_kb=%s uploaded=%s upload_failures=%s pid_hz=%s",
+        stats["samples_per_s"], stats["stored_per_s"], stats["tick_avg_ms"],
+        stats["tick_max_ms"], stats["late_ticks"], stats["spool_backlog_kb"],
+        stats["uploaded_lines"], stats["upload_failures"],
+        ",".join(f"{name}:{hz}" for name, hz in stats["pid_hz"].items()),
+        extra={"fields": {"stats": stats}, "rate_limit": False},
+    )
+    return stats
+
+def render_live(obd_data, stats):
+    live_view.render({
+        f"Motorcycle {MOTORCYCLE_ID}": {name: "-" if v is None else v for name, v in obd_data.items()},
+        f"Stats (every {OBD_STATS_INTERVAL:g}s)": {
+            key: value for key, value in stats.items() if not isinstance(value, dict)
+        },
+        "PID rates (Hz)": stats.get("pid_hz", {})
+    })
 
 # ───── Connect to OBD ─────
-port = "COM3"
-print(f"[OBD] Attempting to connect on {port}...")
+port = args.port
 
 try:
-    connection = obd.OBD(portstr=port, fast=True, timeout=3)
+    if args.simulate:
+        log.info("Using simulated ELM327")
+        connection = SimulatedConnection()
+    else:
+        log.info("Attempting to connect on %s...", port)
+        connection = obd.OBD(portstr=port, fast=True, timeout=3)
 
     if connection.is_connected():
-        print(f"[OBD] Successfully connected on {port}")
+        log.info("Successfully connected on %s", "simulator" if args.simulate else port)
 
         if not connection.supports(obd.commands.LONG_FUEL_TRIM_1):
-            print("[WARNING] LONG_FUEL_TRIM_1 not supported.")
+            log.warning("LONG_FUEL_TRIM_1 not supported.")
 
-        commands = [
-            obd.commands.RPM,
-            obd.commands.COOLANT_TEMP,
-            obd.commands.ENGINE_LOAD,
-            obd.commands.ELM_VOLTAGE,
-            obd.commands.THROTTLE_POS,
-            obd.commands.LONG_FUEL_TRIM_1
-        ]
+        poller = PidPoller(connection, OBD_PID_HZ)
+        poller.start()
 
-        last_write_time = time.time()
-        print("[INFO] Gathering OBD data... Press Ctrl+C to stop.")
+        loop_stats = LoopStats()
+        last_stats = {}
+        stored_at = {}  # PID name → updated_at of its last stored reading
+        next_tick = time.monotonic()
+        next_stats = next_tick + OBD_STATS_INTERVAL
+        rates = ", ".join(f"{name} {hz:g} Hz" for name, hz in OBD_PID_HZ.items())
+        log.info("Polling %s; sampling at %g Hz, storing every %d sample(s)... Press Ctrl+C to stop.",
+                 rates, OBD_SAMPLE_HZ, STORE_EVERY)
+        if live_view:
+            live_view.start()
 
         try:
             while True:
-                os.system('cls' if os.name == 'nt' else 'clear')
-                obd_data = {}
-
-                for cmd in commands:
-                    response = connection.query(cmd)
-                    if response.is_null():
-                        print(f"[DEBUG] {cmd.name} returned null.")
-                        value = None
-                    else:
-                        try:
-                            if response.value is not None:
-                                if cmd == obd.commands.COOLANT_TEMP:
-                                    value = float(response.value.to("degC").magnitude)
-                                else:
-                                    value = float(response.value.magnitude)
-                                value = round(value, 2)
-                            else:
-                                value = None
-                        except OffsetUnitCalculusError as ex:
-                            print(f"[ERROR] Offset unit error for {cmd.name}: {ex}")
-                            value = None
-                        except Exception as ex:
-                            print(f"[ERROR] Failed to parse {cmd.name}: {ex}")
-                            value = None
-
-                    obd_data[cmd.name] = value
-
-                payload_data = {k: v for k, v in obd_data.items() if v is not None}
-                payload = {
-                    "motorcycle_id": MOTORCYCLE_ID,
-                    "data": payload_data
-                }
-
-                mqtt_client.publish(MQTT_TOPIC, json.dumps(payload))
-                print(f"[MQTT] Published:\n{json.dumps(payload, indent=2)}")
-
-                if time.time() - last_write_time >= 5:
-                    write_to_influxdb(obd_data, MOTORCYCLE_ID)
-                    last_write_time = time.time()
-
-                time.sleep(0.2)
+                tick_start = time.monotonic()
+                sample_ns = time.time_ns()
+                readings = poller.readings()
+                obd_data = {name: value for name, (value, _) in readings.items()}
+
+                publish_telemetry(obd_data, sample_ns)
+
+                stored = False
+                if loop_stats.total_samples % STORE_EVERY == 0:
+                    stored = write_to_influxdb(fresh_values(readings, stored_at), MOTORCYCLE_ID, sample_ns)
+
+                # Fixed-rate schedule: sleep only for what is left of this tick
+                next_tick += SAMPLE_INTERVAL
+                now = time.monotonic()
+                late = now > next_tick
+                loop_stats.tick(now - tick_start, stored, late)
+
+                if now >= next_stats:
+                    next_stats += OBD_STATS_INTERVAL
+                    last_stats = log_stats(loop_stats, poller)
+                if live_view:
+                    render_live(obd_data, last_stats)
+
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_tick = time.monotonic()
 
         except KeyboardInterrupt:
-            print("\n[OBD] Data gathering stopped by user.")
+            if live_view:
+                live_view.stop()
+            log.info("Data gathering stopped by user.")
+            if telemetry_batcher and (frame := telemetry_batcher.flush()):
+                mqtt_client.publish(MQTT_BIN_TOPIC, frame)
+            log_stats(loop_stats, poller)
 
     else:
-        print(f"[ERROR] Failed to connect to OBD-II on {port}")
+        log.error("Failed to connect to OBD-II on %s", port)
 
 except Exception as e:
-    print(f"[FATAL ERROR] {e}")
+    log.exception("Fatal error: %s", e)
 
 finally:
+    if live_view:
+        live_view.stop()
+    if 'poller' in locals():
+        poller.stop()
     mqtt_client.loop_stop()
     mqtt_client.disconnect()
     if 'connection' in locals() and connection.is_connected():
         connection.close()
-    influx_client.close()
+    drainer.stop(timeout=OBD_DRAIN_SECONDS)
+    spool.close()
+    influx_pool.close_client()
@@ -0,0 +1,196 @@
+"""
+prediction_cache.py
+───────────────────
+Single-flight coalescing and a short-lived result cache for detect_anomalies.
+
+Key: (motorcycle_id, brand, model, mode, minutes), brand/model normalized.
+
+  • Identical calls that arrive while one is running wait for it instead of
+    repeating the window query and the scoring.
+  • Successful results are kept for PREDICT_CACHE_TTL seconds, at most
+    PREDICT_CACHE_MAX_ENTRIES of them (least recently used evicted first).
+    Errors and "Not enough data" replies are shared with waiting callers
+    but not cached.
+  • As a telemetry listener (see server.add_telemetry_listener) it drops a
+    bike's results once PREDICT_CACHE_STALE_SAMPLES new samples arrived, so
+    a live bike is rescored as soon as its window has really moved.
+  • Hit/miss/coalesced/invalidation counts are kept for /metrics.
+
+get() serves threads with a blocking compute(); get_async() serves one event
+loop with a coroutine compute() (the ASGI app), waiters awaiting the leader.
+Use an instance through one of them only.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from range_table import normalize
+
+PREDICT_CACHE_TTL = float(os.getenv("PREDICT_CACHE_TTL", 10))
+PREDICT_CACHE_MAX_ENTRIES = int(os.getenv("PREDICT_CACHE_MAX_ENTRIES", 256))
+PREDICT_CACHE_STALE_SAMPLES = int(os.getenv("PREDICT_CACHE_STALE_SAMPLES", 30))
+
+
+class _Flight:
+    __slots__ = ("done", "future", "result", "error", "generation")
+
+    def __init__(self, generation, future=None):
+        self.done = threading.Event()
+        self.future = future  # get_async() waiters await this instead of `done`
+        self.result = None
+        self.error = None
+        self.generation = generation
+
+
+class PredictionCache:
+    def __init__(self, compute, ttl=PREDICT_CACHE_TTL, max_entries=PREDICT_CACHE_MAX_ENTRIES,
+                 stale_samples=PREDICT_CACHE_STALE_SAMPLES):
+        """compute(motorcycle_id, brand, model, mode=, minutes=) → result dict (awaitable for get_async)."""
+        self.compute = compute
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_samples = stale_samples
+        self._entries = OrderedDict()  # key → (result, stored_at)
+        self._flights = {}             # key → _Flight
+        self._generation = {}          # motorcycle_id → bumped on every invalidation
+        self._new_samples = {}         # motorcycle_id → samples since its last cached result
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0,
+                       "evictions": 0, "invalidations": 0, "not_cached": 0}
+
+    @staticmethod
+    def key(motorcycle_id, brand, model, mode="idle", minutes=30):
+        return (str(motorcycle_id), normalize(brand), normalize(model), mode, int(minutes))
+
+    # ───── Lookup ─────
+    def _lookup(self, key, future=None):
+        """→ (cached entry or None, flight, leader)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry, None, False
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(self._generation.get(key[0], 0), future)
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        return None, flight, leader
+
+    def get(self, motorcycle_id, brand, model, mode="idle", minutes=30):
+        key = self.key(motorcycle_id, brand, model, mode, minutes)
+        entry, flight, leader = self._lookup(key)
+        if entry is not None:
+            return entry[0]
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self.compute(motorcycle_id, brand, model, mode=mode, minutes=minutes)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+            flight.done.set()
+
+    async def get_async(self, motorcycle_id, brand, model, mode="idle", minutes=30):
+        key = self.key(motorcycle_id, brand, model, mode, minutes)
+        entry, flight, leader = self._lookup(key, asyncio.get_running_loop().create_future())
+        if entry is not None:
+            return entry[0]
+
+        if not leader:
+            # Shielded: a waiter whose request is cancelled must not cancel the leader's result
+            return await asyncio.shield(flight.future)
+
+        try:
+            flight.result = await self.compute(motorcycle_id, brand, model, mode=mode, minutes=minutes)
+            return flight.result
+        except BaseException as e:  # a cancelled leader fails its waiters too
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+            flight.done.set()
+            if flight.error is None:
+                flight.future.set_result(flight.result)
+            elif isinstance(flight.error, asyncio.CancelledError):
+                flight.future.cancel()
+            else:
+                flight.future.set_exception(flight.error)
+                flight.future.exception()  # retrieved: no "never retrieved" warning without waiters
+
+    def _land(self, key, flight):
+        result = flight.result
+        with self._lock:
+            self._flights.pop(key, None)
+            # Only complete results, and only if the bike was not invalidated meanwhile
+            cacheable = (flight.error is None and isinstance(result, dict)
+                         and result.get("status") == "ok" and "message" not in result
+                         and self._generation.get(key[0], 0) == flight.generation)
+            if not cacheable:
+                self._stats["not_cached"] += 1
+                return
+            self._entries[key] = (result, time.monotonic())
+            self._entries.move_to_end(key)
+            self._new_samples[key[0]] = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    # ───── Invalidation ─────
+    def invalidate(self, motorcycle_id):
+        """Drop every cached result of one bike; returns how many were dropped."""
+        motorcycle_id = str(motorcycle_id)
+        with self._lock:
+            return self._invalidate_locked(motorcycle_id)
+
+    def _invalidate_locked(self, motorcycle_id):
+        stale = [k for k in self._entries if k[0] == motorcycle_id]
+        for k in stale:
+            del self._entries[k]
+        self._generation[motorcycle_id] = self._generation.get(motorcycle_id, 0) + 1
+        self._new_samples[motorcycle_id] = 0
+        if stale:
+            self._stats["invalidations"] += 1
+        return len(stale)
+
+    def __call__(self, motorcycle_id, samples):
+        """Telemetry listener: invalidate a bike after enough new samples."""
+        motorcycle_id = str(motorcycle_id)
+        with self._lock:
+            count = self._new_samples.get(motorcycle_id, 0) + len(samples)
+            if count >= self.stale_samples:
+                self._invalidate_locked(motorcycle_id)
+            else:
+                self._new_samples[motorcycle_id] = count
+
+    # ───── Metrics ─────
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["in_flight"] = len(self._flights)
+        served = stats["hits"] + stats["coalesced"]
+        lookups = served + stats["misses"]
+        stats["hit_rate"] = round(served / lookups, 4) if lookups else None
+        stats["ttl"] = self.ttl
+        stats["max_entries"] = self.max_entries
+        stats["stale_samples"] = self.stale_samples
+        return stats
@@ -0,0 +1,151 @@
+"""
+range_table.py
+──────────────
+Compiled, read-only view of normal_ranges.json.
+
+The JSON is parsed once into pre-normalized (brand, model) keys, each holding
+contiguous float arrays of warning/critical bounds and midpoints in FEATURES
+order. Lookups are a single dict hit; unknown brand/models resolve to a shared
+"unknown" sentinel instead of raising on every call. Raw client strings are
+memoized in a bounded LRU, so misspellings cannot grow it without limit.
+"""
+
+import json
+from functools import lru_cache
+
+import numpy as np
+
+SEVERITY_UNKNOWN = -1
+SEVERITY_NORMAL = 0
+SEVERITY_WARNING = 1
+SEVERITY_CRITICAL = 2
+
+SEVERITY_LABELS = {
+    SEVERITY_UNKNOWN: "unknown",
+    SEVERITY_NORMAL: "normal",
+    SEVERITY_WARNING: "warning",
+    SEVERITY_CRITICAL: "critical",
+}
+
+# Features whose high/low direction is the sign of the value, not the midpoint
+SIGNED_FEATURES = {"long_fuel_trim_1"}
+
+LOOKUP_CACHE_SIZE = 1024  # raw (brand, model) pairs remembered per table
+
+def normalize(text):
+    return str(text).strip().lower().replace(" ", "_")
+
+
+class RangeBounds:
+    """Warning/critical bounds for one brand/model, aligned to FEATURES."""
+
+    __slots__ = ("warn_min", "warn_max", "crit_min", "crit_max", "midpoint", "known", "signed")
+
+    def __init__(self, bounds, signed):
+        bounds = np.ascontiguousarray(bounds, dtype=np.float64)
+        self.warn_min, self.warn_max, self.crit_min, self.crit_max = bounds
+        self.midpoint = (self.warn_min + self.warn_max) / 2
+        self.known = ~np.isnan(bounds).any(axis=0)
+        self.signed = signed
+
+    @property
+    def is_unknown(self):
+        return not self.known.any()
+
+    def is_high(self, values):
+        """Direction used to pick the high/low tip; unknown features count as high."""
+        values = np.asarray(values, dtype=float)
+        high = np.where(self.signed, values > 0, values > self.midpoint)
+        return high | ~self.known
+
+
+class RangeTable:
+    def __init__(self, ranges: dict, features):
+        self.features = list(features)
+        self.index = {f: j for j, f in enumerate(self.features)}
+        signed = np.array([f in SIGNED_FEATURES for f in self.features])
+
+        self._bounds = {}
+        for brand, models in ranges.items():
+            for model, feature_ranges in models.items():
+                key = (normalize(brand), normalize(model))
+                self._bounds[key] = RangeBounds(self._compile(feature_ranges), signed)
+
+        self.unknown = RangeBounds(np.full((4, len(self.features)), np.nan), signed)
+        self._lookup_cached = lru_cache(maxsize=LOOKUP_CACHE_SIZE)(self._resolve)
+
+    @classmethod
+    def from_json(cls, path, features):
+        with open(path) as f:
+            return cls(json.load(f), features)
+
+    def _compile(self, feature_ranges):
+        bounds = np.full((4, len(self.features)), np.nan)
+        for j, f in enumerate(self.features):
+            try:
+                r = feature_ranges[f]
+                bounds[:, j] = [float(r["warning_min"]), float(r["warning_max"]),
+                                float(r["critical_min"]), float(r["critical_max"])]
+            except (KeyError, TypeError, ValueError):
+                continue
+        return bounds
+
+    def _resolve(self, brand, model):
+        key = (normalize(brand), normalize(model))
+        bounds = self._bounds.get(key, self.unknown)
+        if bounds is self.unknown:
+            print(f"[RangeTable] ⚠️ No reference ranges for {key[0]} → {key[1]}")
+        return bounds
+
+    def lookup(self, brand, model) -> RangeBounds:
+        """O(1) lookup by raw brand/model; misses resolve to the shared unknown sentinel."""
+        return self._lookup_cached(brand, model)
+
+    # ───── Batched classification ─────
+    def classify(self, X, brand, model):
+        """
+        Classify a (rows, len(features)) matrix in one pass.
+        Returns (codes, scores): SEVERITY_* codes and 0–100 severity scores,
+        with -1 scores for unknown references or zero-width bands.
+        """
+        b = self.lookup(brand, model)
+        X = np.asarray(X, dtype=float)
+
+        critical = (X <= b.crit_min) | (X >= b.crit_max)
+        warning = (X <= b.warn_min) | (X >= b.warn_max)
+        codes = np.where(critical, SEVERITY_CRITICAL,
+                         np.where(warning, SEVERITY_WARNING, SEVERITY_NORMAL))
+
+        below = X < b.warn_min
+        above = X > b.warn_max
+        low_span = b.warn_min - b.crit_min
+        high_span = b.crit_max - b.warn_max
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(below, (b.warn_min - X) / low_span,
+                             np.where(above, (X - b.warn_max) / high_span, 0.0))
+        scores = np.clip(ratio * 100, 0, 100)
+        scores = np.nan_to_num(scores, nan=0.0).astype(int)
+        # A zero-width band used to raise ZeroDivisionError → -1; keep that contract.
+        scores[(below & (low_span == 0)) | (above & (high_span == 0))] = -1
+
+        codes[:, ~b.known] = SEVERITY_UNKNOWN
+        scores[:, ~b.known] = -1
+        return codes, scores
+
+    # ───── Scalar helpers ─────
+    def _classify_one(self, feature, value, brand, model):
+        j = self.index.get(feature)
+        if j is None:
+            return SEVERITY_UNKNOWN, -1
+        try:
+            row = np.full((1, len(self.features)), float(value))
+        except (TypeError, ValueError):
+            return SEVERITY_UNKNOWN, -1
+        codes, scores = self.classify(row, brand, model)
+        return int(codes[0, j]), int(scores[0, j])
+
+    def classify_value(self, feature, value, brand, model):
+        return SEVERITY_LABELS[self._classify_one(feature, value, brand, model)[0]]
+
+    def severity_score(self, feature, value, brand, model):
+        return self._classify_one(feature, value, brand, model)[1]
@@ -1,21 +1,11 @@
 from flask import Blueprint, jsonify, request
-from influxdb_client import InfluxDBClient
-import os
 import pandas as pd
-from dotenv import load_dotenv
-load_dotenv()
+import influx_pool
+from influx_pool import INFLUXDB_BUCKET
+from report_cache import RollupCache, RANGE_SECONDS, SUM, COUNT, MIN, MAX
 
 report_api = Blueprint("report_api", __name__)
 
-# InfluxDB configuration
-INFLUXDB_URL = os.getenv("INFLUX_URL")
-INFLUXDB_TOKEN = os.getenv("INFLUX_TOKEN")
-INFLUXDB_ORG = os.getenv("INFLUX_ORG")
-INFLUXDB_BUCKET = os.getenv("INFLUX_BUCKET")
-
-client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-query_api = client.query_api()
-
 FEATURES = [
     "rpm",
     "engine_load",
@@ -25,49 +15,117 @@ FEATURES = [
     "elm_voltage"
 ]
 
-def query_aggregated_report(time_range, motorcycle_id):
-    # Convert -24h or -7d to interval for SQL
-    interval = {
-        "-24h": "1 day",
-        "-7d": "7 days"
-    }.get(time_range, "1 day")
+# Time buckets accepted by ?bucket= → seconds per series point
+BUCKETS = {
+    "hour": 3600,
+    "day": 24 * 3600
+}
 
-    # SQL query to fetch recent data with non-null fields
+def rollup_buckets_flux(motorcycle_id, since_epoch, bucket_minutes, until_epoch=None):
+    """The Flux query behind query_rollup_buckets()."""
+    bounds = f"start: time(v: {int(since_epoch) * 1_000_000_000})"
+    if until_epoch is not None:
+        bounds += f", stop: time(v: {int(until_epoch) * 1_000_000_000})"
+    field_filter = " or\n          ".join(f'r._field == "{f}"' for f in FEATURES)
+    # Each feature is its own series, so every aggregateWindow runs per
+    # feature; the four results are pivoted into one row per bucket
     query = f"""
-    SELECT *
-    FROM "obd_data"
-    WHERE
-        time >= now() - interval '{interval}'
-        AND "motorcycle_id" = '{motorcycle_id}'
-        AND (
-            {" OR ".join([f'"{f}" IS NOT NULL' for f in FEATURES])}
-        )
-    ORDER BY time DESC
-    LIMIT 1000
+    data = from(bucket: "{INFLUXDB_BUCKET}")
+      |> range({bounds})
+      |> filter(fn: (r) => r._measurement == "obd_data")
+      |> filter(fn: (r) => r.motorcycle_id == "{motorcycle_id}")
+      |> filter(fn: (r) =>
+          {field_filter})
+
+    rollup = (tables=<-, fn, stat) => tables
+      |> aggregateWindow(every: {int(bucket_minutes)}m, fn: fn, timeSrc: "_start", createEmpty: false)
+      |> toFloat()
+      |> set(key: "stat", value: stat)
+
+    union(tables: [
+        data |> rollup(fn: sum, stat: "sum"),
+        data |> rollup(fn: count, stat: "count"),
+        data |> rollup(fn: min, stat: "min"),
+        data |> rollup(fn: max, stat: "max")
+      ])
+      |> group()
+      |> pivot(rowKey: ["_time"], columnKey: ["_field", "stat"], valueColumn: "_value")
+      |> rename(columns: {{_time: "bucket"}})
+      |> sort(columns: ["bucket"])
+    """
+    return query
+
+def query_rollup_buckets(motorcycle_id, since_epoch, bucket_minutes, until_epoch=None):
+    """
+    Partial aggregates per fixed time bucket in [since_epoch, until_epoch): a
+    "bucket" start column plus <f>_sum, <f>_count, <f>_min, <f>_max.
     """
+    return influx_pool.query_data_frame(rollup_buckets_flux(motorcycle_id, since_epoch, bucket_minutes, until_epoch))
 
+ROLLUP_CACHE = RollupCache(query_rollup_buckets, FEATURES)
+
+def _clean(value, digits=2):
+    if value is None or pd.isna(value):
+        return None
+    return round(float(value), digits)
+
+def _stats_row(folded):
+    """Folded (4, n_features) partials → <f>, <f>_min, <f>_max, <f>_count."""
+    out = {}
+    for j, f in enumerate(FEATURES):
+        count = int(folded[COUNT, j])
+        out[f] = _clean(folded[SUM, j] / count) if count else None
+        out[f"{f}_min"] = _clean(folded[MIN, j]) if count else None
+        out[f"{f}_max"] = _clean(folded[MAX, j]) if count else None
+        out[f"{f}_count"] = count
+    return out
+
+def query_aggregated_report(time_range, motorcycle_id, bucket=None):
+    if time_range not in RANGE_SECONDS:
+        time_range = "-24h"
+
+    # Aggregates come from the rollup cache; only recent buckets hit InfluxDB
     try:
-        df = query_api.query_data_frame_sql(query=query, database=INFLUXDB_BUCKET)
+        partials = ROLLUP_CACHE.get(motorcycle_id, time_range)
     except Exception as e:
-        print(f"[ERROR] SQL query failed: {e}")
+        print(f"[ERROR] Flux query failed: {e}")
         return {f: None for f in FEATURES}
 
-    if df.empty:
+    return build_report(partials, bucket)
+
+def build_report(partials, bucket=None):
+    """Fold cached partials into the report dict, plus a series per `bucket`."""
+    if not partials:
         return {f: None for f in FEATURES}
 
     try:
-        means = df[FEATURES].mean(numeric_only=True).round(2).to_dict()
-        return means
+        report = _stats_row(ROLLUP_CACHE.fold(partials.values()))
+        if bucket in BUCKETS:
+            report["bucket"] = bucket
+            report["series"] = [
+                {"time": pd.Timestamp(start, unit="s").isoformat(), **_stats_row(folded)}
+                for start, folded in ROLLUP_CACHE.series(partials, BUCKETS[bucket])
+            ]
+        return report
     except Exception as e:
-        print(f"[ERROR] Failed to compute means: {e}")
+        print(f"[ERROR] Failed to build report: {e}")
         return {f: None for f in FEATURES}
 
+def _bucket_arg():
+    bucket = request.args.get("bucket")
+    if bucket is not None and bucket not in BUCKETS:
+        return None, (jsonify({"error": f"bucket must be one of {sorted(BUCKETS)}"}), 400)
+    return bucket, None
+
 @report_api.route("/reports/daily", methods=["GET"])
 def daily_report():
     motorcycle_id = request.args.get("motorcycle_id", "unknown")
     if motorcycle_id == "unknown":
         return jsonify({"error": "Missing motorcycle_id"}), 400
-    report = query_aggregated_report("-24h", motorcycle_id)
+    bucket, error = _bucket_arg()
+    if error:
+        return error
+    report = query_aggregated_report("-24h", motorcycle_id, bucket)
     return jsonify(report)
 
 @report_api.route("/reports/weekly", methods=["GET"])
@@ -75,13 +133,16 @@ def weekly_report():
     motorcycle_id = request.args.get("motorcycle_id", "unknown")
     if motorcycle_id == "unknown":
         return jsonify({"error": "Missing motorcycle_id"}), 400
-    report = query_aggregated_report("-7d", motorcycle_id)
+    bucket, error = _bucket_arg()
+    if error:
+        return error
+    report = query_aggregated_report("-7d", motorcycle_id, bucket)
     return jsonify(report)
 
 # ─── Exported for MQTT use ───
 
-def get_daily_report(motorcycle_id):
-    return query_aggregated_report("-24h", motorcycle_id)
+def get_daily_report(motorcycle_id, bucket=None):
+    return query_aggregated_report("-24h", motorcycle_id, bucket)
 
-def get_weekly_report(motorcycle_id):
-    return query_aggregated_report("-7d", motorcycle_id)
+def get_weekly_report(motorcycle_id, bucket=None):
+    return query_aggregated_report("-7d", motorcycle_id, bucket)
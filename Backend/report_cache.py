@@ -0,0 +1,220 @@
+"""
+report_cache.py
+───────────────
+Materialized rollups behind /reports/daily and /reports/weekly.
+
+Each (motorcycle_id, range) keeps per-bucket partial aggregates — sum, count,
+min and max per feature — in fixed ROLLUP_BUCKET_MINUTES buckets. Within the
+TTL a report is folded straight from memory; after it:
+
+  • the last REPORT_CACHE_LATE_MINUTES are re-queried and replace their
+    cached buckets, so rows the collector spool uploads late still land;
+  • the bucket the range now starts in is re-queried from the exact range
+    start, and older buckets are evicted;
+  • every REPORT_CACHE_FULL_REFRESH seconds the whole range is re-read, which
+    picks up backlogs older than the late window (a collector that was
+    offline for days).
+
+get() serves threads; get_async() serves one event loop with an async fetch
+(the ASGI app), refreshes of one rollup serialized by an asyncio lock. Use
+an instance through one of them only.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+ROLLUP_BUCKET_MINUTES = int(os.getenv("REPORT_ROLLUP_BUCKET_MINUTES", 5))
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", 30))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", 512))
+REPORT_CACHE_LATE_MINUTES = int(os.getenv("REPORT_CACHE_LATE_MINUTES", 60))
+REPORT_CACHE_FULL_REFRESH = float(os.getenv("REPORT_CACHE_FULL_REFRESH", 600))
+
+if 60 % ROLLUP_BUCKET_MINUTES:
+    raise ValueError("REPORT_ROLLUP_BUCKET_MINUTES must divide an hour")
+
+RANGE_SECONDS = {
+    "-24h": 24 * 3600,
+    "-7d": 7 * 24 * 3600
+}
+
+# Row layout of one bucket's partials
+SUM, COUNT, MIN, MAX = range(4)
+
+
+class _Rollup:
+    __slots__ = ("lock", "async_lock", "partials", "refreshed_at", "full_refreshed_at")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.async_lock = None  # created on first get_async(), inside the loop
+        self.partials = {}  # bucket start (epoch s) → (4, n_features), chronological
+        self.refreshed_at = None
+        self.full_refreshed_at = None
+
+
+class RollupCache:
+    def __init__(self, fetch, features):
+        """
+        fetch(motorcycle_id, since_epoch, bucket_minutes, until_epoch=None) must
+        return a DataFrame with a "bucket" timestamp column and
+        <f>_sum/_count/_min/_max per feature, for rows in [since, until).
+        For get_async() it is a coroutine function returning the same.
+        """
+        self.fetch = fetch
+        self.features = list(features)
+        self.bucket_seconds = ROLLUP_BUCKET_MINUTES * 60
+        self._rollups = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "refreshes": 0, "full_refreshes": 0, "refresh_errors": 0,
+                       "buckets_fetched": 0}
+
+    def _rollup(self, key):
+        with self._lock:
+            rollup = self._rollups.get(key)
+            if rollup is None:
+                rollup = self._rollups[key] = _Rollup()
+                while len(self._rollups) > REPORT_CACHE_MAX_ENTRIES:
+                    self._rollups.popitem(last=False)
+            else:
+                self._rollups.move_to_end(key)
+            return rollup
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    # ───── Refresh ─────
+    def _partials(self, df):
+        """Fetched [since, until) rows → {aligned bucket start: partial}."""
+        self._count("buckets_fetched", len(df))
+        partials = {}
+        for row in df.to_dict(orient="records"):
+            start = int(pd.Timestamp(row["bucket"]).timestamp())
+            partial = np.array([
+                [row.get(f"{f}_sum") for f in self.features],
+                [row.get(f"{f}_count") for f in self.features],
+                [row.get(f"{f}_min") for f in self.features],
+                [row.get(f"{f}_max") for f in self.features],
+            ], dtype=float)
+            partial[COUNT] = np.nan_to_num(partial[COUNT])
+            partial[SUM] = np.nan_to_num(partial[SUM])
+            # A window clipped by the query range reports the range start
+            partials[start - start % self.bucket_seconds] = partial
+        return partials
+
+    def _plan(self, rollup, time_range, now):
+        """
+        The [since, until) ranges a refresh queries, and the cached span
+        [head_end, late_start) it keeps, or None for a full refresh.
+        """
+        cutoff = int(now) - RANGE_SECONDS[time_range]
+        # The range starts inside this bucket; it only holds rows from cutoff on
+        head_end = cutoff - cutoff % self.bucket_seconds + self.bucket_seconds
+        late_start = int(now) - REPORT_CACHE_LATE_MINUTES * 60
+        late_start = max(late_start - late_start % self.bucket_seconds, head_end)
+
+        full = (rollup.full_refreshed_at is None or late_start <= head_end
+                or now - rollup.full_refreshed_at >= REPORT_CACHE_FULL_REFRESH)
+        if full:
+            return [(cutoff, None)], None
+        # Buckets between the head and the late window are still complete
+        return [(cutoff, head_end), (late_start, None)], (head_end, late_start)
+
+    def _apply(self, rollup, frames, keep, now):
+        partials = {}
+        for df in frames:
+            partials.update(self._partials(df))
+        if keep is None:
+            rollup.full_refreshed_at = now
+            self._count("full_refreshes")
+        else:
+            partials.update((s, p) for s, p in rollup.partials.items() if keep[0] <= s < keep[1])
+
+        rollup.partials = dict(sorted(partials.items()))
+        rollup.refreshed_at = now
+        self._count("refreshes")
+
+    def _refresh(self, rollup, motorcycle_id, time_range, now):
+        ranges, keep = self._plan(rollup, time_range, now)
+        frames = [self.fetch(motorcycle_id, since, ROLLUP_BUCKET_MINUTES, until) for since, until in ranges]
+        self._apply(rollup, frames, keep, now)
+
+    async def _refresh_async(self, rollup, motorcycle_id, time_range, now):
+        ranges, keep = self._plan(rollup, time_range, now)
+        frames = await asyncio.gather(*(self.fetch(motorcycle_id, since, ROLLUP_BUCKET_MINUTES, until)
+                                        for since, until in ranges))
+        self._apply(rollup, frames, keep, now)
+
+    def get(self, motorcycle_id, time_range):
+        """Return {bucket_start: partial} for the range, refreshing if the TTL lapsed."""
+        rollup = self._rollup((str(motorcycle_id), time_range))
+        with rollup.lock:
+            now = time.time()
+            fresh = rollup.refreshed_at is not None and now - rollup.refreshed_at < REPORT_CACHE_TTL
+            if fresh:
+                self._count("hits")
+            else:
+                try:
+                    self._refresh(rollup, motorcycle_id, time_range, now)
+                except Exception as e:
+                    self._count("refresh_errors")
+                    print(f"[ERROR] Rollup refresh failed for {motorcycle_id} {time_range}: {e}")
+                    if rollup.refreshed_at is None:
+                        raise
+            return dict(rollup.partials)
+
+    async def get_async(self, motorcycle_id, time_range):
+        """get() for a coroutine fetch; the queries of one refresh run concurrently."""
+        rollup = self._rollup((str(motorcycle_id), time_range))
+        if rollup.async_lock is None:
+            rollup.async_lock = asyncio.Lock()
+        async with rollup.async_lock:
+            now = time.time()
+            fresh = rollup.refreshed_at is not None and now - rollup.refreshed_at < REPORT_CACHE_TTL
+            if fresh:
+                self._count("hits")
+            else:
+                try:
+                    await self._refresh_async(rollup, motorcycle_id, time_range, now)
+                except Exception as e:
+                    self._count("refresh_errors")
+                    print(f"[ERROR] Rollup refresh failed for {motorcycle_id} {time_range}: {e}")
+                    if rollup.refreshed_at is None:
+                        raise
+            return dict(rollup.partials)
+
+    # ───── Folding ─────
+    def fold(self, partials):
+        """Combine partials into one (4, n_features) array."""
+        stacked = np.stack(list(partials))
+        out = np.empty((4, len(self.features)))
+        out[SUM] = stacked[:, SUM].sum(axis=0)
+        out[COUNT] = stacked[:, COUNT].sum(axis=0)
+        with np.errstate(all="ignore"):
+            out[MIN] = np.fmin.reduce(stacked[:, MIN], axis=0)
+            out[MAX] = np.fmax.reduce(stacked[:, MAX], axis=0)
+        return out
+
+    def series(self, partials, bucket_seconds):
+        """Fold partials into coarser buckets → [(bucket_start, (4, n_features))]."""
+        groups = OrderedDict()
+        for start, partial in sorted(partials.items()):
+            groups.setdefault(start - start % bucket_seconds, []).append(partial)
+        return [(start, self.fold(group)) for start, group in groups.items()]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._rollups)
+            stats["buckets_cached"] = sum(len(r.partials) for r in self._rollups.values())
+        stats["bucket_minutes"] = ROLLUP_BUCKET_MINUTES
+        stats["ttl_seconds"] = REPORT_CACHE_TTL
+        stats["late_minutes"] = REPORT_CACHE_LATE_MINUTES
+        stats["full_refresh_seconds"] = REPORT_CACHE_FULL_REFRESH
+        return stats
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import paho.mqtt.client as mqtt
 import json
@@ -10,18 +10,31 @@ import psutil
 import ssl
 import base64
 import io
-import pandas as pd
-import numpy as np
 from dotenv import load_dotenv
 import signal
-
-from report_api import get_daily_report, get_weekly_report, report_api
-from anomaly_model import detect_anomalies, FEATURES
-from influx_query import get_recent_data
+import time
+
+from report_api import get_daily_report, get_weekly_report, report_api, ROLLUP_CACHE
+from anomaly_model import detect_anomalies, detect_anomalies_batch, detect_anomalies_from_csv, preload_models, MODEL_REGISTRY, MODEL_BASE_DIR
+from influx_query import (get_recent_data, get_recent_columnar, encode_msgpack, page_filled,
+                          DOWNSAMPLE_METHODS, FORMATS, parse_cursor, stream_json, stream_ndjson)
+from influx_pool import pool_stats
+from telemetry_codec import decode_message
+from stream_detector import StreamDetector
+from training_jobs import QueueFull, TrainingJobs, trained_bikes
+from mqtt_dispatcher import CommandDispatcher
+from prediction_cache import PredictionCache
 
 # ───── Load Environment Variables ─────
 load_dotenv()
-print(f"📄 .env loaded: MQTT_HOST={os.getenv('MQTT_BROKER_HOST')}, PORT={os.getenv('MQTT_BROKER_PORT')}")
+
+# Spawned training workers run this file again as "__mp_main__" (see
+# training_jobs.py). Everything below that starts a thread or a connection
+# only does so in the server itself; a worker just gets the definitions.
+IS_SERVER_PROCESS = __name__ != "__mp_main__"
+
+if IS_SERVER_PROCESS:
+    print(f"📄 .env loaded: MQTT_HOST={os.getenv('MQTT_BROKER_HOST')}, PORT={os.getenv('MQTT_BROKER_PORT')}")
 
 # ───── Flask App Setup ─────
 app = Flask(__name__)
@@ -33,6 +46,8 @@ EMQX_HOST = os.getenv("MQTT_BROKER_HOST")
 EMQX_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
 MQTT_COMMAND_TOPIC = "obd/command"
 MQTT_STATUS_TOPIC = "obd/status"
+MQTT_RECENT_DATA_BIN_TOPIC = "obd/status/recent-data"  # msgpack replies
+MQTT_TELEMETRY_TOPIC = "obd/motorcycle/+/data/#"  # JSON on .../data, binary on .../data/bin
 
 mqtt_client = mqtt.Client()
 mqtt_client.username_pw_set(os.getenv("MQTT_USERNAME"), os.getenv("MQTT_PASSWORD"))
@@ -46,81 +61,178 @@ def publish_status(status):
 def on_mqtt_connect(client, userdata, flags, rc):
     print("✅ Connected to MQTT broker")
     client.subscribe(MQTT_COMMAND_TOPIC)
+    client.subscribe(MQTT_TELEMETRY_TOPIC)
 
-def on_mqtt_message(client, userdata, msg):
+# ───── Live Telemetry ─────
+# Collector messages in either codec are decoded here and handed to listeners
+# as (motorcycle_id, [(epoch_ms, {PID_NAME: value}), ...]).
+_telemetry_listeners = []
+_telemetry_lock = threading.Lock()
+_telemetry_stats = {"messages": 0, "samples": 0, "bytes": 0, "decode_errors": 0, "listener_errors": 0,
+                    "by_codec": {"json": {"messages": 0, "bytes": 0}, "binary": {"messages": 0, "bytes": 0}}}
+
+def add_telemetry_listener(listener):
+    _telemetry_listeners.append(listener)
+
+def handle_telemetry(topic, payload):
     try:
-        payload = json.loads(msg.payload.decode())
-        command = payload.get("command")
-        print(f"[MQTT] Received: {command}")
-
-        if command == "start-obd":
-            motorcycle_id = payload.get("motorcycle_id")
-            threading.Thread(target=lambda: start_obd_internal(motorcycle_id), daemon=True).start()
-
-        elif command == "stop-obd":
-            stop_obd_internal()
-
-        elif command == "report-daily":
-            motorcycle_id = payload.get("motorcycle_id")
-            if not motorcycle_id:
-                return publish_status({"status": "error", "message": "Missing motorcycle_id"})
-            report = get_daily_report(motorcycle_id)
-            publish_status({"type": "report-daily", "rows": report})
-
-        elif command == "report-weekly":
-            motorcycle_id = payload.get("motorcycle_id")
-            if not motorcycle_id:
-                return publish_status({"status": "error", "message": "Missing motorcycle_id"})
-            report = get_weekly_report(motorcycle_id)
-            publish_status({"type": "report-weekly", "rows": report})
-
-        elif command == "train-model":
-            motorcycle_id = payload.get("motorcycle_id")
-            brand = payload.get("brand")
-            threading.Thread(target=lambda: train_model_internal(motorcycle_id, brand), daemon=True).start()
-
-        elif command == "predict":
-            motorcycle_id = payload.get("motorcycle_id")
-            brand = payload.get("brand")
-            model = payload.get("model")
-            result = predict_internal(motorcycle_id, brand, model)
-            publish_status(result)
-
-        elif command == "recent-data":
-            motorcycle_id = payload.get("motorcycle_id")
-            minutes = payload.get("minutes", 30)
-            data = get_recent_data(motorcycle_id, minutes)
-            publish_status({"type": "recent-data", "rows": data})
-
-        elif command == "predict-from-csv":
-            motorcycle_id = payload.get("motorcycle_id")
-            brand = payload.get("brand")
-            model = payload.get("model")
-            csv_base64 = payload.get("file_base64")
-
-            if not all([motorcycle_id, brand, model, csv_base64]):
-                raise ValueError("Missing motorcycle_id, brand, model, or file")
-
-            decoded_csv = base64.b64decode(csv_base64).decode('utf-8')
-            df = pd.read_csv(io.StringIO(decoded_csv)).replace(0, np.nan).dropna()
-            for col in FEATURES:
-                df[col] = pd.to_numeric(df[col], errors="coerce")
-            df["_time"] = pd.Timestamp.now()
-
-            import anomaly_model
-            original_get_window_df = anomaly_model._get_window_df
-            anomaly_model._get_window_df = lambda *_, **__: df
+        motorcycle_id, codec, samples = decode_message(topic, payload)
+    except Exception as e:
+        with _telemetry_lock:
+            _telemetry_stats["decode_errors"] += 1
+        print(f"[ERROR] Bad telemetry on {topic}: {e}")
+        return
 
-            try:
-                result = detect_anomalies(motorcycle_id, brand, model, mode="idle", minutes=30)
-            finally:
-                anomaly_model._get_window_df = original_get_window_df
+    now_ms = int(time.time() * 1000)
+    samples = [(now_ms if ts is None else ts, data) for ts, data in samples]
+    with _telemetry_lock:
+        _telemetry_stats["messages"] += 1
+        _telemetry_stats["samples"] += len(samples)
+        _telemetry_stats["bytes"] += len(payload)
+        _telemetry_stats["by_codec"][codec]["messages"] += 1
+        _telemetry_stats["by_codec"][codec]["bytes"] += len(payload)
 
-            publish_status({"type": "predict-from-csv", "result": result})
+    for listener in _telemetry_listeners:
+        try:
+            listener(motorcycle_id, samples)
+        except Exception as e:
+            with _telemetry_lock:
+                _telemetry_stats["listener_errors"] += 1
+            print(f"[ERROR] Telemetry listener failed for {motorcycle_id}: {e}")
+
+if IS_SERVER_PROCESS:
+    # Continuous detection for watched bikes, straight from the telemetry stream
+    STREAM_DETECTOR = StreamDetector(publish_status)
+    add_telemetry_listener(STREAM_DETECTOR)
+
+    # Coalesced, briefly cached predictions; new telemetry for a bike expires its results
+    PREDICTION_CACHE = PredictionCache(detect_anomalies)
+    add_telemetry_listener(PREDICTION_CACHE)
+
+def telemetry_stats():
+    with _telemetry_lock:
+        stats = dict(_telemetry_stats)
+        stats["by_codec"] = {codec: dict(c) for codec, c in _telemetry_stats["by_codec"].items()}
+    return stats
 
+def on_mqtt_message(client, userdata, msg):
+    if msg.topic != MQTT_COMMAND_TOPIC:
+        return handle_telemetry(msg.topic, msg.payload)
+    try:
+        payload = json.loads(msg.payload.decode())
+        print(f"[MQTT] Received: {payload.get('command')}")
     except Exception as e:
         print(f"❌ MQTT command error: {e}")
-        publish_status({"status": "error", "message": str(e)})
+        return publish_status({"status": "error", "message": f"Bad command payload: {e}"})
+    # Handled on the dispatcher's workers, never on paho's network thread
+    COMMAND_DISPATCHER.submit(payload)
+
+def handle_command(payload, reply):
+    """Run one MQTT command; `reply` publishes to obd/status with the request_id."""
+    command = payload.get("command")
+
+    if command == "start-obd":
+        start_obd_internal(payload.get("motorcycle_id"), reply)
+
+    elif command == "stop-obd":
+        stop_obd_internal(reply)
+
+    elif command == "report-daily":
+        motorcycle_id = payload.get("motorcycle_id")
+        if not motorcycle_id:
+            return reply({"status": "error", "message": "Missing motorcycle_id"})
+        report = get_daily_report(motorcycle_id, payload.get("bucket"))
+        reply({"type": "report-daily", "rows": report})
+
+    elif command == "report-weekly":
+        motorcycle_id = payload.get("motorcycle_id")
+        if not motorcycle_id:
+            return reply({"status": "error", "message": "Missing motorcycle_id"})
+        report = get_weekly_report(motorcycle_id, payload.get("bucket"))
+        reply({"type": "report-weekly", "rows": report})
+
+    elif command == "train-model":
+        motorcycle_id = payload.get("motorcycle_id")
+        brand = payload.get("brand")
+        reply(train_model_internal(motorcycle_id, brand, payload.get("request_id")))
+
+    elif command == "train-fleet":
+        reply({"type": "train-fleet", **train_fleet_internal(payload.get("motorcycles"), payload.get("request_id"))})
+
+    elif command == "train-status":
+        reply({"type": "train-status", **train_status_internal(payload.get("job_id"), payload.get("motorcycle_id"))})
+
+    elif command == "predict":
+        motorcycle_id = payload.get("motorcycle_id")
+        brand = payload.get("brand")
+        model = payload.get("model")
+        result = predict_internal(motorcycle_id, brand, model)
+        reply(result)
+
+    elif command == "stream-watch":
+        motorcycle_id = payload.get("motorcycle_id")
+        brand = payload.get("brand")
+        model = payload.get("model")
+        if not all([motorcycle_id, brand, model]):
+            return reply({"status": "error", "message": "Missing motorcycle_id, brand or model"})
+        STREAM_DETECTOR.watch(motorcycle_id, brand, model)
+        reply({"type": "stream-watch", "motorcycle_id": motorcycle_id, "watching": True})
+
+    elif command == "stream-unwatch":
+        motorcycle_id = payload.get("motorcycle_id")
+        STREAM_DETECTOR.unwatch(motorcycle_id)
+        reply({"type": "stream-watch", "motorcycle_id": motorcycle_id, "watching": False})
+
+    elif command == "predict-batch":
+        motorcycles = payload.get("motorcycles", [])
+        minutes = payload.get("minutes", 30)
+        result = predict_batch_internal(motorcycles, minutes)
+        reply({"type": "predict-batch", **result})
+
+    elif command == "recent-data":
+        motorcycle_id = payload.get("motorcycle_id")
+        minutes = payload.get("minutes", 30)
+        points = payload.get("points")
+        method = payload.get("downsample", "mean")
+        fmt = payload.get("format", "rows")
+        if method not in DOWNSAMPLE_METHODS:
+            return reply({"status": "error", "message": f"downsample must be one of {list(DOWNSAMPLE_METHODS)}"})
+        if fmt not in FORMATS:
+            return reply({"status": "error", "message": f"format must be one of {list(FORMATS)}"})
+        if fmt == "columnar":
+            data = get_recent_columnar(motorcycle_id, minutes, points=points, method=method)
+            reply({"type": "recent-data", **data})
+        elif fmt == "msgpack":
+            data = get_recent_columnar(motorcycle_id, minutes, points=points, method=method)
+            if payload.get("request_id") is not None:
+                data["request_id"] = payload["request_id"]
+            mqtt_client.publish(MQTT_RECENT_DATA_BIN_TOPIC, encode_msgpack(data))
+        else:
+            data = get_recent_data(motorcycle_id, minutes, points=points, method=method)
+            reply({"type": "recent-data", "rows": data})
+
+    elif command == "predict-from-csv":
+        motorcycle_id = payload.get("motorcycle_id")
+        brand = payload.get("brand")
+        model = payload.get("model")
+        csv_base64 = payload.get("file_base64")
+
+        if not all([motorcycle_id, brand, model, csv_base64]):
+            raise ValueError("Missing motorcycle_id, brand, model, or file")
+
+        csv_file = io.BytesIO(base64.b64decode(csv_base64))
+        result = detect_anomalies_from_csv(motorcycle_id, brand, model, csv_file, mode="idle")
+        reply({"type": "predict-from-csv", "result": result})
+
+    else:
+        reply({"status": "error", "message": f"Unknown command: {command}"})
+
+MQTT_COMMANDS = {"start-obd", "stop-obd", "report-daily", "report-weekly", "train-model", "train-fleet",
+                 "train-status", "predict", "stream-watch", "stream-unwatch", "predict-batch", "recent-data",
+                 "predict-from-csv"}
+
+if IS_SERVER_PROCESS:
+    COMMAND_DISPATCHER = CommandDispatcher(handle_command, publish_status, MQTT_COMMANDS)
 
 def start_mqtt():
     print(f"📱 Connecting to EMQX at {EMQX_HOST}:{EMQX_PORT} with TLS...")
@@ -130,14 +242,24 @@ def start_mqtt():
     mqtt_client.connect(EMQX_HOST, EMQX_PORT)
     mqtt_client.loop_start()
 
-threading.Thread(target=start_mqtt, daemon=True).start()
+if IS_SERVER_PROCESS:
+    threading.Thread(target=start_mqtt, daemon=True).start()
+
+# ───── Model Preload ─────
+# Warm the model registry with the bikes that were active recently
+MODEL_PRELOAD_HOURS = int(os.getenv("MODEL_PRELOAD_HOURS", 24))
+if IS_SERVER_PROCESS and MODEL_PRELOAD_HOURS > 0:
+    threading.Thread(target=lambda: preload_models(MODEL_PRELOAD_HOURS), daemon=True).start()
 
 # ───── OBD Subprocess Control ─────
-def start_obd_internal(motorcycle_id=None):
+# SIGTERM → SIGKILL grace period; obddata.py reads the same variable to bound its final drain
+OBD_STOP_TIMEOUT = float(os.getenv("OBD_STOP_TIMEOUT", 5))
+
+def start_obd_internal(motorcycle_id=None, reply=publish_status):
     global obd_process
 
     if obd_process and obd_process.poll() is None:
-        publish_status({"status": "running", "message": "OBD already running"})
+        reply({"status": "running", "message": "OBD already running"})
         return
 
     try:
@@ -146,28 +268,36 @@ def start_obd_internal(motorcycle_id=None):
             args.append(str(motorcycle_id))
         print(f"Starting subprocess: {' '.join(args)}")
 
-        obd_process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
-        publish_status({"status": "started", "pid": obd_process.pid})
+        # Unbuffered so collector log lines arrive as they are written
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        obd_process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1, env=env)
+        reply({"status": "started", "pid": obd_process.pid})
 
+        # Keep both pipes drained, otherwise a full pipe buffer blocks the collector
         def read_stream(stream, label, is_error=False):
             for line in iter(stream.readline, ''):
                 line = line.strip()
-                print(f"[OBD {label}] {line}")
+                if line:
+                    print(f"[OBD {label}] {line}", file=sys.stderr if is_error else sys.stdout)
+            stream.close()
+
+        threading.Thread(target=read_stream, args=(obd_process.stdout, "stdout"), daemon=True).start()
+        threading.Thread(target=read_stream, args=(obd_process.stderr, "stderr", True), daemon=True).start()
 
     except Exception as e:
-        publish_status({"status": "error", "message": str(e)})
+        reply({"status": "error", "message": str(e)})
 
-def stop_obd_internal():
+def stop_obd_internal(reply=publish_status):
     global obd_process
     if obd_process and obd_process.poll() is None:
         print("Stopping running OBD subprocess...")
         obd_process.terminate()
         try:
-            obd_process.wait(timeout=5)
+            obd_process.wait(timeout=OBD_STOP_TIMEOUT)
         except subprocess.TimeoutExpired:
             obd_process.kill()
         obd_process = None
-        publish_status({"status": "stopped", "message": "OBD stopped"})
+        reply({"status": "stopped", "message": "OBD stopped"})
     else:
         killed = False
         for proc in psutil.process_iter(["pid", "name", "cmdline"]):
@@ -178,29 +308,79 @@ def stop_obd_internal():
                     killed = True
             except (psutil.NoSuchProcess, psutil.AccessDenied):
                 continue
-        publish_status({"status": "stopped" if killed else "idle", "message": "Stopped OBD process"})
+        reply({"status": "stopped" if killed else "idle", "message": "Stopped OBD process"})
 
 # ───── ML Training / Prediction ─────
-def train_model_internal(motorcycle_id, brand):
+# Training runs on a pool of warm worker processes (see training_jobs.py);
+# the finished job is published on obd/status like the other replies, once
+# per MQTT command that asked for it so each caller gets its request_id back
+def on_training_finished(job):
+    if job["status"] == "succeeded":
+        MODEL_REGISTRY.invalidate(job["result"]["brand"], job["motorcycle_id"])
+        PREDICTION_CACHE.invalidate(job["motorcycle_id"])
+        status = {"type": "train-model", "status": "success", "message": "Model trained", "job": job}
+    else:
+        status = {"type": "train-model", "status": "error", "message": job["error"], "job": job}
+    for request_id in job["request_ids"] or [None]:
+        publish_status(status if request_id is None else {**status, "request_id": request_id})
+
+if IS_SERVER_PROCESS:
+    TRAINING_JOBS = TrainingJobs(on_finished=on_training_finished)
+
+def train_model_internal(motorcycle_id, brand, request_id=None):
+    if not motorcycle_id or not brand:
+        return {"status": "error", "message": "Missing motorcycle_id or brand"}
     try:
         brand_folder = brand.strip().replace(" ", "_").lower()
-        cmd = [sys.executable, "train_idle_model.py", "--motorcycle_id", str(motorcycle_id), "--brand", brand_folder, "--minutes", "43200"]
-        print(f"Training model: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode == 0:
-            publish_status({"status": "success", "message": "Model trained"})
+        job = TRAINING_JOBS.submit(motorcycle_id, brand_folder, request_id=request_id)
+        return {"type": "train-model", "status": "queued", "job": job}
+    except QueueFull as e:
+        return {"status": "busy", "message": str(e)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def train_fleet_internal(motorcycles=None, request_id=None):
+    """Queue the given bikes, or every bike with a model on disk."""
+    try:
+        if motorcycles:
+            bikes = [(m["motorcycle_id"], m["brand"].strip().replace(" ", "_").lower()) for m in motorcycles]
         else:
-            publish_status({"status": "error", "message": result.stderr})
+            bikes = trained_bikes(MODEL_BASE_DIR)
+        if not bikes:
+            return {"status": "error", "message": "No motorcycles to train"}
+        return {"status": "ok", **TRAINING_JOBS.submit_fleet(bikes, request_id=request_id)}
     except Exception as e:
-        publish_status({"status": "error", "message": str(e)})
+        return {"status": "error", "message": str(e)}
+
+def train_status_internal(job_id=None, motorcycle_id=None):
+    if job_id:
+        job = TRAINING_JOBS.get(job_id)
+    elif motorcycle_id:
+        job = TRAINING_JOBS.for_motorcycle(motorcycle_id)
+    else:
+        return {"status": "ok", "jobs": TRAINING_JOBS.list()}
+    if job is None:
+        return {"status": "error", "message": "No such training job"}
+    return {"status": "ok", "job": job}
 
 def predict_internal(motorcycle_id, brand, model):
     try:
         print(f"Predicting for motorcycle {motorcycle_id}, brand={brand}, model={model}")
-        return detect_anomalies(motorcycle_id, brand, model, mode="idle", minutes=30)
+        return PREDICTION_CACHE.get(motorcycle_id, brand, model, mode="idle", minutes=30)
     except Exception as e:
         return {"status": "error", "message": f"Prediction failed: {str(e)}"}
 
+def predict_batch_internal(motorcycles, minutes=30):
+    try:
+        bikes = [(m["motorcycle_id"], m["brand"], m["model"]) for m in motorcycles]
+        if not bikes:
+            return {"status": "error", "message": "No motorcycles given"}
+        print(f"Batch predicting for {len(bikes)} motorcycles")
+        results = detect_anomalies_batch(bikes, mode="idle", minutes=int(minutes))
+        return {"status": "ok", "results": results}
+    except Exception as e:
+        return {"status": "error", "message": f"Batch prediction failed: {str(e)}"}
+
 # ───── Flask API Routes ─────
 @app.route("/start-obd", methods=["POST"])
 def start_obd_route():
@@ -216,20 +396,131 @@ def stop_obd_route():
 @app.route("/train_model", methods=["POST"])
 def train_model_route():
     data = request.get_json()
-    threading.Thread(target=lambda: train_model_internal(data["motorcycle_id"], data["brand"]), daemon=True).start()
-    return jsonify({"message": "Training started"}), 200
+    result = train_model_internal(data.get("motorcycle_id"), data.get("brand"))
+    codes = {"queued": 202, "busy": 429}
+    return jsonify(result), codes.get(result["status"], 400)
+
+@app.route("/train/fleet", methods=["POST"])
+def train_fleet_route():
+    data = request.get_json(silent=True) or {}
+    result = train_fleet_internal(data.get("motorcycles"))
+    return jsonify(result), 202 if result["status"] == "ok" else 400
+
+@app.route("/train/jobs", methods=["GET"])
+def train_jobs_route():
+    motorcycle_id = request.args.get("motorcycle_id")
+    if motorcycle_id:
+        return jsonify(train_status_internal(motorcycle_id=motorcycle_id))
+    return jsonify({"status": "ok", "jobs": TRAINING_JOBS.list(request.args.get("status"))})
+
+@app.route("/train/jobs/<job_id>", methods=["GET"])
+def train_job_route(job_id):
+    result = train_status_internal(job_id=job_id)
+    return jsonify(result), 200 if result["status"] == "ok" else 404
 
 @app.route("/predict", methods=["POST"])
 def predict_route():
     data = request.get_json()
     return jsonify(predict_internal(data["motorcycle_id"], data["brand"], data["model"]))
 
+@app.route("/predict/csv", methods=["POST"])
+def predict_csv_route():
+    """
+    Score an uploaded ride log: multipart form with `file` plus motorcycle_id,
+    brand and model fields, or a raw text/csv body with those as query args.
+    """
+    fields = request.form if request.files else request.args
+    motorcycle_id, brand, model = fields.get("motorcycle_id"), fields.get("brand"), fields.get("model")
+    upload = request.files.get("file").stream if request.files.get("file") else request.stream
+    if not all([motorcycle_id, brand, model]):
+        return jsonify({"status": "error", "message": "Missing motorcycle_id, brand or model"}), 400
+    result = detect_anomalies_from_csv(motorcycle_id, brand, model, upload, mode="idle")
+    return jsonify(result), 200 if result["status"] == "ok" else 400
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch_route():
+    data = request.get_json()
+    return jsonify(predict_batch_internal(data.get("motorcycles", []), data.get("minutes", 30)))
+
+@app.route("/stream/watch", methods=["POST"])
+def stream_watch_route():
+    data = request.get_json()
+    if not all(data.get(k) for k in ("motorcycle_id", "brand", "model")):
+        return jsonify({"error": "Missing motorcycle_id, brand or model"}), 400
+    STREAM_DETECTOR.watch(data["motorcycle_id"], data["brand"], data["model"])
+    return jsonify({"motorcycle_id": data["motorcycle_id"], "watching": True})
+
+@app.route("/stream/unwatch", methods=["POST"])
+def stream_unwatch_route():
+    motorcycle_id = request.get_json().get("motorcycle_id")
+    return jsonify({"motorcycle_id": motorcycle_id, "watching": False,
+                    "was_watching": STREAM_DETECTOR.unwatch(motorcycle_id)})
+
+@app.route("/stream/status", methods=["GET"])
+def stream_status_route():
+    motorcycle_id = request.args.get("motorcycle_id")
+    if motorcycle_id is None:
+        return jsonify(STREAM_DETECTOR.status())
+    status = STREAM_DETECTOR.status(motorcycle_id)
+    if status is None:
+        return jsonify({"error": f"{motorcycle_id} is not being watched"}), 404
+    return jsonify(status)
+
 @app.route("/recent-data", methods=["POST"])
 def recent_data_route():
     data = request.get_json()
-    rows = get_recent_data(data["motorcycle_id"], int(data.get("minutes", 30)))
+    motorcycle_id = data["motorcycle_id"]
+    minutes = int(data.get("minutes", 30))
+    cursor = data.get("cursor")
+    limit = data.get("limit")
+    stream = data.get("stream")
+    points = data.get("points")
+    method = data.get("downsample", "mean")
+    fmt = data.get("format", "rows")
+    if method not in DOWNSAMPLE_METHODS:
+        return jsonify({"error": f"downsample must be one of {list(DOWNSAMPLE_METHODS)}"}), 400
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {list(FORMATS)}"}), 400
+    try:
+        cursor = parse_cursor(cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if fmt != "rows":
+        columnar = get_recent_columnar(motorcycle_id, minutes, cursor, limit, points, method)
+        if fmt == "columnar":
+            return jsonify(columnar)
+        try:
+            return Response(encode_msgpack(columnar), mimetype="application/x-msgpack")
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 501
+
+    if stream == "ndjson":
+        return Response(stream_with_context(stream_ndjson(motorcycle_id, minutes, cursor, limit, points, method)),
+                        mimetype="application/x-ndjson")
+    if stream:
+        return Response(stream_with_context(stream_json(motorcycle_id, minutes, cursor, limit, points, method)),
+                        mimetype="application/json")
+
+    state = {}
+    rows = get_recent_data(motorcycle_id, minutes, cursor, limit, state, points, method)
+    if limit:
+        return jsonify({"rows": rows, "next_cursor": state.get("next_cursor") if page_filled(state, limit) else None})
     return jsonify({"rows": rows})
 
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    return jsonify({
+        "influx": pool_stats(),
+        "report_cache": ROLLUP_CACHE.stats(),
+        "telemetry": telemetry_stats(),
+        "stream_detector": STREAM_DETECTOR.stats(),
+        "models": MODEL_REGISTRY.stats(),
+        "training": TRAINING_JOBS.stats(),
+        "mqtt_commands": COMMAND_DISPATCHER.stats(),
+        "prediction_cache": PREDICTION_CACHE.stats()
+    })
+
 @app.route("/health", methods=["GET"])
 def health_check():
     return jsonify({"status": "ok"})
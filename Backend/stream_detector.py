@@ -0,0 +1,276 @@
+"""
+stream_detector.py
+──────────────────
+Continuous anomaly detection for live bikes, fed from MQTT telemetry.
+
+Each watched bike keeps a rolling window of its last STREAM_WINDOW_ROWS
+complete samples. Mean and variance are updated in O(1) per sample with
+Welford's add/remove updates, and min/max with monotonic deques, so the
+window never has to be re-read, re-scaled or re-aggregated.
+
+StandardScaler is affine per feature, so the 24-feature model input
+(mean/std/max/min of the scaled window, see anomaly_model._aggregate_features)
+follows directly from the raw window statistics. The IsolationForest is only
+re-run when that vector has moved by at least STREAM_RESCORE_DELTA (in
+scaled units) since the last score. Alerts are published to obd/status when
+a bike's state changes; InfluxDB is never queried.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from anomaly_model import FEATURES, MIN_WINDOW_ROWS, RANGE_TABLE, WINDOW_ROWS, _load_model
+from range_table import SEVERITY_LABELS, SEVERITY_WARNING, normalize
+
+STREAM_WINDOW_ROWS = int(os.getenv("STREAM_WINDOW_ROWS", WINDOW_ROWS))
+STREAM_RESCORE_DELTA = float(os.getenv("STREAM_RESCORE_DELTA", 0.1))
+STREAM_MIN_SCORE_INTERVAL = float(os.getenv("STREAM_MIN_SCORE_INTERVAL", 1.0))
+
+# Telemetry uses python-OBD command names; the model uses the stored field names
+PID_TO_FEATURE = {f.upper(): f for f in FEATURES}
+
+
+class RollingStats:
+    """Mean, variance, min and max over the last `size` rows, updated in O(1)."""
+
+    def __init__(self, size, n_features):
+        self.size = size
+        self._rows = np.empty((size, n_features))
+        self._seq = 0       # rows pushed so far
+        self.count = 0
+        self.mean = np.zeros(n_features)
+        self._m2 = np.zeros(n_features)
+        self._max = [deque() for _ in range(n_features)]  # (seq, value), values decreasing
+        self._min = [deque() for _ in range(n_features)]  # (seq, value), values increasing
+
+    def push(self, row):
+        row = np.asarray(row, dtype=float)
+        slot = self._seq % self.size
+
+        if self.count == self.size:
+            # Remove the oldest row (reverse Welford step)
+            old = self._rows[slot].copy()
+            self.count -= 1
+            delta = old - self.mean
+            self.mean -= delta / self.count
+            self._m2 -= delta * (old - self.mean)
+
+        # Add the new row (Welford step)
+        self._rows[slot] = row
+        self.count += 1
+        delta = row - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (row - self.mean)
+
+        oldest_kept = self._seq - self.size + 1
+        for j, value in enumerate(row.tolist()):
+            high, low = self._max[j], self._min[j]
+            while high and high[-1][1] <= value:
+                high.pop()
+            while low and low[-1][1] >= value:
+                low.pop()
+            high.append((self._seq, value))
+            low.append((self._seq, value))
+            if high[0][0] < oldest_kept:
+                high.popleft()
+            if low[0][0] < oldest_kept:
+                low.popleft()
+        self._seq += 1
+
+        # Re-derive mean/M2 exactly once per window length to stop float drift
+        if self._seq % self.size == 0:
+            rows = self._rows[:self.count]
+            self.mean = rows.mean(axis=0)
+            self._m2 = ((rows - self.mean) ** 2).sum(axis=0)
+
+    @property
+    def var(self):
+        return np.maximum(self._m2 / self.count, 0.0) if self.count else np.zeros_like(self.mean)
+
+    @property
+    def max(self):
+        return np.array([w[0][1] for w in self._max])
+
+    @property
+    def min(self):
+        return np.array([w[0][1] for w in self._min])
+
+
+def scaled_aggregate(stats, scaler):
+    """The (1, 24) model input of the window, derived from its raw statistics."""
+    mu = getattr(scaler, "mean_", None)
+    sigma = getattr(scaler, "scale_", None)
+    mu = np.zeros_like(stats.mean) if mu is None else mu
+    sigma = np.ones_like(stats.mean) if sigma is None else sigma
+    return np.hstack([
+        (stats.mean - mu) / sigma,
+        np.sqrt(stats.var) / sigma,
+        (stats.max - mu) / sigma,
+        (stats.min - mu) / sigma
+    ]).reshape(1, -1)
+
+
+class _Bike:
+    __slots__ = ("brand", "model", "mode", "stats", "scored_vector", "scored_at",
+                 "state", "last_result", "error")
+
+    def __init__(self, brand, model, mode):
+        self.brand = brand
+        self.model = model
+        self.mode = mode
+        self.stats = RollingStats(STREAM_WINDOW_ROWS, len(FEATURES))
+        self.scored_vector = None
+        self.scored_at = 0.0
+        self.state = None
+        self.last_result = None
+        self.error = None
+
+
+class StreamDetector:
+    """
+    Telemetry listener (see server.add_telemetry_listener). Window updates run
+    on the MQTT thread; model scoring runs on one background worker.
+    """
+
+    def __init__(self, publish):
+        self.publish = publish
+        self._bikes = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._stats = {"samples": 0, "incomplete_samples": 0, "scores": 0,
+                       "skipped_unchanged": 0, "alerts": 0, "errors": 0}
+        threading.Thread(target=self._worker, daemon=True, name="stream-detector").start()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    # ───── Watch list ─────
+    def watch(self, motorcycle_id, brand, model, mode="idle"):
+        with self._lock:
+            self._bikes[str(motorcycle_id)] = _Bike(normalize(brand), normalize(model), mode)
+        print(f"[INFO] Streaming detection enabled for {motorcycle_id}")
+
+    def unwatch(self, motorcycle_id):
+        with self._lock:
+            return self._bikes.pop(str(motorcycle_id), None) is not None
+
+    # ───── Telemetry ─────
+    def __call__(self, motorcycle_id, samples):
+        bike = self._bikes.get(str(motorcycle_id))
+        if bike is None:
+            return
+        for _, data in samples:
+            values = {PID_TO_FEATURE[k]: v for k, v in data.items() if k in PID_TO_FEATURE}
+            # Same rows the batch path scores: complete, and not all zero
+            if len(values) < len(FEATURES) or any(v is None for v in values.values()):
+                self._count("incomplete_samples")
+                continue
+            row = [float(values[f]) for f in FEATURES]
+            if not any(row):
+                continue
+            with self._lock:
+                bike.stats.push(row)
+                self._stats["samples"] += 1
+        if bike.stats.count >= MIN_WINDOW_ROWS:
+            self._enqueue(str(motorcycle_id))
+
+    def _enqueue(self, motorcycle_id):
+        with self._lock:
+            if motorcycle_id in self._queued:
+                return
+            self._queued.add(motorcycle_id)
+        self._queue.put(motorcycle_id)
+
+    # ───── Scoring ─────
+    def _worker(self):
+        while True:
+            motorcycle_id = self._queue.get()
+            with self._lock:
+                self._queued.discard(motorcycle_id)
+                bike = self._bikes.get(motorcycle_id)
+            if bike is None:
+                continue
+            try:
+                self._score(motorcycle_id, bike)
+            except Exception as e:
+                self._count("errors")
+                if str(e) != bike.error:
+                    print(f"[ERROR] Streaming detection failed for {motorcycle_id}: {e}")
+                bike.error = str(e)
+
+    def _score(self, motorcycle_id, bike):
+        now = time.monotonic()
+        if now - bike.scored_at < STREAM_MIN_SCORE_INTERVAL:
+            return
+
+        model_obj, scaler = _load_model(bike.brand, motorcycle_id, bike.mode)
+        with self._lock:
+            vector = scaled_aggregate(bike.stats, scaler)
+            mean_values = bike.stats.mean.copy()
+            rows = bike.stats.count
+
+        if bike.scored_vector is not None and \
+                np.max(np.abs(vector - bike.scored_vector)) < STREAM_RESCORE_DELTA:
+            self._count("skipped_unchanged")
+            return
+
+        is_anomaly = bool(model_obj.predict(vector)[0] == -1)
+        score = float(model_obj.decision_function(vector)[0])
+        codes, _ = RANGE_TABLE.classify(mean_values.reshape(1, -1), bike.brand, bike.model)
+        severity = {f: SEVERITY_LABELS[codes[0, j]] for j, f in enumerate(FEATURES)}
+        abnormal = [f for j, f in enumerate(FEATURES) if codes[0, j] >= SEVERITY_WARNING]
+
+        bike.scored_vector = vector
+        bike.scored_at = now
+        bike.error = None
+        self._count("scores")
+
+        result = {
+            "type": "stream-anomaly",
+            "motorcycle_id": motorcycle_id,
+            "anomaly": is_anomaly,
+            "score": round(score, 4),
+            "abnormal_features": abnormal,
+            "severity": severity,
+            "means": {f: round(float(v), 2) for f, v in zip(FEATURES, mean_values)},
+            "window_rows": rows,
+            "time": time.time()
+        }
+        bike.last_result = result
+
+        state = (is_anomaly, tuple(abnormal))
+        if state != bike.state:
+            alert = bike.state is not None or is_anomaly or abnormal
+            bike.state = state
+            if alert:
+                self._count("alerts")
+                print(f"[STREAM] {motorcycle_id}: anomaly={is_anomaly} abnormal={abnormal}")
+                self.publish(result)
+
+    # ───── Status ─────
+    def status(self, motorcycle_id=None):
+        with self._lock:
+            bikes = dict(self._bikes)
+        if motorcycle_id is not None:
+            bike = bikes.get(str(motorcycle_id))
+            return None if bike is None else {
+                "brand": bike.brand, "model": bike.model, "window_rows": bike.stats.count,
+                "last_result": bike.last_result, "error": bike.error
+            }
+        return {m: self.status(m) for m in bikes}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["watched"] = len(self._bikes)
+        stats["queued"] = self._queue.qsize()
+        stats["window_rows"] = STREAM_WINDOW_ROWS
+        stats["rescore_delta"] = STREAM_RESCORE_DELTA
+        return stats
@@ -0,0 +1,132 @@
+"""
+telemetry_codec.py
+──────────────────
+Compact binary form of the live telemetry the collector publishes.
+
+JSON telemetry stays on obd/motorcycle/<id>/data. Binary frames go to
+obd/motorcycle/<id>/data/bin, and their first byte is the codec version, so
+a receiver can tell the two apart by topic suffix or by first byte (a JSON
+object always starts with "{").
+
+Frame layout (little-endian):
+
+    u8   version          (TELEMETRY_VERSION)
+    u8   flags            (reserved, 0)
+    u16  sample count     n
+    u64  base time        epoch milliseconds of the first sample
+    u16  PID mask         bit i set → PID_INDEX[i] is present in every sample
+    n × [ u32 delta ms from base time, k × f32 value (NaN = no reading) ]
+
+With all six PIDs a sample costs 28 bytes instead of ~170 bytes of JSON, and
+micro-batching N samples per publish divides the per-message MQTT/TLS
+overhead by N. Values are already rounded to 2 decimals by the collector,
+so decode() rounds the float32 values back to 2 decimals.
+"""
+
+import json
+import math
+import struct
+
+TELEMETRY_VERSION = 1
+BINARY_SUFFIX = "/bin"
+
+# Fixed PID order of the wire format. Append only; never reorder.
+PID_INDEX = (
+    "RPM",
+    "COOLANT_TEMP",
+    "ENGINE_LOAD",
+    "ELM_VOLTAGE",
+    "THROTTLE_POS",
+    "LONG_FUEL_TRIM_1"
+)
+
+_HEADER = struct.Struct("<BBHQH")
+_DELTA = struct.Struct("<I")
+
+
+def encode(samples):
+    """
+    [(epoch_ms, {pid_name: value or None}), ...] → one binary frame.
+    PIDs outside PID_INDEX are ignored.
+    """
+    if not samples:
+        raise ValueError("Cannot encode an empty batch")
+    present = [name for name in PID_INDEX if any(name in data for _, data in samples)]
+    mask = sum(1 << PID_INDEX.index(name) for name in present)
+    values = struct.Struct(f"<{len(present)}f")
+
+    base_ms = int(samples[0][0])
+    parts = [_HEADER.pack(TELEMETRY_VERSION, 0, len(samples), base_ms, mask)]
+    for ts_ms, data in samples:
+        parts.append(_DELTA.pack(int(ts_ms) - base_ms))
+        parts.append(values.pack(*(
+            math.nan if data.get(name) is None else float(data[name]) for name in present
+        )))
+    return b"".join(parts)
+
+
+def decode(frame):
+    """Binary frame → [(epoch_ms, {pid_name: value}), ...]; missing readings are left out."""
+    if len(frame) < _HEADER.size:
+        raise ValueError("Telemetry frame too short")
+    version, _flags, count, base_ms, mask = _HEADER.unpack_from(frame)
+    if version != TELEMETRY_VERSION:
+        raise ValueError(f"Unsupported telemetry version {version}")
+
+    present = [name for i, name in enumerate(PID_INDEX) if mask & (1 << i)]
+    values = struct.Struct(f"<{len(present)}f")
+    step = _DELTA.size + values.size
+    if len(frame) != _HEADER.size + count * step:
+        raise ValueError("Telemetry frame length does not match its header")
+
+    samples = []
+    offset = _HEADER.size
+    for _ in range(count):
+        (delta,) = _DELTA.unpack_from(frame, offset)
+        row = values.unpack_from(frame, offset + _DELTA.size)
+        samples.append((base_ms + delta, {
+            name: round(v, 2) for name, v in zip(present, row) if not math.isnan(v)
+        }))
+        offset += step
+    return samples
+
+
+def decode_message(topic, payload):
+    """
+    Decode a message from obd/motorcycle/<id>/data[/bin] in either codec.
+    Returns (motorcycle_id, codec, samples). JSON messages carry no time, so
+    their single sample has epoch_ms None.
+    """
+    parts = topic.split("/")
+    if len(parts) < 4 or parts[0] != "obd" or parts[1] != "motorcycle" or parts[3] != "data":
+        raise ValueError(f"Not a telemetry topic: {topic}")
+    motorcycle_id = parts[2]
+
+    if topic.endswith(BINARY_SUFFIX) or payload[:1] == bytes([TELEMETRY_VERSION]):
+        return motorcycle_id, "binary", decode(payload)
+
+    message = json.loads(payload.decode() if isinstance(payload, bytes) else payload)
+    return message.get("motorcycle_id", motorcycle_id), "json", [(None, message.get("data", {}))]
+
+
+class TelemetryBatcher:
+    """Collects samples and hands back a frame every `batch_size` samples."""
+
+    def __init__(self, batch_size=5):
+        self.batch_size = max(1, int(batch_size))
+        self._samples = []
+
+    def add(self, epoch_ms, data):
+        """Buffer one sample; returns an encoded frame when the batch is full, else None."""
+        self._samples.append((epoch_ms, data))
+        if len(self._samples) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Encode whatever is buffered (None when empty)."""
+        if not self._samples:
+            return None
+        frame = encode(self._samples)
+        self._samples = []
+        return frame
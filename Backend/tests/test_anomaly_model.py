@@ -0,0 +1,161 @@
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import anomaly_model
+from anomaly_model import FEATURES, SENSOR_SUGGESTIONS
+
+with open(os.path.join(os.path.dirname(anomaly_model.__file__), "normal_ranges.json")) as f:
+    NORMAL_RANGES = json.load(f)
+
+
+# ───── Per-row reference (the code classify_matrix replaced) ─────
+def _normalize(text):
+    return str(text).strip().lower().replace(" ", "_")
+
+def classify_value(feature, value, brand, model):
+    try:
+        ranges = NORMAL_RANGES[_normalize(brand)][_normalize(model)][feature]
+        if value <= ranges["critical_min"] or value >= ranges["critical_max"]:
+            return "critical"
+        elif value <= ranges["warning_min"] or value >= ranges["warning_max"]:
+            return "warning"
+        else:
+            return "normal"
+    except Exception:
+        return "unknown"
+
+def compute_severity_score(feature, value, brand, model):
+    try:
+        ranges = NORMAL_RANGES[_normalize(brand)][_normalize(model)][feature]
+        normal_min, normal_max = ranges["warning_min"], ranges["warning_max"]
+        if normal_min <= value <= normal_max:
+            return 0
+        if value < normal_min:
+            score = (normal_min - value) / (normal_min - ranges["critical_min"])
+        elif value > normal_max:
+            score = (value - normal_max) / (ranges["critical_max"] - normal_max)
+        else:
+            score = 0
+        return int(min(max(score * 100, 0), 100))
+    except Exception:
+        return -1
+
+def reference_interpretation(df, brand, model):
+    brand, model = _normalize(brand), _normalize(model)
+    explanations, abnormal_features = [], []
+    for f in FEATURES:
+        mean_value = float(df[f].mean())
+        severity = classify_value(f, mean_value, brand, model)
+        severity_score = compute_severity_score(f, mean_value, brand, model)
+        desc, high_tip, low_tip = SENSOR_SUGGESTIONS.get(f, ("", "", ""))
+        try:
+            if f == "long_fuel_trim_1":
+                is_high = mean_value > 0
+            else:
+                r = NORMAL_RANGES[brand][model][f]
+                is_high = mean_value > (r["warning_min"] + r["warning_max"]) / 2
+        except Exception:
+            is_high = True
+        if severity != "normal":
+            abnormal_features.append(f)
+        tip_base = high_tip if is_high else low_tip
+        level = "High" if is_high else "Low"
+        if severity == "critical":
+            tip = f"🔴 CRITICAL ({level}): {tip_base} Please consult a mechanic immediately."
+        elif severity == "warning":
+            tip = f"🟡 WARNING ({level}): {tip_base} Monitor this and schedule maintenance."
+        elif severity == "normal":
+            tip = "🟢 Normal: Sensor reading is within expected range."
+        else:
+            tip = "⚠️ Unknown: No reference range found."
+        explanations.append({"feature": f, "status": severity, "value": round(mean_value, 2),
+                             "severity_score": severity_score, "description": desc, "tip": tip})
+
+    row_anomalies = []
+    for i, row in df.iterrows():
+        issues = []
+        for f in FEATURES:
+            sev = classify_value(f, row[f], brand, model)
+            if sev in ["critical", "warning"]:
+                issues.append(f"{f}={row[f]:.2f} → {sev}")
+        if issues:
+            row_anomalies.append({
+                "row_index": i,
+                "time": row["_time"],
+                "issues": issues,
+                "values": {**{f: row[f] for f in FEATURES}, "_time": row["_time"]},
+                "severity": {f: classify_value(f, row[f], brand, model) for f in FEATURES}
+            })
+    return explanations, abnormal_features, row_anomalies
+
+
+# ───── Helpers ─────
+def _plain(value):
+    """NaN-safe, type-insensitive form for comparing nested results."""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    if isinstance(value, (float, np.floating)):
+        return None if math.isnan(value) else float(value)
+    return value
+
+def _window(rows):
+    df = pd.DataFrame(rows, columns=FEATURES, dtype=float)
+    df.insert(0, "_time", pd.date_range("2026-01-01", periods=len(df), freq="s", tz="UTC"))
+    df.index = df.index + 100  # labels differ from positions, like a filtered window
+    return df
+
+def _assert_matches_reference(df, brand, model):
+    result = anomaly_model._interpret_window("1", brand, model, df, is_anomaly=False)
+    explanations, abnormal_features, row_anomalies = reference_interpretation(df, brand, model)
+    assert _plain(result["explanations"]) == _plain(explanations)
+    assert result["abnormal_features"] == abnormal_features
+    assert _plain(result["row_anomalies"]) == _plain(row_anomalies)
+
+
+# ───── Vectorized vs per-row ─────
+@pytest.mark.parametrize("brand, model", [("Yamaha", "NMAX 155"), ("Honda", "Click i125")])
+def test_random_windows_match_the_per_row_loop(brand, model):
+    rng = np.random.default_rng(3)
+    ranges = NORMAL_RANGES[_normalize(brand)][_normalize(model)]
+    low = np.array([ranges[f]["critical_min"] for f in FEATURES], dtype=float)
+    high = np.array([ranges[f]["critical_max"] for f in FEATURES], dtype=float)
+    span = high - low
+    rows = rng.uniform(low - span / 4, high + span / 4, size=(200, len(FEATURES)))
+    _assert_matches_reference(_window(rows), brand, model)
+
+
+def test_boundaries_zero_span_and_nan_cells_match():
+    r = NORMAL_RANGES["yamaha"]["nmax_155"]
+    rows = []
+    for key in ("warning_min", "warning_max", "critical_min", "critical_max"):
+        rows.append([r[f][key] for f in FEATURES])
+    # elm_voltage has critical_min == warning_min: a zero-width low band
+    below = [r[f]["warning_min"] for f in FEATURES]
+    below[FEATURES.index("elm_voltage")] = 11.0
+    rows.append(below)
+    rows.append([np.nan] * len(FEATURES))
+    with_nan = [r[f]["critical_max"] + 1 for f in FEATURES]
+    with_nan[0] = np.nan
+    rows.append(with_nan)
+    _assert_matches_reference(_window(rows), "yamaha", "nmax_155")
+
+
+def test_unknown_brand_matches():
+    rows = np.random.default_rng(4).uniform(0, 2000, size=(20, len(FEATURES)))
+    _assert_matches_reference(_window(rows), "Ducati", "Panigale")
+
+
+def test_scalar_helpers_match():
+    for f in FEATURES:
+        for value in (-10.0, 0.0, 12.0, 14.9, 15.0, 60.0, 1500.0, float("nan")):
+            for brand, model in (("yamaha", "nmax_155"), ("nobody", "nothing")):
+                assert anomaly_model.classify_value(f, value, brand, model) == classify_value(f, value, brand, model)
+                assert (anomaly_model.compute_severity_score(f, value, brand, model)
+                        == compute_severity_score(f, value, brand, model))
@@ -0,0 +1,71 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+import asgi_app
+from report_api import FEATURES
+
+
+class FakeQueryApiAsync:
+    def __init__(self, frames):
+        self.frames = frames
+        self.queries = []
+
+    async def query_data_frame(self, flux):
+        self.queries.append(flux)
+        await asyncio.sleep(0.01)
+        return self.frames(flux)
+
+
+class FakeInfluxAsync:
+    def __init__(self, frames):
+        self.api = FakeQueryApiAsync(frames)
+
+    def query_api(self):
+        return self.api
+
+
+def _frames(flux):
+    if "aggregateWindow" in flux:
+        now = pd.Timestamp.now(tz="UTC").floor("5min")
+        return pd.DataFrame({"result": "_result", "table": 0, "bucket": [now - pd.Timedelta(minutes=5), now],
+                             **{f"{f}_{stat}": [2.0, 4.0] for f in FEATURES for stat in ("sum", "min", "max")},
+                             **{f"{f}_count": [1.0, 1.0] for f in FEATURES}})
+    return pd.DataFrame()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeInfluxAsync(_frames)
+    monkeypatch.setattr(asgi_app, "_influx", fake)
+    blocking = []
+    real = asgi_app.run_blocking
+    monkeypatch.setattr(asgi_app, "run_blocking", lambda fn, *a, **kw: blocking.append(fn.__name__) or real(fn, *a, **kw))
+    client = asgi_app.app.test_client()
+    client.queries, client.blocking = fake.api.queries, blocking
+    return client
+
+
+def test_reports_query_on_the_async_client_and_fold_on_a_thread(client):
+    async def run():
+        response = await client.get("/reports/daily?motorcycle_id=9&bucket=hour")
+        return await response.get_json()
+
+    report = asyncio.run(run())
+    assert report["rpm"] == 3.0 and report["rpm_count"] == 2 and report["bucket"] == "hour"
+    assert len(client.queries) == 1 and "aggregateWindow" in client.queries[0]
+    assert client.blocking == ["build_report"]
+
+
+def test_concurrent_predictions_share_one_window_query(client):
+    async def run():
+        responses = await asyncio.gather(*(
+            client.post("/predict", json={"motorcycle_id": "9", "brand": "Yamaha", "model": "NMAX 155"})
+            for _ in range(5)))
+        return [await r.get_json() for r in responses]
+
+    results = asyncio.run(run())
+    assert len(client.queries) == 1 and 'r.motorcycle_id == "9"' in client.queries[0]
+    assert client.blocking == ["detect_anomalies_in_window"]
+    assert all(r == results[0] for r in results)
@@ -0,0 +1,133 @@
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_store
+from feature_store import FEATURES, NS_PER_DAY, NS_PER_MINUTE, FeatureStore, _day, _to_ns
+
+
+def _frame(times_ns, value=None):
+    n = len(times_ns)
+    rng = np.random.default_rng(n)
+    df = pd.DataFrame({f: rng.normal(size=n) if value is None else np.full(n, float(value)) for f in FEATURES})
+    df.insert(0, "_time", pd.to_datetime(times_ns, utc=True))
+    return df
+
+
+class FakeInflux:
+    """query_features() over an in-memory frame, recording each range asked for."""
+
+    def __init__(self, df):
+        self.df = df
+        self.calls = []
+
+    @staticmethod
+    def _ns(expr):
+        return int(re.fullmatch(r"time\(v: (-?\d+)\)", expr).group(1))
+
+    def __call__(self, moto_id, start, stop=None):
+        lo, hi = self._ns(start), self._ns(stop) if stop else None
+        self.calls.append((lo, hi))
+        t = _to_ns(self.df["_time"])
+        keep = (t >= lo) & (True if hi is None else t < hi)
+        return self.df[keep].reset_index(drop=True)
+
+
+@pytest.fixture
+def influx(monkeypatch):
+    now = time.time_ns()
+    # One row a minute over the last three days, half a minute off the window edges
+    fake = FakeInflux(_frame(now - (np.arange(3 * 1440, 0, -1) * 2 - 1) * NS_PER_MINUTE // 2))
+    monkeypatch.setattr(feature_store, "query_features", fake)
+    return fake
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FeatureStore(str(tmp_path), overlap_minutes=60, retention_days=45)
+
+
+def _rows(df):
+    return {int(t): tuple(row) for t, row in zip(_to_ns(df["_time"]), df[FEATURES].to_numpy())}
+
+
+def test_first_sync_pulls_the_window_once(store, influx):
+    fetched = store.sync("7", 120)
+    assert len(influx.calls) == 1 and influx.calls[0][1] is None
+    assert fetched["incremental"] == 120 and fetched["backfill"] == 0
+
+    df = store.load("7", 120)
+    assert list(df.columns) == ["_time", *FEATURES]
+    assert _rows(df) == _rows(influx(None, f"time(v: {influx.calls[0][0]})"))
+    state = store.sync_state("7")
+    assert state["end_ns"] >= state["start_ns"] + 120 * NS_PER_MINUTE
+
+
+def test_incremental_sync_rereads_only_the_overlap(store, influx):
+    store.sync("7", 120)
+    end_ns = store.sync_state("7")["end_ns"]
+    late = _frame([end_ns - 30 * NS_PER_MINUTE + 1], value=42)  # spooled upload, older than the last sync
+    influx.df = pd.concat([influx.df, late], ignore_index=True)
+
+    fetched = store.sync("7", 120)
+    assert influx.calls[-1] == (end_ns - 60 * NS_PER_MINUTE, None)
+    assert fetched["backfill"] == 0 and fetched["incremental"] == 61
+
+    df = store.load("7", 120)
+    assert len(df) == len(set(_to_ns(df["_time"])))  # overlap rows stored twice, read once
+    assert _rows(late).items() <= _rows(df).items()
+
+
+def test_a_longer_window_backfills_only_the_gap(store, influx):
+    store.sync("7", 120)
+    start_ns = store.sync_state("7")["start_ns"]
+    fetched = store.sync("7", 600)
+    lo, hi = influx.calls[1]
+    assert hi == start_ns and lo < start_ns
+    assert fetched["backfill"] == 480
+    assert len(store.load("7", 600)) == 600
+
+
+def test_the_newest_part_wins_on_duplicate_rows(store):
+    now = time.time_ns()
+    times = now - np.arange(10, 0, -1) * NS_PER_MINUTE
+    store.append("7", _frame(times, value=1))
+    store.append("7", _frame(times[3:6], value=2))
+    df = store.load("7", 20)
+    assert len(df) == 10
+    assert df["rpm"].tolist() == [1] * 3 + [2] * 3 + [1] * 4
+
+
+def test_compaction_merges_old_days_and_prune_drops_them(store):
+    today = time.time_ns() // NS_PER_DAY * NS_PER_DAY
+    days = [today - d * NS_PER_DAY for d in (3, 2, 1)]
+    for value in (1, 2):  # two parts per day, the second overwriting half the rows
+        for day in days:
+            times = day + np.arange(0, 10 if value == 1 else 5) * NS_PER_MINUTE
+            store.append("7", _frame(times, value=value))
+    before = store.load("7", 5 * 1440)
+
+    assert store.compact("7", before_day=_day(days[2])) == 2
+    bike = store._bike_dir("7")
+    assert [len(store._parts(os.path.join(bike, _day(d)))) for d in days] == [1, 1, 2]
+    after = store.load("7", 5 * 1440)
+    pd.testing.assert_frame_equal(after, before)
+    assert after["rpm"].tolist() == ([2] * 5 + [1] * 5) * 3
+
+    assert store.prune("7", before_day=_day(days[1])) == 1
+    assert not os.path.exists(os.path.join(bike, _day(days[0])))
+    assert len(store.load("7", 5 * 1440)) == 20
+
+
+def test_load_projects_columns_and_cuts_the_range(store):
+    now = time.time_ns()
+    store.append("7", _frame(now - np.arange(100, 0, -1) * NS_PER_MINUTE))
+    df = store.load("7", 30, columns=["rpm", "coolant_temp"])
+    assert list(df.columns) == ["_time", "rpm", "coolant_temp"]
+    assert len(df) in (29, 30)  # the oldest row sits on the boundary as the clock moves
+    assert (_to_ns(df["_time"]) >= now - 30 * NS_PER_MINUTE).all()
+    assert store.load("8", 30).empty
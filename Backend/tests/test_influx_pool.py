@@ -0,0 +1,132 @@
+import threading
+
+import pandas as pd
+import pytest
+
+import influx_pool
+
+
+class FakeQueryApi:
+    def __init__(self, client):
+        self.client = client
+
+    def query_data_frame(self, flux):
+        if self.client.fail:
+            raise ConnectionError("InfluxDB is down")
+        return self.client.frames
+
+    def query_stream(self, flux):
+        if self.client.fail:
+            raise ConnectionError("InfluxDB is down")
+        return iter(self.client.records)
+
+
+class FakeClient:
+    created = 0
+
+    def __init__(self, **kwargs):
+        FakeClient.created += 1
+        self.kwargs = kwargs
+        self.fail = False
+        self.frames = pd.DataFrame()
+        self.records = []
+        self.closed = False
+
+    def query_api(self):
+        return FakeQueryApi(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool(monkeypatch):
+    FakeClient.created = 0
+    monkeypatch.setattr(influx_pool, "InfluxDBClient", FakeClient)
+    monkeypatch.setattr(influx_pool, "_client", None)
+    monkeypatch.setattr(influx_pool, "_slots", threading.BoundedSemaphore(2))
+    monkeypatch.setattr(influx_pool, "_stats", dict.fromkeys(influx_pool._stats, 0))
+
+
+def _slots_free():
+    taken = 0
+    while influx_pool._slots.acquire(blocking=False):
+        taken += 1
+    for _ in range(taken):
+        influx_pool._slots.release()
+    return taken
+
+
+def test_one_client_is_shared_by_all_threads():
+    barrier = threading.Barrier(16)
+    clients = []
+
+    def worker():
+        barrier.wait()
+        clients.append(influx_pool.get_client())
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert FakeClient.created == 1
+    assert all(c is clients[0] for c in clients)
+    stats = influx_pool.pool_stats()
+    assert stats["client_misses"] == 1 and stats["client_hits"] == 15
+    assert clients[0].kwargs["connection_pool_maxsize"] == influx_pool.INFLUX_POOL_SIZE
+
+    influx_pool.close_client()
+    assert clients[0].closed
+    assert influx_pool.get_client() is not clients[0]
+
+
+def test_failed_queries_release_their_slot_and_count_as_errors():
+    influx_pool.get_client().fail = True
+    for _ in range(5):  # more failures than slots
+        with pytest.raises(ConnectionError):
+            influx_pool.query_data_frame("from(bucket: \"b\")")
+        with pytest.raises(ConnectionError):
+            list(influx_pool.query_stream("from(bucket: \"b\")"))
+
+    assert _slots_free() == 2
+    stats = influx_pool.pool_stats()
+    assert stats["queries"] == 10 and stats["errors"] == 10
+
+
+def test_query_data_frame_returns_one_frame_without_bookkeeping_columns():
+    client = influx_pool.get_client()
+    client.frames = [
+        pd.DataFrame({"result": ["_result"], "table": [0], "_time": [1], "rpm": [1500.0]}),
+        pd.DataFrame({"result": ["_result"], "table": [1], "_time": [2], "coolant_temp": [80.0]}),
+    ]
+    df = influx_pool.query_data_frame("q")
+    assert list(df.columns) == ["_time", "rpm", "coolant_temp"]
+    assert len(df) == 2
+
+    client.frames = []
+    assert influx_pool.query_data_frame("q").empty
+
+
+def test_an_abandoned_stream_does_not_hold_a_slot():
+    influx_pool.get_client().records = list(range(100))
+    streams = []
+    for _ in range(5):  # more readers than slots, none finishing
+        stream = influx_pool.query_stream("q")
+        assert next(stream) == 0
+        streams.append(stream)
+    assert _slots_free() == 2
+    for stream in streams:
+        stream.close()
+
+
+def test_stats_counters_and_latency():
+    influx_pool.query_data_frame("q")
+    influx_pool.query_data_frame("q")
+    stats = influx_pool.pool_stats()
+    assert stats["queries"] == 2 and stats["errors"] == 0
+    assert stats["max_ms"] >= stats["avg_ms"] >= 0
+    assert stats["pool_size"] == influx_pool.INFLUX_POOL_SIZE
+    # A fake client has no urllib3 pools: connection counters stay at zero
+    assert stats["requests"] == 0 and stats["connections_reused"] == 0
@@ -0,0 +1,106 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from influx_query import FEATURES, lttb_indices, parse_cursor, recent_data_flux, stream_json, stream_ndjson
+
+T0 = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeRecord:
+    def __init__(self, i):
+        self.values = {"_time": T0 + timedelta(seconds=i), **{f: float(i) for f in FEATURES}}
+
+    def get_time(self):
+        return self.values["_time"]
+
+
+def _records(n, fail_after=None, closed=None):
+    try:
+        for i in range(n):
+            if fail_after is not None and i == fail_after:
+                raise ConnectionError("connection reset")
+            yield FakeRecord(i)
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+# ───── Cursors ─────
+def test_cursor_is_reserialized_as_utc():
+    assert parse_cursor(None) is None and parse_cursor("") is None
+    assert parse_cursor(T0.isoformat()) == "2026-01-01T12:00:00Z"
+    assert parse_cursor("2026-01-01T14:00:00.123456789+02:00") == "2026-01-01T12:00:00.123456789Z"
+    assert parse_cursor((T0 + timedelta(microseconds=5)).isoformat()) == "2026-01-01T12:00:00.000005Z"
+
+
+@pytest.mark.parametrize("bad", [
+    '2026-01-01T12:00:00Z") |> drop(columns: ["rpm"]) |> yield(name: "x',
+    "2026-01-01",
+    "2026-01-01T12:00:00",      # no offset
+    "2026-13-01T12:00:00Z",     # no such month
+    "yesterday",
+    12345,
+])
+def test_bad_cursors_are_rejected(bad):
+    with pytest.raises(ValueError):
+        parse_cursor(bad)
+    with pytest.raises(ValueError):
+        recent_data_flux("1", 30, cursor=bad)
+
+
+def test_cursor_reaches_the_query_normalized():
+    flux = recent_data_flux("1", 30, cursor="2026-01-01T13:00:00+01:00")
+    assert 'time(v: "2026-01-01T12:00:00Z")' in flux
+
+
+# ───── Streaming ─────
+def test_stream_json_is_a_complete_document():
+    doc = json.loads("".join(stream_json("1", limit=3, records=_records(3))))
+    assert len(doc["rows"]) == 3
+    assert doc["next_cursor"] == (T0 + timedelta(seconds=2)).isoformat()
+    assert "error" not in doc
+
+
+def test_stream_json_reports_a_failure_mid_stream():
+    doc = json.loads("".join(stream_json("1", records=_records(10, fail_after=4))))
+    assert len(doc["rows"]) == 4
+    assert doc["next_cursor"] is None
+    assert "connection reset" in doc["error"]
+
+
+def test_stream_ndjson_reports_a_failure_mid_stream():
+    lines = [json.loads(line) for line in stream_ndjson("1", records=_records(10, fail_after=4))]
+    assert len(lines) == 5 and "connection reset" in lines[-1]["error"]
+
+
+def test_closing_a_stream_early_closes_the_source():
+    closed = []
+    stream = stream_json("1", records=_records(100, closed=closed))
+    for _ in range(3):
+        next(stream)
+    stream.close()
+    assert closed == [True]
+
+
+# ───── Downsampling ─────
+def test_lttb_short_series_is_returned_whole():
+    assert list(lttb_indices([0, 1, 2], [5, 6, 7], 10)) == [0, 1, 2]
+    assert list(lttb_indices(range(10), range(10), 2)) == list(range(10))
+
+
+def test_lttb_keeps_ends_and_returns_threshold_sorted_indices():
+    x = np.arange(1000)
+    y = np.sin(x / 20.0)
+    idx = lttb_indices(x, y, 50)
+    assert len(idx) == 50
+    assert idx[0] == 0 and idx[-1] == 999
+    assert np.all(np.diff(idx) > 0)
+
+
+def test_lttb_keeps_a_spike():
+    y = np.zeros(500)
+    y[237] = 100.0
+    assert 237 in lttb_indices(np.arange(500), y, 20)
@@ -0,0 +1,92 @@
+import os
+import pickle
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+import model_registry
+from model_registry import ModelRegistry, _bundle_bytes
+from model_store import FLAT_SUFFIX, save_flat
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    X = np.random.default_rng(0).normal(size=(300, 24))
+    scaler = StandardScaler().fit(X)
+    return IsolationForest(n_estimators=20, random_state=0).fit(scaler.transform(X)), scaler
+
+
+def _write_pkl(base_dir, brand, moto_id, fitted):
+    os.makedirs(os.path.join(base_dir, brand), exist_ok=True)
+    path = os.path.join(base_dir, brand, f"idle_{moto_id}.pkl")
+    joblib.dump({"model": fitted[0], "scaler": fitted[1]}, path)
+    return path
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    calls = []
+    real = model_registry._file_hash
+    monkeypatch.setattr(model_registry, "_file_hash", lambda path: calls.append(path) or real(path))
+    return calls
+
+
+def test_bundle_size_comes_from_array_buffers(fitted, tmp_path):
+    size = _bundle_bytes(fitted)
+    pickled = len(pickle.dumps(fitted))
+    assert 0.5 * pickled < size < 1.5 * pickled
+
+    path = str(tmp_path / ("idle_1" + FLAT_SUFFIX))
+    save_flat(path, *fitted)
+    registry = ModelRegistry(str(tmp_path))
+    assert _bundle_bytes(registry._load(path).bundle) == 0  # memory-mapped
+
+
+def test_files_are_hashed_only_after_they_change(fitted, tmp_path, hashes):
+    path = _write_pkl(str(tmp_path), "yamaha", "1", fitted)
+    registry = ModelRegistry(str(tmp_path), check_interval=0)
+    first = registry.get("yamaha", "1")
+    registry.get("yamaha", "1")
+    assert hashes == []
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    second = registry.get("yamaha", "1")  # no hash known yet: reloads
+    assert len(hashes) == 1 and second is not first
+
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert registry.get("yamaha", "1") is second  # touched only
+    assert len(hashes) == 2
+    assert registry.stats()["reloads"] == 1
+
+
+def test_byte_total_and_key_locks_follow_the_entries(fitted, tmp_path):
+    for moto_id in range(5):
+        _write_pkl(str(tmp_path), "yamaha", str(moto_id), fitted)
+    registry = ModelRegistry(str(tmp_path), max_entries=3)
+    for moto_id in range(5):
+        registry.get("yamaha", str(moto_id))
+
+    stats = registry.stats()
+    assert stats["entries"] == 3 and stats["evictions"] == 2
+    assert stats["bytes"] == sum(e.nbytes for e in registry._entries.values()) > 0
+    assert set(registry._key_locks) <= set(registry._entries)
+
+    registry.invalidate("yamaha", "4")
+    assert registry.stats()["bytes"] == sum(e.nbytes for e in registry._entries.values())
+    assert registry.key("yamaha", "4") not in registry._key_locks
+
+
+def test_byte_budget_evicts_least_recently_used(fitted, tmp_path):
+    for moto_id in range(3):
+        _write_pkl(str(tmp_path), "yamaha", str(moto_id), fitted)
+    one = _bundle_bytes(fitted)
+    registry = ModelRegistry(str(tmp_path), max_bytes=2.5 * one)
+    registry.get("yamaha", "0")
+    registry.get("yamaha", "1")
+    registry.get("yamaha", "0")
+    registry.get("yamaha", "2")
+    assert [os.path.basename(k) for k in registry._entries] == ["idle_0", "idle_2"]
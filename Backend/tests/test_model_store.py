@@ -0,0 +1,45 @@
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from model_store import FlatForest, FlatScaler, flatten, load_flat, save_flat
+
+
+def _fit(max_features=1.0):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 24)) * np.tile([1, 5, 0.1, 3], 6)
+    scaler = StandardScaler().fit(X)
+    model = IsolationForest(n_estimators=40, max_features=max_features, random_state=0)
+    model.fit(scaler.transform(X))
+    return model, scaler, rng.normal(size=(64, 24)) * 8
+
+
+def _assert_same_scores(model, scaler, flat_model, flat_scaler, X):
+    np.testing.assert_allclose(flat_scaler.transform(X), scaler.transform(X))
+    Xs = scaler.transform(X)
+    np.testing.assert_allclose(flat_model.score_samples(Xs), model.score_samples(Xs), rtol=0, atol=1e-12)
+    np.testing.assert_allclose(flat_model.decision_function(Xs), model.decision_function(Xs), rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(flat_model.predict(Xs), model.predict(Xs))
+
+
+def test_flat_forest_scores_like_sklearn():
+    model, scaler, X = _fit()
+    arrays = flatten(model, scaler)
+    _assert_same_scores(model, scaler, FlatForest(arrays),
+                        FlatScaler(arrays["scaler_mean"], arrays["scaler_scale"]), X)
+
+
+def test_flat_forest_with_feature_subsampling():
+    model, scaler, X = _fit(max_features=0.5)
+    arrays = flatten(model, scaler)
+    _assert_same_scores(model, scaler, FlatForest(arrays),
+                        FlatScaler(arrays["scaler_mean"], arrays["scaler_scale"]), X)
+
+
+def test_saved_bundle_is_memory_mapped(tmp_path):
+    model, scaler, X = _fit()
+    path = str(tmp_path / "idle_1.flat.joblib")
+    save_flat(path, model, scaler)
+    flat_model, flat_scaler = load_flat(path)
+    assert isinstance(flat_model.threshold, np.memmap)
+    _assert_same_scores(model, scaler, flat_model, flat_scaler, X)
@@ -0,0 +1,164 @@
+import threading
+import time
+
+import pytest
+
+from mqtt_dispatcher import UNKNOWN_COMMAND, CommandDispatcher, parse_limits
+
+COMMANDS = {"start-obd", "stop-obd", "predict", "recent-data", "hold"}
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.005)
+
+
+class Recorder:
+    """Handler that logs each command; "hold" commands block until released."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+        self.running = 0
+        self.max_running = {}
+        self.release = threading.Event()
+        self.published = []
+
+    def handler(self, payload, reply):
+        name = payload["command"]
+        with self.lock:
+            self.started.append(payload.get("n"))
+            self.running += 1
+            self.max_running[name] = max(self.max_running.get(name, 0), self.running)
+        try:
+            if name == "hold" or payload.get("hold"):
+                self.release.wait(5)
+            if payload.get("fail"):
+                raise RuntimeError("boom")
+            time.sleep(payload.get("sleep", 0))
+            reply({"type": name, "n": payload.get("n")})
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.finished.append(payload.get("n"))
+
+    def publish(self, status):
+        with self.lock:
+            self.published.append(status)
+
+
+@pytest.fixture
+def rec():
+    rec = Recorder()
+    yield rec
+    rec.release.set()
+
+
+def _dispatcher(rec, **kwargs):
+    kwargs.setdefault("limits", parse_limits(""))
+    return CommandDispatcher(rec.handler, rec.publish, COMMANDS, **kwargs)
+
+
+def test_obd_commands_run_one_at_a_time_in_order(rec):
+    dispatcher = _dispatcher(rec, workers=4)
+    for n, command in enumerate(["start-obd", "stop-obd", "start-obd", "stop-obd"]):
+        dispatcher.submit({"command": command, "n": n, "sleep": 0.02})
+    _wait(lambda: len(rec.finished) == 4)
+    assert rec.started == rec.finished == [0, 1, 2, 3]
+    assert rec.max_running == {"start-obd": 1, "stop-obd": 1}
+
+
+def test_a_saturated_group_does_not_block_other_commands(rec):
+    dispatcher = _dispatcher(rec, workers=4, limits={"predict": 2})
+    for n in range(5):
+        dispatcher.submit({"command": "predict", "n": n, "hold": True})
+    _wait(lambda: dispatcher.stats()["running"] == {"predict": 2})
+    dispatcher.submit({"command": "recent-data", "n": "other"})
+    _wait(lambda: "other" in rec.finished)
+    assert dispatcher.stats()["queued"] == 3
+
+    rec.release.set()
+    _wait(lambda: len(rec.finished) == 6)
+    assert rec.max_running["predict"] == 2
+    assert [n for n in rec.started if n != "other"] == [0, 1, 2, 3, 4]
+
+
+def test_reject_policy_refuses_new_commands_when_full(rec):
+    dispatcher = _dispatcher(rec, workers=1, max_queue=2, policy="reject")
+    dispatcher.submit({"command": "hold", "n": 0})
+    _wait(lambda: rec.started == [0])
+    assert dispatcher.submit({"command": "predict", "n": 1})
+    assert dispatcher.submit({"command": "predict", "n": 2})
+    assert not dispatcher.submit({"command": "predict", "n": 3, "request_id": "r3"})
+    assert rec.published == [{"status": "busy", "command": "predict",
+                              "message": "Server busy, command dropped", "request_id": "r3"}]
+
+    rec.release.set()
+    _wait(lambda: len(rec.finished) == 3)
+    assert rec.finished == [0, 1, 2]
+    assert dispatcher.stats()["commands"]["predict"]["rejected"] == 1
+
+
+def test_drop_oldest_policy_evicts_the_oldest_queued_command(rec):
+    dispatcher = _dispatcher(rec, workers=1, max_queue=2, policy="drop-oldest")
+    dispatcher.submit({"command": "hold", "n": 0})
+    _wait(lambda: rec.started == [0])
+    dispatcher.submit({"command": "predict", "n": 1, "request_id": "r1"})
+    dispatcher.submit({"command": "predict", "n": 2})
+    assert dispatcher.submit({"command": "predict", "n": 3})
+    assert rec.published[0]["status"] == "busy" and rec.published[0]["request_id"] == "r1"
+
+    rec.release.set()
+    _wait(lambda: len(rec.finished) == 3)
+    assert rec.finished == [0, 2, 3]
+    assert dispatcher.stats()["commands"]["predict"]["dropped"] == 1
+
+
+def test_commands_past_their_ttl_expire_instead_of_running(rec):
+    dispatcher = _dispatcher(rec, workers=1, ttl=0.05)
+    dispatcher.submit({"command": "hold", "n": 0})
+    _wait(lambda: rec.started == [0])
+    dispatcher.submit({"command": "predict", "n": 1, "request_id": "late"})
+    time.sleep(0.1)
+    rec.release.set()
+    _wait(lambda: any(s.get("status") == "expired" for s in rec.published))
+
+    assert rec.started == [0]
+    expired = [s for s in rec.published if s.get("status") == "expired"]
+    assert expired[0]["request_id"] == "late" and expired[0]["command"] == "predict"
+    assert dispatcher.stats()["commands"]["predict"]["expired"] == 1
+
+
+def test_request_id_is_echoed_in_replies_and_errors(rec):
+    dispatcher = _dispatcher(rec, workers=2)
+    dispatcher.submit({"command": "predict", "n": 1, "request_id": "a"})
+    dispatcher.submit({"command": "predict", "n": 2, "request_id": "b", "fail": True})
+    dispatcher.submit({"command": "predict", "n": 3})
+    _wait(lambda: len(rec.published) == 3)
+
+    by_n = {s.get("n"): s for s in rec.published}
+    assert by_n[1] == {"type": "predict", "n": 1, "request_id": "a"}
+    assert by_n[3] == {"type": "predict", "n": 3}
+    assert by_n[None] == {"status": "error", "message": "boom", "request_id": "b"}
+    _wait(lambda: dispatcher.stats()["commands"]["predict"]["errors"] == 1)
+    stats = dispatcher.stats()["commands"]["predict"]
+    assert stats["received"] == 3 and stats["completed"] == 2
+
+
+def test_unknown_commands_share_one_stats_entry(rec):
+    dispatcher = _dispatcher(rec, workers=1)
+    for command in ("nope", "also-nope", None):
+        dispatcher.submit({"command": command, "n": command})
+    _wait(lambda: len(rec.finished) == 3)
+    assert set(dispatcher.stats()["commands"]) == {UNKNOWN_COMMAND}
+    assert dispatcher.stats()["commands"][UNKNOWN_COMMAND]["received"] == 3
+
+
+def test_parse_limits():
+    assert parse_limits("predict=4, recent-data=0,", {"obd": 1}) == {"obd": 1, "predict": 4, "recent-data": 1}
+    with pytest.raises(ValueError):
+        CommandDispatcher(None, None, COMMANDS, workers=0, policy="drop-newest")
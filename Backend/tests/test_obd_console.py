@@ -0,0 +1,57 @@
+import logging
+
+from obd_console import RateLimitFilter
+
+
+def _record(msg, *args, **extra):
+    record = logging.LogRecord("obd", logging.WARNING, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_repeats_of_the_same_message_are_suppressed(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("obd_console.time.monotonic", lambda: now[0])
+    limiter = RateLimitFilter(interval=30)
+
+    assert limiter.filter(_record("Query %s failed: %s", "RPM", "timeout"))
+    assert not limiter.filter(_record("Query %s failed: %s", "RPM", "timeout"))
+    assert not limiter.filter(_record("Query %s failed: %s", "RPM", "timeout"))
+
+    now[0] += 30
+    record = _record("Query %s failed: %s", "RPM", "timeout")
+    assert limiter.filter(record)
+    assert record.suppressed == 2
+
+
+def test_one_pid_does_not_hide_another(monkeypatch):
+    monkeypatch.setattr("obd_console.time.monotonic", lambda: 100.0)
+    limiter = RateLimitFilter(interval=30)
+    assert limiter.filter(_record("Query %s failed: %s", "COOLANT_TEMP", "timeout"))
+    assert limiter.filter(_record("Query %s failed: %s", "RPM", "timeout"))
+    assert limiter.filter(_record("%s returned null %dx, backing off.", "RPM", 3))
+    assert limiter.filter(_record("%s returned null %dx, backing off.", "ELM_VOLTAGE", 3))
+
+
+def test_rate_key_groups_variants(monkeypatch):
+    monkeypatch.setattr("obd_console.time.monotonic", lambda: 100.0)
+    limiter = RateLimitFilter(interval=30)
+    assert limiter.filter(_record("Upload took %.1fs", 1.2, rate_key="slow-upload"))
+    assert not limiter.filter(_record("Upload took %.1fs", 3.4, rate_key="slow-upload"))
+
+
+def test_opted_out_records_always_pass():
+    limiter = RateLimitFilter(interval=30)
+    for _ in range(3):
+        assert limiter.filter(_record("Loop stats", rate_limit=False))
+
+
+def test_quiet_entries_are_pruned(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("obd_console.time.monotonic", lambda: now[0])
+    limiter = RateLimitFilter(interval=10)
+    for i in range(100):
+        limiter.filter(_record(f"one-off message {i}"))
+    now[0] += 10
+    limiter.filter(_record("later"))
+    assert len(limiter._last) == 1
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+from obd_spool import SEGMENT_SUFFIX, Spool, SpoolDrainer
+
+
+def _lines(n, start=0):
+    return [f"obd_data,motorcycle_id=1 RPM={i} {i}" for i in range(start, start + n)]
+
+
+def test_read_commit_and_resume_after_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    for line in _lines(10):
+        spool.append(line)
+
+    lines, position = spool.read_batch(4)
+    assert lines == _lines(4)
+    spool.commit(position, len(lines))
+
+    # Read but never committed: must come back after a restart
+    assert spool.read_batch(3)[0] == _lines(3, 4)
+    spool.close()
+
+    spool = Spool(str(tmp_path))
+    lines, position = spool.read_batch(100)
+    assert lines == _lines(6, 4)
+    spool.commit(position, len(lines))
+    spool.close()
+
+    spool = Spool(str(tmp_path))
+    assert spool.read_batch(100)[0] == []
+    spool.close()
+
+
+def test_torn_tail_is_skipped(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append("complete")
+    spool.close()
+    segment = [name for name in os.listdir(tmp_path) if name.endswith(SEGMENT_SUFFIX)][0]
+    with open(tmp_path / segment, "ab") as f:
+        f.write(b"torn by a cra")
+
+    spool = Spool(str(tmp_path))
+    spool.append("after restart")
+    lines, position = spool.read_batch(10)
+    assert lines == ["complete"]
+    spool.commit(position, 1)
+    assert spool.read_batch(10)[0] == ["after restart"]
+    spool.close()
+
+
+def test_consumed_segments_are_deleted(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    for line in _lines(30):
+        spool.append(line)
+    written = []
+    drainer = SpoolDrainer(spool, written.extend, batch_lines=7)
+    while drainer.drain_once():
+        pass
+    assert written == _lines(30)
+    assert len([n for n in os.listdir(tmp_path) if n.endswith(SEGMENT_SUFFIX)]) == 1
+    assert spool.backlog_bytes() == 0
+    spool.close()
+
+
+def test_failed_upload_keeps_the_batch(tmp_path):
+    spool = Spool(str(tmp_path))
+    for line in _lines(3):
+        spool.append(line)
+
+    def offline(lines):
+        raise ConnectionError("offline")
+
+    drainer = SpoolDrainer(spool, offline)
+    try:
+        drainer.drain_once()
+    except ConnectionError:
+        pass
+    written = []
+    drainer.write_lines = written.extend
+    assert drainer.drain_once() == 3
+    assert written == _lines(3)
+    spool.close()
+
+
+def test_stop_does_not_drain_alongside_a_stuck_upload(tmp_path):
+    spool = Spool(str(tmp_path))
+    for line in _lines(3):
+        spool.append(line)
+    entered, release, uploads = threading.Event(), threading.Event(), []
+
+    def slow(lines):
+        uploads.append(list(lines))
+        entered.set()
+        release.wait(5)
+
+    drainer = SpoolDrainer(spool, slow, idle_interval=0.01)
+    drainer.start()
+    assert entered.wait(5)
+    drainer.stop(timeout=0.2)
+    assert uploads == [_lines(3)]  # no second upload of the same batch
+    release.set()
+    drainer.join(5)
+    assert spool.read_batch(10)[0] == []
+    spool.close()
+
+
+def test_final_drain_stops_at_the_deadline(tmp_path):
+    spool = Spool(str(tmp_path))
+    for line in _lines(50):
+        spool.append(line)
+    written = []
+
+    def slow(lines):
+        time.sleep(0.05)
+        written.extend(lines)
+
+    drainer = SpoolDrainer(spool, slow, batch_lines=1)
+    started = time.monotonic()
+    drainer.stop(timeout=0.3)
+    assert time.monotonic() - started < 1.0
+    assert 0 < len(written) < 50
+    assert spool.read_batch(100)[0] == _lines(50 - len(written), len(written))
+    spool.close()
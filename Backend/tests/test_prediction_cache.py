@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from prediction_cache import PredictionCache
+
+OK = {"status": "ok", "anomaly": False}
+
+
+class SlowCompute:
+    """compute() that blocks until released and counts its calls."""
+
+    def __init__(self, result=OK):
+        self.calls = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.result = result
+
+    def __call__(self, motorcycle_id, brand, model, mode="idle", minutes=30):
+        self.calls += 1
+        self.entered.set()
+        assert self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return dict(self.result)
+
+
+def _get_in_threads(cache, n, *args):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(cache.get(*args))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+def _wait_in_flight(cache, coalesced):
+    deadline = time.monotonic() + 5
+    while cache.stats()["coalesced"] < coalesced:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_concurrent_identical_calls_share_one_compute():
+    compute = SlowCompute()
+    cache = PredictionCache(compute, ttl=60)
+    threads, results, errors = _get_in_threads(cache, 8, "1", "Yamaha", "NMAX 155")
+    _wait_in_flight(cache, 7)
+    compute.release.set()
+    for t in threads:
+        t.join()
+
+    assert compute.calls == 1 and not errors
+    assert all(r is results[0] for r in results)
+    # Brand/model are normalized into the key
+    assert cache.get("1", " yamaha ", "nmax_155") is results[0]
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 7, 1)
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    compute = SlowCompute(RuntimeError("influx down"))
+    cache = PredictionCache(compute, ttl=60)
+    threads, results, errors = _get_in_threads(cache, 4, "1", "yamaha", "nmax_155")
+    _wait_in_flight(cache, 3)
+    compute.release.set()
+    for t in threads:
+        t.join()
+    assert len(errors) == 4 and not results
+
+    compute.result = {"status": "ok", "message": "Not enough data"}
+    cache.get("1", "yamaha", "nmax_155")
+    cache.get("1", "yamaha", "nmax_155")
+    assert compute.calls == 3 and cache.stats()["entries"] == 0
+
+
+def test_a_result_computed_across_an_invalidation_is_not_cached():
+    compute = SlowCompute()
+    cache = PredictionCache(compute, ttl=60)
+    threads, results, _ = _get_in_threads(cache, 1, "1", "yamaha", "nmax_155")
+    assert compute.entered.wait(5)
+    cache.invalidate("1")  # e.g. the model was retrained meanwhile
+    compute.release.set()
+    threads[0].join()
+
+    assert results == [OK]  # the caller still gets it...
+    cache.get("1", "yamaha", "nmax_155")
+    assert compute.calls == 2  # ...but the next call recomputes
+    cache.get("1", "yamaha", "nmax_155")
+    assert compute.calls == 2
+
+
+def test_new_samples_expire_a_bikes_results():
+    compute = SlowCompute()
+    compute.release.set()
+    cache = PredictionCache(compute, ttl=60, stale_samples=10)
+    cache.get("1", "yamaha", "nmax_155")
+    cache.get("2", "yamaha", "nmax_155")
+
+    cache("1", [(0, {})] * 9)
+    cache.get("1", "yamaha", "nmax_155")
+    assert compute.calls == 2
+    cache(1, [(0, {})])  # ids are compared as strings
+    cache.get("1", "yamaha", "nmax_155")
+    cache.get("2", "yamaha", "nmax_155")
+    assert compute.calls == 3
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_ttl_and_max_entries():
+    compute = SlowCompute()
+    compute.release.set()
+    cache = PredictionCache(compute, ttl=0.05, max_entries=2)
+    for moto_id in ("1", "2", "3"):
+        cache.get(moto_id, "yamaha", "nmax_155")
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+
+    time.sleep(0.06)
+    cache.get("3", "yamaha", "nmax_155")
+    assert compute.calls == 4 and cache.stats()["expired"] == 1
+
+
+def test_async_waiters_await_one_leader():
+    calls = []
+
+    async def compute(motorcycle_id, brand, model, mode="idle", minutes=30):
+        calls.append(motorcycle_id)
+        await asyncio.sleep(0.02)
+        if motorcycle_id == "bad":
+            raise RuntimeError("influx down")
+        return dict(OK)
+
+    cache = PredictionCache(compute, ttl=60)
+
+    async def run():
+        results = await asyncio.gather(*(cache.get_async("1", "yamaha", "nmax_155") for _ in range(6)))
+        failed = await asyncio.gather(*(cache.get_async("bad", "yamaha", "nmax_155") for _ in range(3)),
+                                      return_exceptions=True)
+        cached = await cache.get_async("1", "yamaha", "nmax_155")
+        return results, failed, cached
+
+    results, failed, cached = asyncio.run(run())
+    assert calls == ["1", "bad"]
+    assert all(r is results[0] for r in results) and cached is results[0]
+    assert all(isinstance(e, RuntimeError) for e in failed)
+
+
+def test_a_cancelled_async_waiter_leaves_the_leader_running():
+    async def compute(motorcycle_id, brand, model, mode="idle", minutes=30):
+        await asyncio.sleep(0.05)
+        return dict(OK)
+
+    cache = PredictionCache(compute, ttl=60)
+
+    async def run():
+        leader = asyncio.create_task(cache.get_async("1", "yamaha", "nmax_155"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_async("1", "yamaha", "nmax_155"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(run()) == OK
+    assert cache.stats()["entries"] == 1
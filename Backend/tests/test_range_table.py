@@ -0,0 +1,101 @@
+import numpy as np
+
+from range_table import (LOOKUP_CACHE_SIZE, SEVERITY_CRITICAL, SEVERITY_LABELS, SEVERITY_NORMAL,
+                         SEVERITY_UNKNOWN, SEVERITY_WARNING, RangeTable)
+
+FEATURES = ["rpm", "elm_voltage", "long_fuel_trim_1"]
+RANGES = {
+    "Yamaha": {
+        "NMAX 155": {
+            "rpm": {"warning_min": 1400, "warning_max": 1600, "critical_min": 1300, "critical_max": 1700},
+            # Zero-width low band, as in normal_ranges.json
+            "elm_voltage": {"warning_min": 12.0, "warning_max": 14.9, "critical_min": 12.0, "critical_max": 15.0},
+            "long_fuel_trim_1": {"warning_min": -6, "warning_max": 6, "critical_min": -7, "critical_max": 7}
+        },
+        "partial": {
+            "rpm": {"warning_min": 1400, "warning_max": 1600, "critical_min": 1300, "critical_max": 1700}
+        }
+    }
+}
+
+
+def _reference(feature, value, ranges):
+    """The per-call dict walk RangeTable replaced → (label, score)."""
+    value = float(value)  # a Python float raises ZeroDivisionError, like the old code did
+    try:
+        r = ranges[feature]
+    except KeyError:
+        return "unknown", -1
+    if value <= r["critical_min"] or value >= r["critical_max"]:
+        label = "critical"
+    elif value <= r["warning_min"] or value >= r["warning_max"]:
+        label = "warning"
+    else:
+        label = "normal"
+    if r["warning_min"] <= value <= r["warning_max"]:
+        return label, 0
+    try:
+        if value < r["warning_min"]:
+            score = (r["warning_min"] - value) / (r["warning_min"] - r["critical_min"])
+        elif value > r["warning_max"]:
+            score = (value - r["warning_max"]) / (r["critical_max"] - r["warning_max"])
+        else:
+            score = 0
+    except ZeroDivisionError:
+        return label, -1
+    return label, int(min(max(score * 100, 0), 100))
+
+
+def test_classify_matches_the_per_call_lookup():
+    table = RangeTable(RANGES, FEATURES)
+    rng = np.random.default_rng(5)
+    X = np.column_stack([
+        rng.uniform(1200, 1800, 300),
+        rng.choice([11.0, 12.0, 12.5, 14.9, 14.95, 15.0, 16.0, np.nan], 300),
+        rng.uniform(-9, 9, 300)
+    ])
+    for model, ranges in (("nmax_155", RANGES["Yamaha"]["NMAX 155"]), ("partial", RANGES["Yamaha"]["partial"])):
+        codes, scores = table.classify(X, "yamaha", model)
+        for (r, j), code in np.ndenumerate(codes):
+            label, score = _reference(FEATURES[j], X[r, j], ranges)
+            assert (SEVERITY_LABELS[code], scores[r, j]) == (label, score), (model, FEATURES[j], X[r, j])
+
+
+def test_zero_width_band_keeps_the_minus_one_score():
+    table = RangeTable(RANGES, FEATURES)
+    codes, scores = table.classify([[1500, 11.0, 0], [1500, 12.0, 0]], "yamaha", "nmax_155")
+    assert codes[:, 1].tolist() == [SEVERITY_CRITICAL, SEVERITY_CRITICAL]
+    assert scores[:, 1].tolist() == [-1, 0]
+
+
+def test_lookup_normalizes_and_falls_back_to_unknown():
+    table = RangeTable(RANGES, FEATURES)
+    assert table.lookup(" YAMAHA ", "nmax 155") is table.lookup("yamaha", "nmax_155")
+    assert table.lookup("ducati", "panigale") is table.unknown
+
+    codes, scores = table.classify([[1500, 13.0, 0]], "ducati", "panigale")
+    assert (codes == SEVERITY_UNKNOWN).all() and (scores == -1).all()
+    assert table.unknown.is_high([0, 0, -5]).all()
+
+
+def test_is_high_uses_the_sign_for_fuel_trim():
+    bounds = RangeTable(RANGES, FEATURES).lookup("yamaha", "nmax_155")
+    assert bounds.is_high([1550, 12.0, 1]).tolist() == [True, False, True]
+    assert bounds.is_high([1450, 14.0, -1]).tolist() == [False, True, False]
+
+
+def test_lookup_memo_is_bounded():
+    table = RangeTable(RANGES, FEATURES)
+    for i in range(LOOKUP_CACHE_SIZE * 2):
+        table.lookup(f"brand {i}", "model")
+    assert table._lookup_cached.cache_info().currsize == LOOKUP_CACHE_SIZE
+
+
+def test_scalar_helpers():
+    table = RangeTable(RANGES, FEATURES)
+    assert table.classify_value("rpm", 1500, "yamaha", "nmax_155") == "normal"
+    assert table.classify_value("rpm", 1650, "yamaha", "nmax_155") == "warning"
+    assert table.severity_score("rpm", 1650, "yamaha", "nmax_155") == 50
+    assert table.classify_value("speed", 10, "yamaha", "nmax_155") == "unknown"
+    assert table.classify_value("rpm", "n/a", "yamaha", "nmax_155") == "unknown"
+    assert SEVERITY_LABELS[SEVERITY_NORMAL] == "normal" and SEVERITY_LABELS[SEVERITY_WARNING] == "warning"
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+import report_cache
+from report_cache import COUNT, MAX, RollupCache
+
+START = 1_800_000_123
+
+
+class FakeBucket:
+    """Rows of one feature "x", rolled up the way query_rollup_buckets does."""
+
+    def __init__(self):
+        self.rows = {}  # epoch second → value
+
+    def fetch(self, motorcycle_id, since, bucket_minutes, until=None):
+        size = bucket_minutes * 60
+        buckets = {}
+        for t, v in self.rows.items():
+            if t >= since and (until is None or t < until):
+                buckets.setdefault(max(t - t % size, since), []).append(v)
+        return pd.DataFrame([
+            {"bucket": pd.Timestamp(b, unit="s", tz="UTC"),
+             "x_sum": sum(v), "x_count": len(v), "x_min": min(v), "x_max": max(v)}
+            for b, v in sorted(buckets.items())
+        ])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [START]
+    monkeypatch.setattr(report_cache.time, "time", lambda: now[0])
+    return now
+
+
+def _expected(bucket, now):
+    return [v for t, v in bucket.rows.items() if now - 86400 <= t <= now]
+
+
+def test_incremental_refresh_matches_a_full_query(clock):
+    bucket = FakeBucket()
+    for t in range(START - 2 * 86400, START, 60):
+        bucket.rows[t] = 1.0
+    cache = RollupCache(bucket.fetch, ["x"])
+
+    for step in range(12):
+        clock[0] += 45  # TTL lapsed, and the 24h cutoff moves inside the head bucket
+        bucket.rows[clock[0] - 5] = 2.0
+        bucket.rows[clock[0] - 1800 - step] = 3.0  # arrives half an hour late
+        folded = cache.fold(cache.get("1", "-24h").values())
+        want = _expected(bucket, clock[0])
+        assert folded[COUNT][0] == len(want)
+        assert folded[MAX][0] == max(want)
+
+    assert cache.stats()["full_refreshes"] == 1
+
+
+def test_rows_later_than_the_late_window_wait_for_a_full_refresh(clock):
+    bucket = FakeBucket()
+    for t in range(START - 86400, START, 60):
+        bucket.rows[t] = 1.0
+    cache = RollupCache(bucket.fetch, ["x"])
+    cache.get("1", "-24h")
+
+    bucket.rows[clock[0] - 3 * 3600 - 7] = 5.0
+    clock[0] += 45
+    assert cache.fold(cache.get("1", "-24h").values())[MAX][0] == 1.0
+
+    clock[0] += report_cache.REPORT_CACHE_FULL_REFRESH
+    assert cache.fold(cache.get("1", "-24h").values())[MAX][0] == 5.0
@@ -0,0 +1,17 @@
+import numpy as np
+
+from stream_detector import RollingStats
+
+
+def test_rolling_stats_match_numpy_over_the_window():
+    rng = np.random.default_rng(1)
+    rows = rng.normal(loc=[1500, 20, 3, 0, 85, 14], scale=[200, 5, 1, 2, 3, 0.3], size=(1000, 6))
+    stats = RollingStats(size=50, n_features=6)
+    for i, row in enumerate(rows):
+        stats.push(row)
+        window = rows[max(0, i - 49):i + 1]
+        assert stats.count == len(window)
+        np.testing.assert_allclose(stats.mean, window.mean(axis=0), rtol=1e-9)
+        np.testing.assert_allclose(stats.var, window.var(axis=0), rtol=1e-6, atol=1e-9)
+        np.testing.assert_array_equal(stats.max, window.max(axis=0))
+        np.testing.assert_array_equal(stats.min, window.min(axis=0))
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from telemetry_codec import (BINARY_SUFFIX, PID_INDEX, TelemetryBatcher, decode, decode_message,
+                             encode)
+
+
+def test_round_trip_keeps_times_and_two_decimals():
+    samples = [
+        (1_700_000_000_000, {"RPM": 1450.25, "COOLANT_TEMP": 88.5, "ELM_VOLTAGE": 14.12}),
+        (1_700_000_000_200, {"RPM": 1460.0, "COOLANT_TEMP": 88.75, "ELM_VOLTAGE": 14.1}),
+    ]
+    assert decode(encode(samples)) == samples
+
+
+def test_missing_readings_are_left_out():
+    samples = [(1000, {"RPM": 1500.0, "ENGINE_LOAD": None}), (1100, {"ENGINE_LOAD": 21.5})]
+    assert decode(encode(samples)) == [(1000, {"RPM": 1500.0}), (1100, {"ENGINE_LOAD": 21.5})]
+
+
+def test_all_pids_cost_28_bytes_per_sample():
+    one = encode([(0, {name: 1.0 for name in PID_INDEX})])
+    two = encode([(0, {name: 1.0 for name in PID_INDEX}), (1, {name: 2.0 for name in PID_INDEX})])
+    assert len(two) - len(one) == 28
+
+
+def test_bad_frames_are_rejected():
+    frame = encode([(0, {"RPM": 1.0})])
+    with pytest.raises(ValueError):
+        decode(frame[:-1])
+    with pytest.raises(ValueError):
+        decode(bytes([99]) + frame[1:])
+    with pytest.raises(ValueError):
+        encode([])
+
+
+def test_decode_message_handles_both_codecs():
+    frame = encode([(5, {"RPM": 900.0})])
+    assert decode_message("obd/motorcycle/7/data" + BINARY_SUFFIX, frame) == ("7", "binary", [(5, {"RPM": 900.0})])
+
+    payload = json.dumps({"motorcycle_id": "7", "data": {"RPM": 900}}).encode()
+    assert decode_message("obd/motorcycle/7/data", payload) == ("7", "json", [(None, {"RPM": 900})])
+
+    with pytest.raises(ValueError):
+        decode_message("obd/status", payload)
+
+
+def test_batcher_flushes_every_batch_size_samples():
+    batcher = TelemetryBatcher(batch_size=3)
+    assert batcher.add(0, {"RPM": 1.0}) is None
+    assert batcher.add(1, {"RPM": 2.0}) is None
+    frame = batcher.add(2, {"RPM": 3.0})
+    assert [ts for ts, _ in decode(frame)] == [0, 1, 2]
+    assert batcher.flush() is None
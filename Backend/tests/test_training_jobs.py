@@ -0,0 +1,59 @@
+import os
+import signal
+import time
+
+import pytest
+
+from training_jobs import TrainingJobs
+
+
+def _wait(predicate, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.05)
+
+
+def _kill_workers(pool):
+    for pid in list(pool._processes):
+        os.kill(pid, signal.SIGKILL)
+
+
+@pytest.fixture
+def jobs():
+    finished = []
+    jobs = TrainingJobs(on_finished=finished.append, workers=1)
+    jobs.finished = finished
+    yield jobs
+    if jobs._pool is not None:
+        jobs._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def test_a_job_whose_worker_dies_fails_and_the_next_one_gets_a_new_pool(jobs):
+    pool = jobs._ensure_pool()
+    job = jobs.submit("1", "yamaha", minutes=1)
+    _kill_workers(pool)
+    _wait(lambda: jobs.finished)
+    assert jobs.get(job["job_id"])["status"] == "failed"
+    assert jobs.finished[0]["error"].startswith("Training worker died")
+    assert jobs.stats()["pool_restarts"] == 1 and jobs.stats()["in_flight"] == 0
+
+    jobs.submit("2", "yamaha", minutes=1)
+    _wait(lambda: len(jobs.finished) == 2)
+    assert jobs._pool is not pool
+    # No InfluxDB here, so the trainer itself fails, but in a live worker
+    assert not jobs.finished[1]["error"].startswith("Training worker died")
+
+
+def test_submit_replaces_a_pool_that_broke_while_idle(jobs):
+    pool = jobs._ensure_pool()
+    jobs.submit("1", "yamaha", minutes=1)
+    _wait(lambda: jobs.finished)
+    _kill_workers(pool)
+    _wait(lambda: pool._broken)
+
+    jobs.submit("2", "yamaha", minutes=1)
+    _wait(lambda: len(jobs.finished) == 2)
+    assert not jobs.finished[1]["error"].startswith("Training worker died")
+    assert jobs.stats()["pool_restarts"] == 1
@@ -7,7 +7,18 @@ for a SINGLE motorcycle and save it to:
     models/<brand>/idle_<motorcycle_id>.pkl
 
 Example:
-    python train_idle_model.py --motorcycle_id 4 --brand "Yamaha_NMAX" --minutes 43200
+    python train_idle_model.py --motorcycle_id 4 --brand "Yamaha_NMAX" --minutes 43200 --stride 25
+
+The forest is fit on one 24-feature vector (mean/std/max/min of the scaled
+features) per sliding window of --window rows, the same window size the
+server scores, taken every --stride rows over the history.
+
+The same training runs in-process through train_idle_model(), which is what
+the server's training job pool (training_jobs.py) calls.
+
+History is read through the local feature store (feature_store.py): only data
+newer than the bike's last sync is downloaded. Pass --no-store (or set
+TRAIN_USE_FEATURE_STORE=0) to query InfluxDB directly.
 """
 
 import argparse
@@ -15,38 +26,27 @@ import os
 import joblib
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
-from influxdb_client import InfluxDBClient
+import influx_pool
+from feature_store import FeatureStore, query_features
+from model_store import FLAT_SUFFIX, save_flat
+from anomaly_model import WINDOW_ROWS
 
-# ────────────────────────────────────────────────────────────
-# 1) CLI arguments
-# ────────────────────────────────────────────────────────────
-parser = argparse.ArgumentParser(description="Train idle anomaly model")
-parser.add_argument("--motorcycle_id", required=True, help="e.g. 4 or moto_004")
-parser.add_argument("--brand", required=True, help="e.g. Yamaha_NMAX")
-parser.add_argument("--minutes", type=int, default=60 * 24,
-                    help="How far back to pull data (default 1 day)")
-args = parser.parse_args()
-
-MOTO_ID = str(args.motorcycle_id)
-BRAND = args.brand.strip().replace(" ", "_").lower()
 MODE = "idle"
-MINUTES = args.minutes
+DEFAULT_STRIDE = 25
+CHUNK_WINDOWS = 2048  # windows aggregated per NumPy pass, bounds temporary memory
+USE_FEATURE_STORE = os.getenv("TRAIN_USE_FEATURE_STORE", "1") != "0"
 
 # ────────────────────────────────────────────────────────────
-# 2) InfluxDB connection
+# 1) InfluxDB connection
 # ────────────────────────────────────────────────────────────
-INFLUXDB_URL = os.getenv("INFLUX_URL")
-INFLUXDB_TOKEN = os.getenv("INFLUX_TOKEN")
-INFLUXDB_ORG = os.getenv("INFLUX_ORG")
-INFLUXDB_BUCKET=os.getenv ("INFLUX_BUCKET")
-
-client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-query_api = client.query_api()
+# Shared pooled client (see influx_pool.py); bucket comes from INFLUX_BUCKET.
+# The pivot query itself lives in feature_store.query_features.
 
 # ────────────────────────────────────────────────────────────
-# 3) Pull & clean idle data (SQL version)
+# 2) Pull & clean idle data
 # ────────────────────────────────────────────────────────────
 FEATURES = [
     "rpm",
@@ -57,70 +57,143 @@ FEATURES = [
     "elm_voltage",
 ]
 
-flux = f"""
-from(bucket: "{INFLUXDB_BUCKET}")
-  |> range(start: -{MINUTES}m)
-  |> filter(fn: (r) => r._measurement == "obd_data")
-  |> filter(fn: (r) => r.motorcycle_id == "{MOTO_ID}")
-  |> filter(fn: (r) =>
-      r._field == "rpm" or
-      r._field == "engine_load" or
-      r._field == "throttle_pos" or
-      r._field == "long_fuel_trim_1" or
-      r._field == "coolant_temp"  or
-      r._field == "elm_voltage")
-  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
-  |> keep(columns: ["_time", "rpm", "engine_load", "throttle_pos", "long_fuel_trim_1", "coolant_temp", "elm_voltage"])
-"""
-
-df = query_api.query_data_frame(flux)
-client.close()
-
-if df.empty or len(df) < 60:          # at least one minute of ~1 Hz data
-    raise RuntimeError("Not enough idle data to train a model!")
+def load_idle_data(moto_id, minutes, use_store=USE_FEATURE_STORE) -> pd.DataFrame:
+    if use_store:
+        df = FeatureStore().sync_and_load(moto_id, minutes, FEATURES)
+    else:
+        df = query_features(moto_id, f"-{minutes}m")
 
-df = df.drop(columns=["result", "table"], errors="ignore")
-df = df.dropna().sort_values("_time").reset_index(drop=True)
+    if df.empty or len(df) < 60:          # at least one minute of ~1 Hz data
+        raise RuntimeError("Not enough idle data to train a model!")
 
-# ✅ Filter by coolant temperature
-df = df[(df["coolant_temp"] >= 70) & (df["coolant_temp"] <= 105)]
-print(f"Filtered to {len(df)} rows where coolant_temp is between 70–105°C")
+    df = df.dropna().sort_values("_time").reset_index(drop=True)
 
-if df.empty or len(df) < 60:
-    raise RuntimeError("Not enough filtered warm-idle data to train the model!")
+    # ✅ Filter by coolant temperature
+    df = df[(df["coolant_temp"] >= 70) & (df["coolant_temp"] <= 105)]
+    print(f"Filtered to {len(df)} rows where coolant_temp is between 70–105°C")
 
-X_raw = df[FEATURES].values
+    if df.empty or len(df) < 60:
+        raise RuntimeError("Not enough filtered warm-idle data to train the model!")
 
+    return df
 
 # ────────────────────────────────────────────────────────────
-# 4) Scale → Extract 24-feature vector → Train Isolation Forest
+# 3) Scale → 24-feature vector per sliding window → Train Isolation Forest
 # ────────────────────────────────────────────────────────────
-scaler = StandardScaler().fit(X_raw)
-X_scaled = scaler.transform(X_raw)
-
-# Extract mean, std, max, min per feature (→ 24 features)
-agg_features = np.hstack([
-    np.mean(X_scaled, axis=0),
-    np.std(X_scaled, axis=0),
-    np.max(X_scaled, axis=0),
-    np.min(X_scaled, axis=0)
-]).reshape(1, -1)  # Shape: (1, 24)
-
-# Train on the 24-feature vector
-model = IsolationForest(
-    n_estimators=200,
-    contamination=0.05,
-    random_state=42
-).fit(agg_features)
+def window_features(X, window, stride):
+    """
+    mean, std, max, min per feature of every `window`-row window starting
+    every `stride` rows → (n_windows, 24), same layout as the server's input.
+    """
+    # Zero-copy (n_windows, n_features, window) view of the strided windows
+    windows = sliding_window_view(X, window, axis=0)[::stride]
+    out = np.empty((len(windows), 4 * X.shape[1]))
+    for start in range(0, len(windows), CHUNK_WINDOWS):
+        # One contiguous copy per chunk makes the reductions run at memory speed
+        chunk = np.ascontiguousarray(windows[start:start + CHUNK_WINDOWS])
+        mean = chunk.mean(axis=2)
+        centered = chunk - mean[..., None]
+        std = np.sqrt(np.einsum("ijk,ijk->ij", centered, centered) / window)
+        out[start:start + len(chunk)] = np.hstack([
+            mean,
+            std,
+            chunk.max(axis=2),
+            chunk.min(axis=2)
+        ])
+    return out
+
+def fit_model(X_raw, window, stride):
+    scaler = StandardScaler().fit(X_raw)
+    X_scaled = scaler.transform(X_raw)
+
+    if len(X_scaled) >= window:
+        agg_features = window_features(X_scaled, window, stride)
+    else:
+        print(f"[WARNING] Only {len(X_scaled)} rows (< window of {window}); training on a single aggregate")
+        agg_features = window_features(X_scaled, len(X_scaled), 1)
+    print(f"Extracted {len(agg_features):,} training windows of {min(window, len(X_scaled))} rows (stride {stride})")
+
+    # Train on the distribution of window vectors
+    model = IsolationForest(
+        n_estimators=200,
+        contamination=0.05,
+        random_state=42
+    ).fit(agg_features)
+    return model, scaler, len(agg_features)
 
 # ────────────────────────────────────────────────────────────
-# 5) Save model & scaler → models/<brand>/idle_<motorcycle_id>.pkl
+# 4) Save model & scaler → models/<brand>/idle_<motorcycle_id>.pkl (+ .flat.joblib)
 # ────────────────────────────────────────────────────────────
-out_dir  = os.path.join("models", BRAND)
-os.makedirs(out_dir, exist_ok=True)
-out_path = os.path.join(out_dir, f"{MODE}_{MOTO_ID}.pkl")
+def save_model(brand, moto_id, model, scaler, base_dir="models"):
+    out_dir  = os.path.join(base_dir, brand)
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, f"{MODE}_{moto_id}.pkl")
+
+    # Write to a temp file and swap it in, so a server hot-reloading the model
+    # never reads a half-written bundle
+    tmp_path = out_path + ".tmp"
+    joblib.dump({"model": model, "scaler": scaler}, tmp_path, compress=3)
+    os.replace(tmp_path, out_path)
+
+    # Memory-mappable copy the server prefers (see model_store.py); written after
+    # the pickle so it is never older than it
+    flat_path = os.path.join(out_dir, f"{MODE}_{moto_id}{FLAT_SUFFIX}")
+    save_flat(flat_path, model, scaler)
+    return out_path, flat_path
+
+def train_idle_model(motorcycle_id, brand, minutes=60 * 24, window=WINDOW_ROWS,
+                     stride=DEFAULT_STRIDE, progress=None, use_store=USE_FEATURE_STORE) -> dict:
+    """
+    Pull, train and save one bike's idle model. `progress(stage, fraction)`
+    is called between steps when given.
+    """
+    report = progress or (lambda stage, fraction: None)
+    moto_id = str(motorcycle_id)
+    brand = brand.strip().replace(" ", "_").lower()
+    window = max(2, int(window))
+    stride = max(1, int(stride))
+
+    report("loading", 0.0)
+    df = load_idle_data(moto_id, int(minutes), use_store)
+
+    report("fitting", 0.5)
+    model, scaler, n_windows = fit_model(df[FEATURES].values, window, stride)
+
+    report("saving", 0.9)
+    out_path, flat_path = save_model(brand, moto_id, model, scaler)
+
+    print(f" Trained on {len(df):,} rows for motorcycle {moto_id}")
+    print(f"Saved model to: {out_path}")
+    print(f"Saved flat model to: {flat_path}")
+    report("done", 1.0)
+    return {
+        "motorcycle_id": moto_id,
+        "brand": brand,
+        "rows": len(df),
+        "windows": n_windows,
+        "model_path": out_path,
+        "flat_path": flat_path
+    }
 
-joblib.dump({"model": model, "scaler": scaler}, out_path, compress=3)
-
-print(f" Trained on {len(df):,} rows for motorcycle {MOTO_ID}")
-print(f"Saved model to: {out_path}")
+# ────────────────────────────────────────────────────────────
+# CLI
+# ────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train idle anomaly model")
+    parser.add_argument("--motorcycle_id", required=True, help="e.g. 4 or moto_004")
+    parser.add_argument("--brand", required=True, help="e.g. Yamaha_NMAX")
+    parser.add_argument("--minutes", type=int, default=60 * 24,
+                        help="How far back to pull data (default 1 day)")
+    parser.add_argument("--window", type=int, default=WINDOW_ROWS,
+                        help=f"Rows per training window (default {WINDOW_ROWS}, as scored by the server)")
+    parser.add_argument("--stride", type=int, default=DEFAULT_STRIDE,
+                        help=f"Rows between the starts of consecutive windows (default {DEFAULT_STRIDE})")
+    parser.add_argument("--no-store", action="store_true",
+                        help="Query InfluxDB directly instead of syncing the local feature store")
+    args = parser.parse_args()
+
+    try:
+        train_idle_model(args.motorcycle_id, args.brand, args.minutes, args.window, args.stride,
+                         use_store=USE_FEATURE_STORE and not args.no_store)
+    finally:
+        influx_pool.close_client()
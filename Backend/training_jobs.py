@@ -0,0 +1,266 @@
+"""
+training_jobs.py
+────────────────
+Bounded training job queue on a pool of warm worker processes.
+
+  • TRAIN_WORKERS processes (default: CPU count, at most 4) import pandas,
+    sklearn and the trainer once and keep their own InfluxDB client, so a job
+    no longer pays for a fresh interpreter.
+  • Workers are spawned, not forked: the server runs MQTT, dispatcher,
+    detector and Flask threads, and a forked child would inherit any lock
+    one of them held at that moment. A spawned worker still runs the main
+    module again as "__mp_main__", so server.py starts its threads and
+    connections only in the server process.
+  • A worker that dies (OOM kill, segfault) breaks the whole pool: its jobs
+    fail, the broken pool is dropped and the next submit starts a new one.
+  • At most TRAIN_QUEUE_MAX jobs are queued or running; submit() raises
+    QueueFull beyond that instead of piling work onto the host.
+  • A bike has at most one job in flight: submitting it again returns the
+    existing job. Every submitter's request_id is kept on the job, so each
+    MQTT caller can match the completion status to its command.
+  • Workers report their stage through a multiprocessing queue; job status
+    and progress are kept here for the HTTP and MQTT status commands.
+"""
+
+import glob
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", min(4, os.cpu_count() or 1)))
+TRAIN_QUEUE_MAX = int(os.getenv("TRAIN_QUEUE_MAX", 32))
+TRAIN_HISTORY = int(os.getenv("TRAIN_HISTORY", 200))  # finished jobs kept for status queries
+TRAIN_MINUTES = int(os.getenv("TRAIN_MINUTES", 43200))
+
+
+class QueueFull(Exception):
+    pass
+
+
+# ───── Worker process side ─────
+_progress_queue = None
+
+def _init_worker(progress_queue):
+    """Runs once per worker: warm the imports."""
+    global _progress_queue
+    _progress_queue = progress_queue
+    import train_idle_model  # noqa: F401  (pandas/sklearn loaded once per worker)
+
+def _run_job(job_id, motorcycle_id, brand, minutes):
+    from train_idle_model import train_idle_model
+
+    def progress(stage, fraction):
+        _progress_queue.put((job_id, stage, fraction))
+
+    return train_idle_model(motorcycle_id, brand, minutes, progress=progress)
+
+
+# ───── Server side ─────
+def _mp_context():
+    # Never fork the multi-threaded server. Spawned workers run the main
+    # module again as "__mp_main__", so server.py keeps every thread and
+    # connection it starts out of that case (see IS_SERVER_PROCESS there).
+    return multiprocessing.get_context("spawn")
+
+
+def _snapshot(job):
+    """Copy of a job dict that later updates cannot change (caller holds the lock)."""
+    return dict(job, request_ids=list(job["request_ids"]))
+
+
+class TrainingJobs:
+    def __init__(self, on_finished=None, workers=TRAIN_WORKERS, max_queue=TRAIN_QUEUE_MAX):
+        """on_finished(job_dict) is called from a pool thread when a job ends."""
+        self.on_finished = on_finished
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._jobs = OrderedDict()   # job_id → job dict, oldest first
+        self._in_flight = {}         # motorcycle_id → job_id
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self._pool = None
+        self._progress = None
+        self.pool_restarts = 0
+
+    def _ensure_pool(self):
+        # Started on first use, so importing the server spawns no processes
+        with self._pool_lock:
+            if self._pool is None:
+                ctx = _mp_context()
+                self._progress = ctx.Queue()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=ctx,
+                    initializer=_init_worker, initargs=(self._progress,)
+                )
+                threading.Thread(target=self._read_progress, args=(self._progress,),
+                                 daemon=True, name="train-progress").start()
+            return self._pool
+
+    def _drop_pool(self, pool):
+        """Forget a broken pool so the next submit starts a fresh one."""
+        with self._pool_lock:
+            if self._pool is not pool:
+                return  # already replaced by another caller
+            self._pool, progress = None, self._progress
+            self._progress = None
+            self.pool_restarts += 1
+        print("[ERROR] A training worker died; starting a new process pool on the next job")
+        pool.shutdown(wait=False, cancel_futures=True)
+        progress.put(None)  # stops that pool's progress reader
+
+    def _read_progress(self, progress):
+        while True:
+            item = progress.get()
+            if item is None:
+                return
+            job_id, stage, fraction = item
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None and job["finished_at"] is None:
+                    if job["status"] == "queued":
+                        job["status"] = "running"
+                        job["started_at"] = time.time()
+                    job["stage"] = stage
+                    job["progress"] = fraction
+
+    # ───── Submitting ─────
+    def submit(self, motorcycle_id, brand, minutes=TRAIN_MINUTES, request_id=None):
+        """Queue one bike; returns its job (the existing one if already in flight)."""
+        motorcycle_id = str(motorcycle_id)
+        with self._lock:
+            existing = self._in_flight.get(motorcycle_id)
+            if existing is not None:
+                job = self._jobs[existing]
+                if request_id is not None and request_id not in job["request_ids"]:
+                    job["request_ids"].append(request_id)
+                return dict(_snapshot(job), deduplicated=True)
+            if len(self._in_flight) >= self.max_queue:
+                raise QueueFull(f"Training queue is full ({self.max_queue} jobs)")
+
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                "job_id": job_id,
+                "motorcycle_id": motorcycle_id,
+                "brand": brand,
+                "minutes": int(minutes),
+                "status": "queued",
+                "stage": None,
+                "progress": 0.0,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "request_ids": [] if request_id is None else [request_id]
+            }
+            self._jobs[job_id] = job
+            self._in_flight[motorcycle_id] = job_id
+            self._trim_history()
+
+        try:
+            pool = self._ensure_pool()
+            try:
+                future = pool.submit(_run_job, job_id, motorcycle_id, brand, int(minutes))
+            except BrokenProcessPool:
+                # A worker died since the last job ended: retry once on a new pool
+                self._drop_pool(pool)
+                pool = self._ensure_pool()
+                future = pool.submit(_run_job, job_id, motorcycle_id, brand, int(minutes))
+        except Exception as e:
+            self._finish(job_id, error=str(e))
+            raise
+        future.add_done_callback(lambda f: self._done(job_id, pool, f))
+        print(f"[INFO] Training job {job_id} queued for motorcycle {motorcycle_id}")
+        with self._lock:
+            return _snapshot(job)
+
+    def submit_fleet(self, bikes, minutes=TRAIN_MINUTES, request_id=None):
+        """Queue many (motorcycle_id, brand) pairs; a full queue stops the rest."""
+        jobs, skipped = [], []
+        for motorcycle_id, brand in bikes:
+            try:
+                jobs.append(self.submit(motorcycle_id, brand, minutes, request_id))
+            except QueueFull as e:
+                skipped.append({"motorcycle_id": str(motorcycle_id), "error": str(e)})
+        return {"jobs": jobs, "skipped": skipped}
+
+    # ───── Completion ─────
+    def _done(self, job_id, pool, future):
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            self._drop_pool(pool)
+            self._finish(job_id, error=f"Training worker died: {e}")
+        except Exception as e:
+            self._finish(job_id, error=str(e))
+        else:
+            self._finish(job_id, result=result)
+
+    def _finish(self, job_id, result=None, error=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = "failed" if error else "succeeded"
+            job["result"] = result
+            job["error"] = error
+            job["finished_at"] = time.time()
+            if not error:
+                job["stage"], job["progress"] = "done", 1.0
+            if self._in_flight.get(job["motorcycle_id"]) == job_id:
+                del self._in_flight[job["motorcycle_id"]]
+            finished = _snapshot(job)
+        print(f"[INFO] Training job {job_id} {finished['status']}" + (f": {error}" if error else ""))
+        if self.on_finished:
+            try:
+                self.on_finished(finished)
+            except Exception as e:
+                print(f"[ERROR] Training completion hook failed: {e}")
+
+    def _trim_history(self):
+        finished = [j for j, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(self._jobs) - TRAIN_HISTORY)]:
+            del self._jobs[job_id]
+
+    # ───── Status ─────
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return _snapshot(job) if job else None
+
+    def for_motorcycle(self, motorcycle_id):
+        """The newest job of a bike, or None."""
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job["motorcycle_id"] == str(motorcycle_id):
+                    return _snapshot(job)
+        return None
+
+    def list(self, status=None):
+        with self._lock:
+            return [_snapshot(j) for j in self._jobs.values() if status is None or j["status"] == status]
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            in_flight = len(self._in_flight)
+        return {"workers": self.workers, "max_queue": self.max_queue,
+                "in_flight": in_flight, "by_status": counts, "pool_restarts": self.pool_restarts}
+
+
+def trained_bikes(base_dir="models", mode="idle"):
+    """(motorcycle_id, brand) of every bike that already has a model on disk."""
+    bikes = set()
+    for path in glob.glob(os.path.join(base_dir, "*", f"{mode}_*")):
+        name = os.path.basename(path)
+        for suffix in (".pkl", ".flat.joblib"):
+            if name.endswith(suffix):
+                bikes.add((name[len(mode) + 1:-len(suffix)], os.path.basename(os.path.dirname(path))))
+    return sorted(bikes)